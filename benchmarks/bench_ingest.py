@@ -0,0 +1,224 @@
+"""
+Offline benchmarks of the ingest hot paths (audio processing, face detection and DB).
+
+Usage (from the repo root):
+    python -m benchmarks.bench_ingest                          # Default cases
+    python -m benchmarks.bench_ingest --quick                  # Fewer iterations and sizes
+    python -m benchmarks.bench_ingest --full                   # Also the 1M rows DB
+    python -m benchmarks.bench_ingest --save-baseline          # Store the results as the baseline
+    python -m benchmarks.bench_ingest --baseline benchmarks/baseline.json --tolerance 0.2
+
+The exit code is 1 if some case is slower than the baseline p95 (+ tolerance).
+"""
+from benchmarks.fixtures import make_voice_note, make_photo, load_photos, seed_database
+from benchmarks.stats import percentile
+from data.database_handler import DatabaseHandler
+from utils.audio_utils import AudioUtils
+from utils.image_utils import ImageUtils
+import threading
+import tempfile
+import argparse
+import asyncio
+import psutil
+import shutil
+import json
+import time
+import os
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'baseline.json')
+
+class PeakRSS:
+    """Samples the process RSS in a background thread, to obtain the peak of a benchmark case."""
+    def __init__(self, interval:float=0.005):
+        self._interval = interval
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self.peak = 0
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._process.memory_info().rss)
+            self._stop.wait(self._interval)
+
+    def __enter__(self):
+        self.peak = self._process.memory_info().rss
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._process.memory_info().rss)
+
+def run_case(name:str, func, iterations:int, warmup:int=1) -> dict:
+    """Runs `func()` `iterations` times (after `warmup` runs) and summarizes its latency.
+
+    Returns:
+        dict: p50/p95/p99 latency (ms), throughput (ops/s) and peak RSS (MB).
+    """
+    for _ in range(warmup):
+        func()
+    latencies = []
+    with PeakRSS() as rss:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            t0 = time.perf_counter()
+            func()
+            latencies.append((time.perf_counter() - t0) * 1000)
+        total = time.perf_counter() - start
+    result = {
+        'iterations': iterations,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'throughput_ops': round(iterations / total, 2),
+        'peak_rss_mb': round(rss.peak / 2**20, 1),
+    }
+    print(f"{name:<40} p50 {result['p50_ms']:>9.2f}ms  p95 {result['p95_ms']:>9.2f}ms  "
+          f"p99 {result['p99_ms']:>9.2f}ms  {result['throughput_ops']:>9.2f} ops/s  {result['peak_rss_mb']:>7.1f}MB")
+    return result
+
+# =========================================================================================== CASES
+def audio_cases(work_dir:str, durations:list, iterations:int) -> dict:
+    results = {}
+    db = DatabaseHandler(os.path.join(work_dir, 'audio.db'))
+    db.create_tables()
+    au = AudioUtils(base_dir=work_dir, db=db)
+    loop = asyncio.new_event_loop()
+    for seconds in durations:
+        voice = bytearray(make_voice_note(seconds, seed=seconds))
+        results[f'audio.processAudio[{seconds}s]'] = run_case(
+            f'audio.processAudio[{seconds}s]',
+            lambda: loop.run_until_complete(au.processAudio(voice, user_id=seconds)),
+            iterations
+        )
+        results[f'audio.processAudio.streaming[{seconds}s]'] = run_case(
+            f'audio.processAudio.streaming[{seconds}s]',
+            lambda: loop.run_until_complete(au.processAudio(voice, user_id=seconds, streaming=True)),
+            iterations
+        )
+    loop.close()
+    return results
+
+def image_cases(work_dir:str, sizes:list, iterations:int, face_dir:str=None) -> dict:
+    results = {}
+    iu = ImageUtils(db=DatabaseHandler(os.path.join(work_dir, 'image.db')))
+    photos = {}
+    for width, height in sizes:
+        photos[f'{width}x{height},noise'] = make_photo(width, height, face=False, seed=width)
+        photos[f'{width}x{height},drawn_face'] = make_photo(width, height, face=True, seed=width)
+    if face_dir:
+        photos.update({f'{name},real': data for name, data in load_photos(face_dir).items()})
+
+    loop = asyncio.new_event_loop()
+    for label, data in photos.items():
+        img = bytearray(data)
+        results[f'image.processImage[{label}]'] = run_case(
+            f'image.processImage[{label}]',
+            lambda: loop.run_until_complete(iu.processImage(img)),
+            iterations
+        )
+        gray_img = iu.preprocessImage(iu.decodeImage(img))
+        results[f'image.hasFaces[{label}]'] = run_case(
+            f'image.hasFaces[{label}]',
+            lambda: iu.hasFaces(gray_img),
+            iterations
+        )
+    loop.close()
+    return results
+
+def db_cases(work_dir:str, row_counts:list, iterations:int) -> dict:
+    results = {}
+    for rows in row_counts:
+        print(f'Seeding a DB with {rows} audio rows...')
+        db = seed_database(os.path.join(work_dir, f'db_{rows}.db'), rows)
+        user_ids = iter(range(10**9))
+        results[f'db.postUserAudio[{rows} rows]'] = run_case(
+            f'db.postUserAudio[{rows} rows]',
+            lambda: db.postUserAudio(next(user_ids) % 1000),
+            iterations * 10
+        )
+        results[f'db.getUserAudioCount[{rows} rows]'] = run_case(
+            f'db.getUserAudioCount[{rows} rows]',
+            lambda: db.getUserAudioCount(next(user_ids) % 1000),
+            iterations * 10
+        )
+    DatabaseHandler.close_all()
+    return results
+
+# =========================================================================================== BASELINE
+def compare(results:dict, baseline:dict, tolerance:float) -> list:
+    """Compares the p95 of every case with the baseline one.
+
+    Returns:
+        list: Names of the cases slower than the baseline p95 * (1 + tolerance).
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        ratio = result['p95_ms'] / base['p95_ms'] if base['p95_ms'] > 0 else 1
+        status = 'REGRESSION' if ratio > 1 + tolerance else 'ok'
+        print(f"{name:<40} p95 {base['p95_ms']:>9.2f}ms -> {result['p95_ms']:>9.2f}ms  ({ratio:.2f}x)  {status}")
+        if status != 'ok':
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks of the ingest hot paths.')
+    parser.add_argument('--quick', action='store_true', help='Fewer iterations and sizes.')
+    parser.add_argument('--full', action='store_true', help='Also seed a 1M audio rows DB (slow).')
+    parser.add_argument('--iterations', type=int, default=None, help='Iterations per case.')
+    parser.add_argument('--only', choices=['audio', 'image', 'db'], action='append', help='Run only these groups.')
+    parser.add_argument('--face-dir', default=None, help='Folder with real .jpg photos with faces.')
+    parser.add_argument('--output', default=None, help='Write the results to this JSON file.')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='Baseline JSON to compare with.')
+    parser.add_argument('--save-baseline', action='store_true', help='Store the results as the new baseline.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed p95 slowdown (0.2 = 20%%).')
+    args = parser.parse_args()
+
+    iterations = args.iterations or (5 if args.quick else 20)
+    durations = [3, 30] if args.quick else [3, 30, 120]
+    sizes = [(320, 240), (1280, 960)] if args.quick else [(320, 240), (1280, 960), (2560, 1920)]
+    row_counts = [10_000] if args.quick else [10_000, 100_000]
+    if args.full:
+        row_counts.append(1_000_000)
+    groups = args.only or ['audio', 'image', 'db']
+
+    work_dir = tempfile.mkdtemp(prefix='bench_ingest_')
+    results = {}
+    try:
+        if 'audio' in groups:
+            results.update(audio_cases(work_dir, durations, iterations))
+        if 'image' in groups:
+            results.update(image_cases(work_dir, sizes, iterations, args.face_dir))
+        if 'db' in groups:
+            results.update(db_cases(work_dir, row_counts, iterations))
+    finally:
+        DatabaseHandler.close_all()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print(f'Baseline saved in {args.baseline}')
+        return 0
+
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        print(f'\nComparing with {args.baseline}')
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f'{len(regressions)} regression(s) found')
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,122 @@
+"""
+Startup time benchmark: every run starts the bot in a fresh Python process (against
+the local fake Bot API server) and measures, from the process start:
+    - import_main_s: `import main`.
+    - polling_s: the bot is initialized and polling.
+    - media_ready_s: the media utils are loaded and the workers warmed up.
+    - first_reply_s: the answer to a photo sent right when the polling starts.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_startup --runs 5
+    python -m benchmarks.bench_startup --runs 5 --no-warmup     # MEDIA_WARMUP=0
+"""
+import time
+START = time.perf_counter()
+
+from benchmarks.fake_bot_api import FakeBotAPI
+import subprocess
+import statistics
+import tempfile
+import argparse
+import asyncio
+import shutil
+import json
+import sys
+import os
+
+async def child_run(photo_path:str) -> dict:
+    """Measures a single bot startup, in this (fresh) process."""
+    work_dir = tempfile.mkdtemp(prefix='bench_startup_')
+    os.chdir(work_dir)
+    os.environ['DB_PATH'] = os.path.join(work_dir, 'data', 'db', 'database_prod.db')
+    results = {}
+    server = FakeBotAPI()
+    server.start()
+    with open(photo_path, 'rb') as photo_file:
+        server.add_file('photo_0', photo_file.read())
+    replied = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    def on_message(chat_id:int, text:str):
+        results['first_reply_s'] = time.perf_counter() - START
+        loop.call_soon_threadsafe(replied.set)
+    server.on_message = on_message
+
+    try:
+        import main
+        results['import_main_s'] = time.perf_counter() - START
+        main.IMAGE_DATA_PATH = os.path.join(work_dir, 'data', 'image_data') + '/'
+        from data.database_handler import DatabaseHandler
+        DatabaseHandler().create_tables()
+
+        app = main.build_application('123456:FAKE', server.base_url, server.base_file_url)
+        async with app:
+            await main.post_init(app)
+            await app.start()
+            await app.updater.start_polling(poll_interval=0, timeout=10, allowed_updates=main.ALLOWED_UPDATES)
+            results['polling_s'] = time.perf_counter() - START
+
+            server.push_update({'message': {
+                'message_id': 1, 'date': int(time.time()),
+                'chat': {'id': 1, 'type': 'private'},
+                'from': {'id': 1, 'is_bot': False, 'first_name': 'user_1'},
+                'photo': [{'file_id': 'photo_0', 'file_unique_id': 'photo_0', 'width': 1280, 'height': 960}],
+            }})
+            warmup = app.bot_data.get('media_warmup')
+            if warmup is not None:
+                await warmup
+            else:
+                await main.media_ready(app)
+            results['media_ready_s'] = time.perf_counter() - START
+            await asyncio.wait_for(replied.wait(), timeout=120)
+
+            await app.updater.stop()
+            await app.stop()
+            await main.post_shutdown(app)
+    finally:
+        server.stop()
+        os.chdir('/')
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {name: round(seconds, 4) for name, seconds in results.items()}
+
+def run_child(photo_path:str, warmup:bool) -> dict:
+    env = dict(os.environ, MEDIA_WARMUP='1' if warmup else '0', PYTHONPATH=os.getcwd())
+    process = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.bench_startup', '--child', photo_path],
+        env=env, capture_output=True, text=True, check=True
+    )
+    # The bot prints its logs, the results are the last line
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='Bot startup time benchmark.')
+    parser.add_argument('--runs', type=int, default=5, help='Number of bot startups.')
+    parser.add_argument('--no-warmup', action='store_true', help='Load the media utils on the first update (MEDIA_WARMUP=0).')
+    parser.add_argument('--output', default=None, help='Write the results to this JSON file.')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(child_run(args.child))))
+        return 0
+
+    from benchmarks.fixtures import make_photo
+    fd, photo_path = tempfile.mkstemp(suffix='.jpg')
+    with os.fdopen(fd, 'wb') as photo_file:
+        photo_file.write(make_photo(1280, 960, seed=0))
+    try:
+        runs = [run_child(photo_path, warmup=not args.no_warmup) for _ in range(args.runs)]
+    finally:
+        os.remove(photo_path)
+
+    results = {}
+    for name in runs[0]:
+        values = [run[name] for run in runs]
+        results[name] = {'median': round(statistics.median(values), 4), 'max': round(max(values), 4)}
+        print(f"{name:<16} median {results[name]['median']:>8.3f}s  max {results[name]['max']:>8.3f}s")
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,154 @@
+"""
+Local stand-in for the Telegram Bot API, to run the real bot offline (no token needed).
+
+It implements the endpoints the bot uses: getMe, deleteWebhook, getUpdates (long polling),
+getFile, the files download and sendMessage. Any other method answers `true`.
+
+    server = FakeBotAPI()
+    server.start()
+    app = build_application('123:FAKE', server.base_url, server.base_file_url)
+    server.add_file('voice_1', ogg_bytes)
+    server.push_update({...})
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qsl
+import threading
+import json
+import time
+
+class FakeBotAPI:
+    """Bot API server, running in a background thread."""
+    def __init__(self, host:str='127.0.0.1', port:int=0):
+        self._updates = []
+        self._next_update_id = 1
+        self._files = {}
+        self._sent = []
+        self._next_message_id = 1
+        self._condition = threading.Condition()
+        # Called with every sent message, e.g. to measure the reply latency
+        self.on_message = None
+
+        api = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                api._handle(self)
+
+            def do_POST(self):
+                api._handle(self)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    # =========================================================================================== LIFE CYCLE
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/bot'
+
+    @property
+    def base_file_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/file/bot'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._condition.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+
+    # =========================================================================================== TEST DATA
+    def add_file(self, file_id:str, data:bytes, file_unique_id:str=None):
+        """Makes `data` downloadable as the file `file_id`."""
+        self._files[file_id] = (file_unique_id or file_id, data)
+
+    def push_update(self, update:dict) -> int:
+        """Queues an update (without `update_id`) for the next getUpdates, returns its id."""
+        with self._condition:
+            update_id = self._next_update_id
+            self._next_update_id += 1
+            self._updates.append(dict(update, update_id=update_id))
+            self._condition.notify_all()
+        return update_id
+
+    @property
+    def sent_messages(self) -> list:
+        """Messages sent by the bot, as the sendMessage parameters."""
+        return list(self._sent)
+
+    # =========================================================================================== API
+    def _handle(self, request):
+        url = urlparse(request.path)
+        parts = url.path.strip('/').split('/')
+        if parts[0] == 'file':
+            # /file/bot<token>/<file_path>
+            return self._download(request, '/'.join(parts[2:]))
+
+        params = dict(parse_qsl(url.query))
+        length = int(request.headers.get('Content-Length') or 0)
+        body = request.rfile.read(length) if length else b''
+        content_type = request.headers.get('Content-Type', '')
+        if body and 'json' in content_type:
+            params.update(json.loads(body))
+        elif body:
+            params.update(parse_qsl(body.decode()))
+
+        method = parts[-1]
+        handler = getattr(self, f'_api_{method}', None)
+        result = handler(params) if handler else True
+        self._reply(request, 200, json.dumps({'ok': True, 'result': result}).encode(), 'application/json')
+
+    def _reply(self, request, status:int, body:bytes, content_type:str):
+        request.send_response(status)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def _download(self, request, file_path:str):
+        entry = self._files.get(file_path)
+        if entry is None:
+            return self._reply(request, 404, b'Not Found', 'text/plain')
+        self._reply(request, 200, entry[1], 'application/octet-stream')
+
+    def _api_getMe(self, params:dict) -> dict:
+        return {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot',
+                'can_join_groups': True, 'can_read_all_group_messages': False, 'supports_inline_queries': False}
+
+    def _api_getUpdates(self, params:dict) -> list:
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            # Updates before the offset were confirmed by the bot
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                self._condition.wait(deadline - time.monotonic())
+            return self._updates[:limit]
+
+    def _api_getFile(self, params:dict) -> dict:
+        file_id = params['file_id']
+        file_unique_id, data = self._files.get(file_id, (file_id, b''))
+        return {'file_id': file_id, 'file_unique_id': file_unique_id, 'file_size': len(data), 'file_path': file_id}
+
+    def _api_sendMessage(self, params:dict) -> dict:
+        chat_id = int(params['chat_id'])
+        with self._condition:
+            message_id = self._next_message_id
+            self._next_message_id += 1
+            self._sent.append(params)
+        if self.on_message is not None:
+            self.on_message(chat_id, params.get('text'))
+        return {'message_id': message_id, 'date': int(time.time()), 'text': params.get('text'),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': {'id': 1, 'is_bot': True, 'first_name': 'FakeBot'}}
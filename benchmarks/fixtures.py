@@ -0,0 +1,127 @@
+from data.database_handler import DatabaseHandler
+import soundfile as sf
+import numpy as np
+import sqlite3
+import uuid
+import cv2
+import io
+import os
+
+# Telegram voice notes are OGG/Opus at 48kHz mono
+VOICE_SAMPLING_RATE = 48000
+
+def make_voice_note(seconds:float, seed:int=0) -> bytes:
+    """Generates an OGG/Opus voice note with a speech-like signal (a few harmonics
+    with a slow amplitude modulation plus some noise).
+
+    Args:
+        seconds (float): Voice note duration.
+        seed (int, optional): Random seed, the same seed gives the same audio. Defaults to 0.
+
+    Returns:
+        bytes: The encoded OGG/Opus file.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * VOICE_SAMPLING_RATE)) / VOICE_SAMPLING_RATE
+    pitch = 120 + 30 * np.sin(2 * np.pi * 0.5 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / VOICE_SAMPLING_RATE
+    wave = sum(np.sin(k * phase) / k for k in range(1, 6))
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t)
+    wave = 0.2 * envelope * wave + 0.01 * rng.standard_normal(len(t))
+
+    buffer = io.BytesIO()
+    sf.write(buffer, wave.astype(np.float32), VOICE_SAMPLING_RATE, format='OGG', subtype='OPUS')
+    return buffer.getvalue()
+
+def make_photo(width:int, height:int, face:bool=False, seed:int=0, quality:int=87) -> bytes:
+    """Generates a JPEG photo, a smooth random background with some shapes.
+
+    Args:
+        width (int): Image width.
+        height (int): Image height.
+        face (bool, optional): Draw a face-like figure (head, eyes, mouth) in the center.
+            NOTE: It's a drawing, the detector can still miss it, use real photos
+            (see `load_photos`) when the detection result matters. Defaults to False.
+        seed (int, optional): Random seed. Defaults to 0.
+        quality (int, optional): JPEG quality, Telegram uses ~87. Defaults to 87.
+
+    Returns:
+        bytes: The encoded JPEG file.
+    """
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 255, (max(2, height // 32), max(2, width // 32), 3), dtype=np.uint8)
+    img = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    for _ in range(10):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.circle(img, center, int(rng.integers(5, max(6, min(width, height) // 6))), color, -1)
+
+    if face:
+        cx, cy, r = width // 2, height // 2, min(width, height) // 5
+        cv2.ellipse(img, (cx, cy), (r, int(r * 1.3)), 0, 0, 360, (140, 170, 210), -1)
+        for ex in (cx - r // 2, cx + r // 2):
+            cv2.ellipse(img, (ex, cy - r // 3), (r // 5, r // 8), 0, 0, 360, (40, 30, 30), -1)
+        cv2.ellipse(img, (cx, cy + r // 2), (r // 2, r // 6), 0, 0, 180, (60, 40, 120), -1)
+
+    ok, jpeg = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return jpeg.tobytes()
+
+def resize_photo(jpeg:bytes, width:int, height:int, quality:int=87) -> bytes:
+    """Downscales a JPEG photo, e.g. to make the smaller sizes Telegram sends with every photo.
+
+    Returns:
+        bytes: The encoded JPEG file.
+    """
+    img = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+    img = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+    ok, resized = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return resized.tobytes()
+
+def load_photos(folder:str) -> dict:
+    """Loads the .jpg photos of a folder (e.g. real photos with faces).
+
+    Returns:
+        dict: {file name: bytes}
+    """
+    photos = {}
+    for filename in sorted(os.listdir(folder)):
+        if filename.lower().endswith(('.jpg', '.jpeg')):
+            with open(os.path.join(folder, filename), 'rb') as photo_file:
+                photos[filename] = photo_file.read()
+    return photos
+
+def seed_database(db_path:str, audio_rows:int, users:int=1000, batch_size:int=50000) -> DatabaseHandler:
+    """Creates a DB with the production schema and `audio_rows` audios spread over `users` users.
+
+    NOTE: The rows are bulk inserted with a plain connection (much faster than
+    `postUserAudio`), then the user counters are set as the migration does.
+
+    Args:
+        db_path (str): Path of the new DB, it must not exist.
+        audio_rows (int): Number of Audios rows.
+        users (int, optional): Number of users. Defaults to 1000.
+        batch_size (int, optional): Rows per executemany. Defaults to 50000.
+
+    Returns:
+        DatabaseHandler: Handler of the seeded DB.
+    """
+    DatabaseHandler(db_path).create_tables()
+
+    db_conn = sqlite3.connect(db_path)
+    with db_conn:
+        db_conn.executemany("INSERT OR IGNORE INTO Users (u_id) VALUES (?)", ((u,) for u in range(users)))
+    next_audio = [0] * users
+    for start in range(0, audio_rows, batch_size):
+        rows = []
+        for i in range(start, min(start + batch_size, audio_rows)):
+            user_id = i % users
+            a_msg_name = f'audio_message_{next_audio[user_id]}'
+            next_audio[user_id] += 1
+            rows.append((str(uuid.uuid4()), a_msg_name, f'/data/{user_id}/audio_data/{a_msg_name}.wav', user_id))
+        with db_conn:
+            db_conn.executemany("INSERT INTO Audios (a_id, a_name, a_path, u_id) VALUES (?,?,?,?)", rows)
+    with db_conn:
+        db_conn.executemany("UPDATE Users SET u_next_audio = ? WHERE u_id = ?",
+                            ((count, user_id) for user_id, count in enumerate(next_audio)))
+    db_conn.close()
+    return DatabaseHandler(db_path)
@@ -0,0 +1,203 @@
+"""
+End-to-end load generator: runs the real bot (main.py handlers) against the local
+fake Bot API server and replays simulated voice and photo updates.
+
+Usage (from the repo root):
+    python -m benchmarks.load_driver --updates 1000 --users 50 --rate 100
+    python -m benchmarks.load_driver --updates 500 --voice-ratio 0.3 --photo-size 1280x960 --media-pool 500
+
+It reports the update-to-reply latency (p50/p95/p99), the processed updates per second,
+the time until the queued audio jobs are processed and the time spent in every stage of
+the pipeline (p95 approximated by the histogram buckets).
+NOTE: The bot runs in a temporary folder (DB, audios and images), the repo data is not touched.
+"""
+from benchmarks.fixtures import make_voice_note, make_photo, resize_photo
+from benchmarks.fake_bot_api import FakeBotAPI
+from benchmarks.stats import percentile
+from collections import defaultdict, deque, Counter
+import threading
+import tempfile
+import argparse
+import asyncio
+import random
+import shutil
+import time
+import json
+import os
+
+def parse_size(size:str) -> tuple:
+    width, height = size.lower().split('x')
+    return int(width), int(height)
+
+def build_media_pool(server:FakeBotAPI, args) -> tuple:
+    """Generates the voice notes and photos the simulated users send, and uploads them to the server.
+
+    Returns:
+        tuple: (voices, photos), lists of dicts with the Telegram media objects.
+    """
+    rng = random.Random(args.seed)
+    voices, photos = [], []
+    for i in range(args.media_pool):
+        seconds = rng.choice(args.voice_seconds)
+        data = make_voice_note(seconds, seed=i)
+        server.add_file(f'voice_{i}', data)
+        voices.append({'file_id': f'voice_{i}', 'file_unique_id': f'voice_{i}', 'duration': seconds,
+                       'mime_type': 'audio/ogg', 'file_size': len(data)})
+
+        width, height = parse_size(rng.choice(args.photo_size))
+        photo = make_photo(width, height, face=rng.random() < args.face_ratio, seed=i)
+        sizes = []
+        # Telegram sends several sizes of every photo (the same photo downscaled), the biggest is the last one
+        for scale, suffix in ((0.25, 's'), (0.5, 'm'), (1, 'x')):
+            w, h = max(1, int(width * scale)), max(1, int(height * scale))
+            data = photo if scale == 1 else resize_photo(photo, w, h)
+            server.add_file(f'photo_{i}_{suffix}', data)
+            sizes.append({'file_id': f'photo_{i}_{suffix}', 'file_unique_id': f'photo_{i}_{suffix}',
+                          'width': w, 'height': h, 'file_size': len(data)})
+        photos.append(sizes)
+    return voices, photos
+
+async def run_load(args) -> dict:
+    work_dir = tempfile.mkdtemp(prefix='load_driver_')
+    os.chdir(work_dir)
+    os.environ['DB_PATH'] = os.path.join(work_dir, 'data', 'db', 'database_prod.db')
+    # Every simulated user sends a lot of media, the per user limit is off unless it's asked
+    os.environ['ADMISSION_USER_RATE'] = str(args.user_rate)
+
+    # Imported here, once the environment of the temporary bot is ready
+    import main
+    main.IMAGE_DATA_PATH = os.path.join(work_dir, 'data', 'image_data') + '/'
+    from data.database_handler import DatabaseHandler
+    from utils.audio_utils import AudioUtils
+    from utils.metrics import METRICS
+    METRICS.reset()
+
+    server = FakeBotAPI()
+    server.start()
+    print(f'Generating {args.media_pool} voice notes and photos...')
+    voices, photos = build_media_pool(server, args)
+
+    lock = threading.Lock()
+    pending = defaultdict(deque)
+    latencies = []
+    replies = Counter()
+    loop = asyncio.get_running_loop()
+    all_replied = asyncio.Event()
+
+    def on_message(chat_id:int, text:str):
+        # Called from the server threads: every update gets exactly one reply, in order per chat
+        with lock:
+            if pending[chat_id]:
+                latencies.append(time.perf_counter() - pending[chat_id].popleft())
+            replies[text] += 1
+            if len(latencies) >= args.updates:
+                loop.call_soon_threadsafe(all_replied.set)
+    server.on_message = on_message
+
+    DatabaseHandler().create_tables()
+    app = main.build_application('123456:FAKE', server.base_url, server.base_file_url)
+    rng = random.Random(args.seed)
+    try:
+        async with app:
+            await main.post_init(app)
+            await main.media_ready(app)
+            app.bot_data['audio_utils'] = AudioUtils(base_dir=work_dir, db=app.bot_data['db'])
+            await app.start()
+            await app.updater.start_polling(poll_interval=0, timeout=10, allowed_updates=main.ALLOWED_UPDATES)
+
+            print(f'Sending {args.updates} updates from {args.users} users...')
+            start = time.perf_counter()
+            for i in range(args.updates):
+                user_id = 1000 + rng.randrange(args.users)
+                message = {
+                    'message_id': i + 1,
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': {'id': user_id, 'is_bot': False, 'first_name': f'user_{user_id}'},
+                }
+                if rng.random() < args.voice_ratio:
+                    message['voice'] = rng.choice(voices)
+                else:
+                    message['photo'] = rng.choice(photos)
+                with lock:
+                    pending[user_id].append(time.perf_counter())
+                server.push_update({'message': message})
+                if args.rate > 0:
+                    # Poisson arrivals
+                    await asyncio.sleep(rng.expovariate(args.rate))
+
+            try:
+                await asyncio.wait_for(all_replied.wait(), timeout=args.timeout)
+            except asyncio.TimeoutError:
+                print(f'Timeout: {len(latencies)}/{args.updates} updates answered')
+            elapsed = time.perf_counter() - start
+
+            # The audios are answered once queued, wait until they are processed
+            job_queue = app.bot_data['job_queue']
+            deadline = time.perf_counter() + args.timeout
+            while time.perf_counter() < deadline:
+                job_counts = job_queue.counts()
+                if not job_counts.get('pending') and not job_counts.get('running'):
+                    break
+                await asyncio.sleep(0.05)
+            drained = time.perf_counter() - start
+            metrics = METRICS.snapshot()
+
+            await app.updater.stop()
+            await app.stop()
+            await main.post_shutdown(app)
+    finally:
+        server.stop()
+        os.chdir('/')
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    latencies_ms = [latency * 1000 for latency in latencies]
+    return {
+        'updates': args.updates,
+        'answered': len(latencies),
+        'elapsed_s': round(elapsed, 3),
+        'updates_per_s': round(len(latencies) / elapsed, 2) if elapsed > 0 else 0,
+        'latency_p50_ms': round(percentile(latencies_ms, 50), 2),
+        'latency_p95_ms': round(percentile(latencies_ms, 95), 2),
+        'latency_p99_ms': round(percentile(latencies_ms, 99), 2),
+        'latency_max_ms': round(max(latencies_ms, default=0), 2),
+        'jobs_drained_s': round(drained, 3),
+        'jobs': job_counts,
+        'replies': dict(replies),
+        # Where the time goes, see utils/metrics.py
+        'stages_ms': {
+            ':'.join(str(v) for v in histogram['labels'].values()): {
+                'count': histogram['count'],
+                'avg': round(histogram['avg'] * 1000, 2),
+                'p95': round(histogram['p95'] * 1000, 2),
+            }
+            for histogram in metrics['histograms'] if histogram['name'] == 'stage_duration_seconds'
+        },
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end load generator for the bot.')
+    parser.add_argument('--updates', type=int, default=200, help='Number of updates to send.')
+    parser.add_argument('--users', type=int, default=20, help='Number of simulated users.')
+    parser.add_argument('--rate', type=float, default=50, help='Updates per second (0 = all at once).')
+    parser.add_argument('--voice-ratio', type=float, default=0.5, help='Fraction of voice notes, the rest are photos.')
+    parser.add_argument('--voice-seconds', type=int, nargs='+', default=[3, 10, 30], help='Voice note durations.')
+    parser.add_argument('--photo-size', nargs='+', default=['1280x960'], help='Photo sizes, e.g. 1280x960.')
+    parser.add_argument('--face-ratio', type=float, default=0.3, help='Fraction of photos with a drawn face.')
+    parser.add_argument('--media-pool', type=int, default=50,
+                        help='Distinct media files, reused (as forwards) when there are more updates.')
+    parser.add_argument('--user-rate', type=float, default=0, help='Admission limit, media per minute per user (0 = no limit).')
+    parser.add_argument('--timeout', type=float, default=300, help='Max seconds to wait for the replies.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+    parser.add_argument('--output', default=None, help='Write the results to this JSON file.')
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    results = asyncio.run(run_load(args))
+    print(json.dumps(results, indent=2))
+    if output:
+        with open(output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+if __name__ == '__main__':
+    main()
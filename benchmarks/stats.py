@@ -0,0 +1,10 @@
+import math
+
+def percentile(values:list, pct:float) -> float:
+    """Nearest-rank percentile of the given values (the smallest value with at least
+    `pct`% of the values less or equal to it), 0.0 if there are no values."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered) - 1, math.ceil(pct * len(ordered) / 100) - 1))
+    return ordered[index]
@@ -1,12 +1,167 @@
+from concurrent.futures import ThreadPoolExecutor
+from utils.metrics import METRICS
+from utils.cache_utils import TTLCache
+import threading
 import sqlite3
+import time
+import asyncio
+import queue
+import json
 import uuid
+import os
+import re
+
+DB_PROD_PATH = './data/db/database_prod.db'
+# Audio storage formats (Audios.a_format) and their file extension
+AUDIO_FORMAT_EXTENSIONS = {
+    'wav24': '.wav',        # 16kHz 24-bit PCM WAV (default)
+    'wav16': '.wav',        # 16kHz 16-bit PCM WAV
+    'flac': '.flac',        # 16kHz 24-bit FLAC, lossless
+    'opus': '.ogg',         # Original OGG/Opus voice note (passthrough)
+}
+IMAGE_DATA_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'image_data')
+# Seconds the stats reads are cached (see the STATS section of DatabaseHandler), 0 = no cache
+STATS_CACHE_TTL = float(os.getenv('DB_STATS_CACHE_TTL', 10))
+
+class ConnectionPool:
+    """
+        Persistent connections to a SQLite database, shared by all the DatabaseHandler
+        instances pointing to the same file.
+
+        - All the writes go through a single dedicated writer thread and connection, so
+          they are serialized without "database is locked" errors.
+        - Reads use a small pool of read-only connections, which in WAL mode never
+          block (nor are blocked by) the writer.
+    """
+    def __init__(self, db_path:str, readers:int=None):
+        self._db_path = db_path
+        self._readers_size = readers or int(os.getenv('DB_READERS', 4))
+        self._writer_conn = None
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._writer_thread = None
+        self._readers = queue.LifoQueue()
+        self._readers_created = 0
+        self._readers_lock = threading.Lock()
+        # Create the writer connection (and the WAL journal) inside the writer thread
+        self._writer.submit(self._open_writer).result()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Opens a new connection with the tuned pragmas."""
+        # NOTE: cached_statements keeps the compiled SQL statements of every connection,
+        # since the connections are persistent, the same queries are never prepared twice.
+        db_conn = sqlite3.connect(self._db_path, check_same_thread=False, timeout=30, cached_statements=256)
+        # Commits only need to wait for the WAL write, not for a full fsync of the DB
+        db_conn.execute("PRAGMA synchronous = NORMAL")
+        # ~16MB of page cache per connection (negative values are KiB)
+        db_conn.execute("PRAGMA cache_size = -16000")
+        db_conn.execute("PRAGMA temp_store = MEMORY")
+        db_conn.execute("PRAGMA busy_timeout = 30000")
+        return db_conn
+
+    def _open_writer(self):
+        os.makedirs(os.path.dirname(self._db_path) or '.', exist_ok=True)
+        self._writer_conn = self._connect()
+        # The WAL mode is persistent in the database file, readers and the writer can work concurrently
+        self._writer_conn.execute("PRAGMA journal_mode = WAL")
+        self._writer_thread = threading.current_thread()
+
+    @staticmethod
+    def _run(mode:str, func, db_conn:sqlite3.Connection, *args):
+        """Runs `func(db_conn, *args)` recording its duration and errors in the metrics."""
+        operation = func.__name__.strip('_')
+        start = time.perf_counter()
+        try:
+            return func(db_conn, *args)
+        except sqlite3.Error:
+            METRICS.inc('db_errors_total', mode=mode, operation=operation)
+            raise
+        finally:
+            METRICS.observe('db_duration_seconds', time.perf_counter() - start, mode=mode, operation=operation)
+
+    # =========================================================================================== WRITES
+    def write(self, func, *args):
+        """Runs `func(db_conn, *args)` in the writer thread and returns its result (blocking)."""
+        if threading.current_thread() is self._writer_thread:
+            # Already in the writer thread (e.g. a write calling another write)
+            return self._run('write', func, self._writer_conn, *args)
+        return self._writer.submit(self._run, 'write', func, self._writer_conn, *args).result()
+
+    async def write_async(self, func, *args):
+        """Awaitable version of `write`, the event loop is not blocked while waiting."""
+        return await asyncio.wrap_future(self._writer.submit(self._run, 'write', func, self._writer_conn, *args))
+
+    # =========================================================================================== READS
+    def _acquire_reader(self) -> sqlite3.Connection:
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._readers_lock:
+            if self._readers_created < self._readers_size:
+                self._readers_created += 1
+                db_conn = self._connect()
+                db_conn.execute("PRAGMA query_only = ON")
+                return db_conn
+        # All the readers are in use, wait for one
+        return self._readers.get()
+
+    def read(self, func, *args):
+        """Runs `func(db_conn, *args)` with a pooled read-only connection (blocking)."""
+        db_conn = self._acquire_reader()
+        try:
+            return self._run('read', func, db_conn, *args)
+        finally:
+            # Never leave a read transaction open, it would keep old WAL pages alive
+            if db_conn.in_transaction:
+                db_conn.rollback()
+            self._readers.put(db_conn)
+
+    async def read_async(self, func, *args):
+        """Awaitable version of `read`, the event loop is not blocked while waiting."""
+        return await asyncio.to_thread(self.read, func, *args)
+
+    # =========================================================================================== CLOSE
+    def close(self):
+        """Closes all the connections and stops the writer thread."""
+        def _close_writer():
+            if self._writer_conn is not None:
+                self._writer_conn.close()
+                self._writer_conn = None
+        self._writer.submit(_close_writer).result()
+        self._writer.shutdown(wait=True)
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
 
 class DatabaseHandler:
     """
         Set of database functions to handle all its life cicle with sqlite3
     """
-    def __init__(self):
-        self._db_prod_path = './data/db/database_prod.db'
+    _pools = {}
+    _caches = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, db_path:str=None):
+        self._db_prod_path = db_path or os.getenv('DB_PATH', DB_PROD_PATH)
+        # All the handlers of the same DB share the same connections (created only once) and stats cache
+        with DatabaseHandler._pools_lock:
+            pool = DatabaseHandler._pools.get(self._db_prod_path)
+            if pool is None:
+                pool = DatabaseHandler._pools[self._db_prod_path] = ConnectionPool(self._db_prod_path)
+                DatabaseHandler._caches[self._db_prod_path] = TTLCache(STATS_CACHE_TTL)
+        self._pool = pool
+        self._cache = DatabaseHandler._caches[self._db_prod_path]
+
+    @classmethod
+    def close_all(cls):
+        """Closes the connections of all the databases, call it on shutdown."""
+        with cls._pools_lock:
+            for pool in cls._pools.values():
+                pool.close()
+            cls._pools.clear()
+            cls._caches.clear()
 
     def generate_uuid(self):
         """ Generates new UUID so can be used as ID en some table """
@@ -14,135 +169,1276 @@ class DatabaseHandler:
 
     # =========================================================================================== CREATE
     def create_tables(self):
-        """ 
+        """
         This command creates a production DB if this does not exist
         """
         try:
-            with sqlite3.connect(self._db_prod_path) as db_conn:
-                cursor = db_conn.cursor()
-
-                # Create the table for Users
-                # NOTE: Created with the intention to add some user information
-                # in the future while processing audio messages or, creating 
-                # other user related tables (e.g. Images table). To avoid 
-                # overloading the Audio table
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS Users (
-                        u_id INTEGER PRIMARY KEY NOT NULL,
-                        u_joined DATETIME DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-
-                # Create the table for audio messages
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS Audios (
-                        a_id CHAR(36) PRIMARY KEY NOT NULL,
-                        a_name VARCHAR,
-                        a_path VARCHAR,
-                        a_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                        u_id INTEGER,
-                        FOREIGN KEY (u_id) REFERENCES Users (u_id) ON DELETE SET NULL
-                    )
-                """)
-                db_conn.commit()
+            self._pool.write(self._create_tables)
 
         except sqlite3.Error as e:
             print(f"Error creating tables: {e}")
 
+    def _create_tables(self, db_conn:sqlite3.Connection):
+        with db_conn:
+            cursor = db_conn.cursor()
+
+            # Create the table for Users
+            # NOTE: Created with the intention to add some user information
+            # in the future while processing audio messages or, creating
+            # other user related tables (e.g. Images table). To avoid
+            # overloading the Audio table
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS Users (
+                    u_id INTEGER PRIMARY KEY NOT NULL,
+                    u_joined DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # Create the table for audio messages
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS Audios (
+                    a_id CHAR(36) PRIMARY KEY NOT NULL,
+                    a_name VARCHAR,
+                    a_path VARCHAR,
+                    a_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    u_id INTEGER,
+                    FOREIGN KEY (u_id) REFERENCES Users (u_id) ON DELETE SET NULL
+                )
+            """)
+
+        # Bring the schema up to date (also the DBs created before the migrations existed)
+        self._migrate(db_conn)
+
+    # =========================================================================================== MIGRATIONS
+    def _migrations(self) -> list:
+        """Ordered schema migrations, the DB `user_version` is the number of applied ones.
+        NOTE: Only append new migrations at the end of the list, never reorder them.
+        """
+        return [
+            self._migration_user_audio_counter,
+            self._migration_images_table,
+            self._migration_media_cache,
+            self._migration_audio_format,
+            self._migration_jobs,
+            self._migration_stats,
+        ]
+
+    def _migrate(self, db_conn:sqlite3.Connection):
+        """Applies the pending migrations, each one in its own transaction."""
+        version = db_conn.execute("PRAGMA user_version").fetchone()[0]
+        for target_version, migration in enumerate(self._migrations(), start=1):
+            if version >= target_version:
+                continue
+            with db_conn:
+                db_conn.execute("BEGIN")
+                migration(db_conn)
+                db_conn.execute(f"PRAGMA user_version = {target_version}")
+            print(f"Database migrated to version {target_version}: {migration.__name__}")
+
+    def _migration_user_audio_counter(self, db_conn:sqlite3.Connection):
+        """Per-user counter with the next audio N, so the audio names don't need a COUNT(*)."""
+        db_conn.execute("ALTER TABLE Users ADD COLUMN u_next_audio INTEGER NOT NULL DEFAULT 0")
+        # Backfill from the existing audios, continuing after the highest "audio_message_N" 
+        # (not the count) so an existing file is never overwritten.
+        db_conn.execute("""
+            UPDATE Users SET u_next_audio = (
+                SELECT COALESCE(MAX(CAST(SUBSTR(a_name, LENGTH('audio_message_') + 1) AS INTEGER)) + 1, 0)
+                FROM Audios WHERE Audios.u_id = Users.u_id
+            )
+        """)
+        db_conn.execute("CREATE INDEX IF NOT EXISTS idx_audios_user_timestamp ON Audios (u_id, a_timestamp)")
+
+    def _migration_images_table(self, db_conn:sqlite3.Connection):
+        """Images table, with a global sequence for the "image_N" names."""
+        db_conn.execute("""
+            CREATE TABLE IF NOT EXISTS Images (
+                i_id CHAR(36) PRIMARY KEY NOT NULL,
+                i_name VARCHAR,
+                i_path VARCHAR,
+                i_width INTEGER,
+                i_height INTEGER,
+                i_faces TEXT,
+                i_hash CHAR(64),
+                i_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                u_id INTEGER,
+                FOREIGN KEY (u_id) REFERENCES Users (u_id) ON DELETE SET NULL
+            )
+        """)
+        db_conn.execute("CREATE INDEX IF NOT EXISTS idx_images_user_timestamp ON Images (u_id, i_timestamp)")
+        db_conn.execute("CREATE INDEX IF NOT EXISTS idx_images_hash ON Images (i_hash)")
+
+        # Named counters, allocated in the same transaction as the row that uses them
+        db_conn.execute("""
+            CREATE TABLE IF NOT EXISTS Sequences (
+                s_name VARCHAR PRIMARY KEY NOT NULL,
+                s_next INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        # NOTE: Before this table the image names came from the files in the image_data folder,
+        # so the folder is scanned this one time to continue after the last stored image.
+        next_image = 0
+        if os.path.isdir(IMAGE_DATA_DIR):
+            for filename in os.listdir(IMAGE_DATA_DIR):
+                match = re.fullmatch(r'image_(\d+)\.jpg', filename)
+                if match:
+                    next_image = max(next_image, int(match.group(1)) + 1)
+        db_conn.execute("INSERT OR IGNORE INTO Sequences (s_name, s_next) VALUES ('images', ?)", (next_image,))
+
+    def _migration_media_cache(self, db_conn:sqlite3.Connection):
+        """Dedup index of the already processed media, by Telegram `file_unique_id` and by content hash."""
+        db_conn.execute("""
+            CREATE TABLE IF NOT EXISTS MediaCache (
+                m_unique_id VARCHAR PRIMARY KEY NOT NULL,
+                m_kind VARCHAR NOT NULL,
+                m_hash CHAR(64),
+                m_path VARCHAR,
+                m_name VARCHAR,
+                m_faces TEXT,
+                m_width INTEGER,
+                m_height INTEGER,
+                m_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        db_conn.execute("CREATE INDEX IF NOT EXISTS idx_mediacache_kind_hash ON MediaCache (m_kind, m_hash)")
+
+    def _migration_audio_format(self, db_conn:sqlite3.Connection):
+        """Storage format of every audio (see AUDIO_FORMAT_EXTENSIONS), the existing ones are 24-bit WAV."""
+        db_conn.execute("ALTER TABLE Audios ADD COLUMN a_format TEXT NOT NULL DEFAULT 'wav24'")
+
+    def _migration_jobs(self, db_conn:sqlite3.Connection):
+        """Durable media jobs queue (see data/job_queue.py), and the job that created every audio."""
+        db_conn.execute("""
+            CREATE TABLE IF NOT EXISTS Jobs (
+                j_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                j_key VARCHAR NOT NULL UNIQUE,
+                j_kind VARCHAR NOT NULL,
+                j_user INTEGER,
+                j_payload TEXT,
+                j_status VARCHAR NOT NULL DEFAULT 'pending',
+                j_attempts INTEGER NOT NULL DEFAULT 0,
+                j_run_after REAL NOT NULL DEFAULT 0,
+                j_error TEXT,
+                j_created DATETIME DEFAULT CURRENT_TIMESTAMP,
+                j_updated DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        db_conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON Jobs (j_status, j_id)")
+        db_conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user_status ON Jobs (j_user, j_status, j_id)")
+        db_conn.execute("ALTER TABLE Audios ADD COLUMN a_job VARCHAR")
+        db_conn.execute("CREATE INDEX IF NOT EXISTS idx_audios_job ON Audios (a_job) WHERE a_job IS NOT NULL")
+
+    def _migration_stats(self, db_conn:sqlite3.Connection):
+        """Per-user, global and hourly counters kept up to date by triggers, so the stats never 
+        need a COUNT(*) of the Audios or Images."""
+        db_conn.execute("ALTER TABLE Users ADD COLUMN u_audio_count INTEGER NOT NULL DEFAULT 0")
+        db_conn.execute("ALTER TABLE Users ADD COLUMN u_image_count INTEGER NOT NULL DEFAULT 0")
+        db_conn.execute("ALTER TABLE Users ADD COLUMN u_last_activity DATETIME")
+        db_conn.execute("""
+            UPDATE Users SET
+                u_audio_count = (SELECT COUNT(*) FROM Audios WHERE Audios.u_id = Users.u_id),
+                u_image_count = (SELECT COUNT(*) FROM Images WHERE Images.u_id = Users.u_id),
+                u_last_activity = NULLIF(MAX(
+                    COALESCE((SELECT MAX(a_timestamp) FROM Audios WHERE Audios.u_id = Users.u_id), ''),
+                    COALESCE((SELECT MAX(i_timestamp) FROM Images WHERE Images.u_id = Users.u_id), '')
+                ), '')
+        """)
+        db_conn.execute("""
+            CREATE TABLE IF NOT EXISTS Counters (
+                c_name VARCHAR PRIMARY KEY NOT NULL,
+                c_value INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        db_conn.execute("""
+            INSERT OR REPLACE INTO Counters (c_name, c_value) VALUES
+                ('users', (SELECT COUNT(*) FROM Users)),
+                ('audios', (SELECT COUNT(*) FROM Audios)),
+                ('images', (SELECT COUNT(*) FROM Images))
+        """)
+        # Audios and images received per hour ('YYYY-MM-DD HH:00:00', UTC)
+        db_conn.execute("""
+            CREATE TABLE IF NOT EXISTS ActivityHours (
+                h_hour DATETIME PRIMARY KEY NOT NULL,
+                h_audios INTEGER NOT NULL DEFAULT 0,
+                h_images INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        db_conn.execute("""
+            INSERT INTO ActivityHours (h_hour, h_audios)
+            SELECT STRFTIME('%Y-%m-%d %H:00:00', a_timestamp), COUNT(*) FROM Audios 
+            WHERE a_timestamp IS NOT NULL GROUP BY 1
+        """)
+        db_conn.execute("""
+            INSERT INTO ActivityHours (h_hour, h_images)
+            SELECT STRFTIME('%Y-%m-%d %H:00:00', i_timestamp), COUNT(*) FROM Images 
+            WHERE i_timestamp IS NOT NULL GROUP BY 1
+            ON CONFLICT (h_hour) DO UPDATE SET h_images = excluded.h_images
+        """)
+        # NOTE: The triggers run inside the writer's transactions, in the same commit as the row
+        for table, counter in (('Users', 'users'), ('Audios', 'audios'), ('Images', 'images')):
+            db_conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{counter}_count_insert AFTER INSERT ON {table} BEGIN
+                    UPDATE Counters SET c_value = c_value + 1 WHERE c_name = '{counter}';
+                END
+            """)
+            db_conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{counter}_count_delete AFTER DELETE ON {table} BEGIN
+                    UPDATE Counters SET c_value = c_value - 1 WHERE c_name = '{counter}';
+                END
+            """)
+        for table, prefix, column, hour_column in (('Audios', 'a', 'u_audio_count', 'h_audios'),
+                                                   ('Images', 'i', 'u_image_count', 'h_images')):
+            db_conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table.lower()}_user_insert AFTER INSERT ON {table} BEGIN
+                    UPDATE Users SET {column} = {column} + 1,
+                        u_last_activity = MAX(COALESCE(u_last_activity, ''), NEW.{prefix}_timestamp)
+                    WHERE u_id = NEW.u_id;
+                    INSERT INTO ActivityHours (h_hour, {hour_column})
+                    VALUES (STRFTIME('%Y-%m-%d %H:00:00', NEW.{prefix}_timestamp), 1)
+                    ON CONFLICT (h_hour) DO UPDATE SET {hour_column} = {hour_column} + 1;
+                END
+            """)
+            db_conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table.lower()}_user_delete AFTER DELETE ON {table} BEGIN
+                    UPDATE Users SET {column} = {column} - 1 WHERE u_id = OLD.u_id;
+                    UPDATE ActivityHours SET {hour_column} = {hour_column} - 1
+                    WHERE h_hour = STRFTIME('%Y-%m-%d %H:00:00', OLD.{prefix}_timestamp);
+                END
+            """)
+        # Covering index of the active users count, it never reads the Users rows
+        db_conn.execute("CREATE INDEX IF NOT EXISTS idx_users_last_activity ON Users (u_last_activity)")
+
     def postNewUser(self, user_id:int):
         """
         Create new user with the given user_id in the DB if this does not exist
-        
+
         Args:
             user_id (int): The user ID which is also the Telegram UID.
         """
         try:
-            with sqlite3.connect(self._db_prod_path) as db_conn:
-                cursor = db_conn.cursor()
-                cursor.execute("INSERT OR IGNORE INTO Users (u_id) VALUES (?)", (user_id,))
-                db_conn.commit()
+            self._pool.write(self._insert_user, user_id)
 
         except sqlite3.Error as e:
             print(f"Error inserting user: {e}")
 
-    def postUserAudio(self, user_id:int) -> str:
+    async def postNewUserAsync(self, user_id:int):
+        """Awaitable version of `postNewUser`."""
+        try:
+            await self._pool.write_async(self._insert_user, user_id)
+
+        except sqlite3.Error as e:
+            print(f"Error inserting user: {e}")
+
+    def _insert_user(self, db_conn:sqlite3.Connection, user_id:int):
+        with db_conn:
+            db_conn.execute("INSERT OR IGNORE INTO Users (u_id) VALUES (?)", (user_id,))
+
+    def postUserAudio(self, user_id:int, audio_format:str='wav24', job_key:str=None) -> str:
         """
         Posts a new audio message for a specified user into the database.
 
         This function generates a unique audio message ID (`a_id`) and determines the
-        next sequential audio message name (`a_name`) based on the current audio count
-        associated with the given user ID (`user_id`). The audio message is inserted
-        into the 'Audios' table in the database.
+        next sequential audio message name (`a_name`) from the user's audio counter
+        (`Users.u_next_audio`), which is incremented in the same transaction as the 
+        insert into the 'Audios' table, so two concurrent audios never get the same N.
 
         Args:
             user_id (int): The user ID associated with the audio message.
+            audio_format (str, optional): Storage format of the audio file, see 
+                AUDIO_FORMAT_EXTENSIONS. Defaults to 'wav24'.
+            job_key (str, optional): Key of the job storing the audio (see data/job_queue.py),
+                so a retried job finds the audio it already stored.
 
         Returns:
             str: The name of the newly created audio message (`a_name`). If error, returns 'NULL'
-        
+
         Note:
             Because this function uses an SQLite database to store and manage audio data
             locally (not in the cloud), it determines the next sequential ID for audio
             messages within the database. This approach ensures each audio message is
-            uniquely identified and ordered chronologically within the database, also ensures 
-            scalability because in scenarios with a large number of audio files, directly 
+            uniquely identified and ordered chronologically within the database, also ensures
+            scalability because in scenarios with a large number of audio files, directly
             counting files in the folder (the other approach) could be inefficient and time-consuming.
         """
-        # Create the user if this does not exist
-        self.postNewUser(user_id=user_id)
-        # Obtain the user Audio count
-        next_audio_id = self.getUserAudioCount(user_id=user_id)
+        try:
+            return self._pool.write(self._insert_user_audio, user_id, audio_format, job_key)
 
-        # Abort execution in case of DB fault
-        if next_audio_id == -1:
+        except sqlite3.Error as e:
+            # Log: Error inserting audio
+            print(f"Error inserting audio: {e}")
+            # We shouldn't save the audio file if we don't have its record in the DB
             return 'NULL'
 
-        # Create the new audio message name
-        a_msg_name = f'audio_message_{next_audio_id}'
-        # Obtain new Audio Path
-        a_path = f'/data/{user_id}/audio_data/{a_msg_name}.wav'
-        # Obtain new Audio UID
-        a_id = self.generate_uuid()
-
-        # Add new Audio record into DB: (a_id, a_name, a_path, a_timestamp, u_id -> User)
+    async def postUserAudioAsync(self, user_id:int, audio_format:str='wav24', job_key:str=None) -> str:
+        """Awaitable version of `postUserAudio`."""
         try:
-            with sqlite3.connect(self._db_prod_path) as db_conn:
-                cursor = db_conn.cursor()
-                cursor.execute("""
-                    INSERT OR IGNORE INTO Audios (a_id, a_name, a_path, u_id)
-                    VALUES (?,?,?,?)
-                """, (a_id, a_msg_name, a_path, user_id))
-                db_conn.commit()
-        
+            return await self._pool.write_async(self._insert_user_audio, user_id, audio_format, job_key)
+
         except sqlite3.Error as e:
             # Log: Error inserting audio
             print(f"Error inserting audio: {e}")
             # We shouldn't save the audio file if we don't have its record in the DB
             return 'NULL'
 
+    def _insert_user_audio(self, db_conn:sqlite3.Connection, user_id:int, audio_format:str='wav24', job_key:str=None) -> str:
+        # NOTE: Runs in the writer thread, so the user creation, the count and
+        # the insert are done in a single transaction (one commit, one fsync).
+        with db_conn:
+            cursor = db_conn.cursor()
+            # Create the user if this does not exist
+            cursor.execute("INSERT OR IGNORE INTO Users (u_id) VALUES (?)", (user_id,))
+            # Allocate the next user Audio N, O(1) no matter how many audios are stored
+            cursor.execute("UPDATE Users SET u_next_audio = u_next_audio + 1 WHERE u_id = ?", (user_id,))
+            cursor.execute("SELECT u_next_audio - 1 FROM Users WHERE u_id = ?", (user_id,))
+            next_audio_id = cursor.fetchone()[0]
+
+            # Create the new audio message name
+            a_msg_name = f'audio_message_{next_audio_id}'
+            # Obtain new Audio Path
+            a_path = f'/data/{user_id}/audio_data/{a_msg_name}{AUDIO_FORMAT_EXTENSIONS[audio_format]}'
+            # Obtain new Audio UID
+            a_id = self.generate_uuid()
+
+            # Add new Audio record into DB: (a_id, a_name, a_path, a_timestamp, u_id -> User, a_format, a_job)
+            cursor.execute("""
+                INSERT OR IGNORE INTO Audios (a_id, a_name, a_path, u_id, a_format, a_job)
+                VALUES (?,?,?,?,?,?)
+            """, (a_id, a_msg_name, a_path, user_id, audio_format, job_key))
+
+        self._invalidate_stats(user_id)
         return a_msg_name
-    
+
+    def deleteUserAudio(self, user_id:int, audio_name:str) -> bool:
+        """
+        Removes the user's audio record, e.g. when its file could not be written.
+        NOTE: The user's audio counter is not decremented, its audio N is never reused.
+
+        Returns:
+            bool: True if the audio was removed, False otherwise.
+        """
+        try:
+            return self._pool.write(self._delete_user_audio, user_id, audio_name)
+
+        except sqlite3.Error as e:
+            # Log: Error removing audio
+            print(f"Error removing audio: {e}")
+            return False
+
+    async def deleteUserAudioAsync(self, user_id:int, audio_name:str) -> bool:
+        """Awaitable version of `deleteUserAudio`."""
+        try:
+            return await self._pool.write_async(self._delete_user_audio, user_id, audio_name)
+
+        except sqlite3.Error as e:
+            # Log: Error removing audio
+            print(f"Error removing audio: {e}")
+            return False
+
+    def _delete_user_audio(self, db_conn:sqlite3.Connection, user_id:int, audio_name:str) -> bool:
+        with db_conn:
+            cursor = db_conn.execute("DELETE FROM Audios WHERE u_id = ? AND a_name = ?", (user_id, audio_name))
+        self._invalidate_stats(user_id)
+        return cursor.rowcount > 0
+
+    def getAudiosToConvert(self, audio_format:str, after_rowid:int=0, limit:int=500) -> list:
+        """
+        Returns a page of the audios not stored in the given format, ordered by rowid
+        (keyset pagination, pass the last returned rowid as `after_rowid`).
+
+        Args:
+            audio_format (str): Target storage format, see AUDIO_FORMAT_EXTENSIONS.
+            after_rowid (int, optional): Return the audios after this rowid. Defaults to 0.
+            limit (int, optional): Max number of audios. Defaults to 500.
+
+        Returns:
+            list: Dicts with the rowid, a_id, a_name, a_format and u_id of every audio, [] on error.
+        """
+        try:
+            return self._pool.read(self._select_audios_to_convert, audio_format, after_rowid, limit)
+
+        except sqlite3.Error as e:
+            # Log: Error reading audios
+            print(f"Error reading audios: {e}")
+            return []
+
+    def _select_audios_to_convert(self, db_conn:sqlite3.Connection, audio_format:str, after_rowid:int, limit:int) -> list:
+        cursor = db_conn.execute("""
+            SELECT rowid, a_id, a_name, a_format, u_id FROM Audios
+            WHERE rowid > ? AND a_format != ?
+            ORDER BY rowid LIMIT ?
+        """, (after_rowid, audio_format, limit))
+        columns = ('rowid', 'a_id', 'a_name', 'a_format', 'u_id')
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def updateAudioFormat(self, a_id:str, audio_format:str) -> bool:
+        """
+        Records that the audio file was converted to another storage format.
+
+        Args:
+            a_id (str): The audio ID.
+            audio_format (str): New storage format, see AUDIO_FORMAT_EXTENSIONS.
+
+        Returns:
+            bool: True if the audio was updated, False otherwise.
+        """
+        try:
+            return self._pool.write(self._update_audio_format, a_id, audio_format)
+
+        except sqlite3.Error as e:
+            # Log: Error updating audio
+            print(f"Error updating audio format: {e}")
+            return False
+
+    def _update_audio_format(self, db_conn:sqlite3.Connection, a_id:str, audio_format:str) -> bool:
+        extension = AUDIO_FORMAT_EXTENSIONS[audio_format]
+        with db_conn:
+            # Same path as `postUserAudio`, with the extension of the new format
+            cursor = db_conn.execute("""
+                UPDATE Audios SET a_format = ?, a_path = '/data/' || u_id || '/audio_data/' || a_name || ?
+                WHERE a_id = ?
+            """, (audio_format, extension, a_id))
+        return cursor.rowcount > 0
+
+    def postUserImage(self, user_id:int, width:int, height:int, faces:list, content_hash:str) -> str:
+        """
+        Posts a new image, sent by the given user, into the database.
+
+        The image name (`image_N`) comes from the 'images' sequence, incremented in the 
+        same transaction as the insert, so two concurrent images never get the same N 
+        and the cost does not depend on how many images are stored.
+
+        Args:
+            user_id (int): The user ID who sent the image.
+            width (int): Original image width.
+            height (int): Original image height.
+            faces (list): Detected face boxes (x, y, w, h).
+            content_hash (str): SHA-256 of the image bytes.
+
+        Returns:
+            str: The name of the newly created image (`i_name`). If error, returns 'NULL'
+        """
+        try:
+            return self._pool.write(self._insert_user_image, user_id, width, height, faces, content_hash)
+
+        except sqlite3.Error as e:
+            # Log: Error inserting image
+            print(f"Error inserting image: {e}")
+            # We shouldn't save the image file if we don't have its record in the DB
+            return 'NULL'
+
+    async def postUserImageAsync(self, user_id:int, width:int, height:int, faces:list, content_hash:str) -> str:
+        """Awaitable version of `postUserImage`."""
+        try:
+            return await self._pool.write_async(self._insert_user_image, user_id, width, height, faces, content_hash)
+
+        except sqlite3.Error as e:
+            # Log: Error inserting image
+            print(f"Error inserting image: {e}")
+            # We shouldn't save the image file if we don't have its record in the DB
+            return 'NULL'
+
+    def _insert_user_image(self, db_conn:sqlite3.Connection, user_id:int, width:int, height:int, 
+                           faces:list, content_hash:str) -> str:
+        with db_conn:
+            cursor = db_conn.cursor()
+            # Create the user if this does not exist
+            cursor.execute("INSERT OR IGNORE INTO Users (u_id) VALUES (?)", (user_id,))
+            # Allocate the next image N
+            cursor.execute("UPDATE Sequences SET s_next = s_next + 1 WHERE s_name = 'images'")
+            cursor.execute("SELECT s_next - 1 FROM Sequences WHERE s_name = 'images'")
+            next_image_id = cursor.fetchone()[0]
+
+            i_name = f'image_{next_image_id}'
+            i_path = f'/data/image_data/{i_name}.jpg'
+            i_id = self.generate_uuid()
+
+            # Add new Image record into DB: (i_id, i_name, i_path, i_width, i_height, i_faces, i_hash, i_timestamp, u_id -> User)
+            cursor.execute("""
+                INSERT INTO Images (i_id, i_name, i_path, i_width, i_height, i_faces, i_hash, u_id)
+                VALUES (?,?,?,?,?,?,?,?)
+            """, (i_id, i_name, i_path, width, height, json.dumps([list(face) for face in faces]), content_hash, user_id))
+
+        self._invalidate_stats(user_id)
+        return i_name
+
+    def linkUserImage(self, user_id:int, image_name:str) -> str:
+        """
+        Links an already stored image to the given user (e.g. a forwarded photo), 
+        inserting a new Images record that points to the same file.
+
+        Args:
+            user_id (int): The user ID who sent the image again.
+            image_name (str): The stored image name (`i_name`).
+
+        Returns:
+            str: The linked image name. If error (or there is no such image), returns 'NULL'
+        """
+        try:
+            return self._pool.write(self._link_user_image, user_id, image_name)
+
+        except sqlite3.Error as e:
+            # Log: Error linking image
+            print(f"Error linking image: {e}")
+            return 'NULL'
+
+    async def linkUserImageAsync(self, user_id:int, image_name:str) -> str:
+        """Awaitable version of `linkUserImage`."""
+        try:
+            return await self._pool.write_async(self._link_user_image, user_id, image_name)
+
+        except sqlite3.Error as e:
+            # Log: Error linking image
+            print(f"Error linking image: {e}")
+            return 'NULL'
+
+    def _link_user_image(self, db_conn:sqlite3.Connection, user_id:int, image_name:str) -> str:
+        with db_conn:
+            cursor = db_conn.cursor()
+            cursor.execute("INSERT OR IGNORE INTO Users (u_id) VALUES (?)", (user_id,))
+            cursor.execute("""
+                INSERT INTO Images (i_id, i_name, i_path, i_width, i_height, i_faces, i_hash, u_id)
+                SELECT ?, i_name, i_path, i_width, i_height, i_faces, i_hash, ?
+                FROM Images WHERE i_name = ? LIMIT 1
+            """, (self.generate_uuid(), user_id, image_name))
+            if cursor.rowcount == 0:
+                return 'NULL'
+        self._invalidate_stats(user_id)
+        return image_name
+
+    def deleteUserImage(self, user_id:int, image_name:str) -> bool:
+        """
+        Removes the user's image record, e.g. when its file could not be written.
+        NOTE: The image N is not reused, the images sequence is not decremented.
+
+        Returns:
+            bool: True if the image was removed, False otherwise.
+        """
+        try:
+            return self._pool.write(self._delete_user_image, user_id, image_name)
+
+        except sqlite3.Error as e:
+            # Log: Error removing image
+            print(f"Error removing image: {e}")
+            return False
+
+    async def deleteUserImageAsync(self, user_id:int, image_name:str) -> bool:
+        """Awaitable version of `deleteUserImage`."""
+        try:
+            return await self._pool.write_async(self._delete_user_image, user_id, image_name)
+
+        except sqlite3.Error as e:
+            # Log: Error removing image
+            print(f"Error removing image: {e}")
+            return False
+
+    def _delete_user_image(self, db_conn:sqlite3.Connection, user_id:int, image_name:str) -> bool:
+        with db_conn:
+            cursor = db_conn.execute("DELETE FROM Images WHERE u_id = ? AND i_name = ?", (user_id, image_name))
+        self._invalidate_stats(user_id)
+        return cursor.rowcount > 0
+
+    # =========================================================================================== DEDUP INDEX
+    def postMediaCache(self, kind:str, unique_id:str, content_hash:str, path:str=None, name:str=None,
+                       faces:list=None, width:int=None, height:int=None) -> bool:
+        """
+        Records an already processed media in the dedup index.
+
+        Args:
+            kind (str): 'audio' or 'image'.
+            unique_id (str): Telegram `file_unique_id`, stable for the same file.
+            content_hash (str): SHA-256 of the downloaded bytes, None if it was not downloaded
+                (e.g. a photo rejected by its preview).
+            path (str, optional): Stored file path, None if it was not stored (e.g. image without faces).
+            name (str, optional): Stored record name (`a_name` / `i_name`).
+            faces (list, optional): Images only, the detected face boxes.
+            width (int, optional): Images only, original width.
+            height (int, optional): Images only, original height.
+
+        Returns:
+            bool: True if recorded, False otherwise.
+        """
+        try:
+            self._pool.write(self._insert_media_cache, kind, unique_id, content_hash, path, name, faces, width, height)
+            return True
+
+        except sqlite3.Error as e:
+            print(f"Error inserting media cache: {e}")
+            return False
+
+    async def postMediaCacheAsync(self, kind:str, unique_id:str, content_hash:str, path:str=None, name:str=None,
+                                  faces:list=None, width:int=None, height:int=None) -> bool:
+        """Awaitable version of `postMediaCache`."""
+        try:
+            await self._pool.write_async(self._insert_media_cache, kind, unique_id, content_hash, path, name, faces, width, height)
+            return True
+
+        except sqlite3.Error as e:
+            print(f"Error inserting media cache: {e}")
+            return False
+
+    def _insert_media_cache(self, db_conn:sqlite3.Connection, kind:str, unique_id:str, content_hash:str,
+                            path:str, name:str, faces:list, width:int, height:int):
+        faces = json.dumps([list(face) for face in faces]) if faces is not None else None
+        with db_conn:
+            db_conn.execute("""
+                INSERT OR REPLACE INTO MediaCache (m_unique_id, m_kind, m_hash, m_path, m_name, m_faces, m_width, m_height)
+                VALUES (?,?,?,?,?,?,?,?)
+            """, (unique_id, kind, content_hash, path, name, faces, width, height))
+
+    def getMediaCache(self, kind:str, unique_id:str=None, content_hash:str=None) -> dict:
+        """
+        Search an already processed media in the dedup index, by `unique_id` or by `content_hash`.
+
+        Args:
+            kind (str): 'audio' or 'image'.
+            unique_id (str, optional): Telegram `file_unique_id`.
+            content_hash (str, optional): SHA-256 of the downloaded bytes.
+
+        Returns:
+            dict: The cached media (see `postMediaCache` for the keys), None if not found or error.
+        """
+        try:
+            return self._pool.read(self._select_media_cache, kind, unique_id, content_hash)
+
+        except sqlite3.Error as e:
+            print(f"Error reading media cache: {e}")
+            return None
+
+    async def getMediaCacheAsync(self, kind:str, unique_id:str=None, content_hash:str=None) -> dict:
+        """Awaitable version of `getMediaCache`."""
+        try:
+            return await self._pool.read_async(self._select_media_cache, kind, unique_id, content_hash)
+
+        except sqlite3.Error as e:
+            print(f"Error reading media cache: {e}")
+            return None
+
+    def _select_media_cache(self, db_conn:sqlite3.Connection, kind:str, unique_id:str, content_hash:str) -> dict:
+        columns = "m_unique_id, m_hash, m_path, m_name, m_faces, m_width, m_height"
+        if unique_id is not None:
+            cursor = db_conn.execute(f"SELECT {columns} FROM MediaCache WHERE m_unique_id = ? AND m_kind = ?", (unique_id, kind))
+        else:
+            cursor = db_conn.execute(f"SELECT {columns} FROM MediaCache WHERE m_kind = ? AND m_hash = ? LIMIT 1", (kind, content_hash))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return {
+            'kind': kind,
+            'unique_id': row[0],
+            'content_hash': row[1],
+            'path': row[2],
+            'name': row[3],
+            'faces': [tuple(face) for face in json.loads(row[4])] if row[4] is not None else None,
+            'width': row[5],
+            'height': row[6],
+        }
+
+    # =========================================================================================== JOB QUEUE
+    def postJob(self, kind:str, key:str, user_id:int, payload:dict) -> int:
+        """
+        Adds a new pending job to the queue, unless there is already a job with the same key.
+
+        Args:
+            kind (str): Job kind, e.g. 'audio'.
+            key (str): Idempotency key (e.g. 'audio:<chat_id>:<message_id>'), the same 
+                update delivered twice by Telegram is queued only once.
+            user_id (int): The user the job belongs to, its jobs are run one after the other.
+            payload (dict): JSON serializable job data.
+
+        Returns:
+            int: The new job ID, 0 if the job was already queued, -1 on error.
+        """
+        try:
+            return self._pool.write(self._insert_job, kind, key, user_id, payload)
+
+        except sqlite3.Error as e:
+            # Log: Error inserting job
+            print(f"Error inserting job: {e}")
+            return -1
+
+    async def postJobAsync(self, kind:str, key:str, user_id:int, payload:dict) -> int:
+        """Awaitable version of `postJob`."""
+        try:
+            return await self._pool.write_async(self._insert_job, kind, key, user_id, payload)
+
+        except sqlite3.Error as e:
+            # Log: Error inserting job
+            print(f"Error inserting job: {e}")
+            return -1
+
+    def _insert_job(self, db_conn:sqlite3.Connection, kind:str, key:str, user_id:int, payload:dict) -> int:
+        with db_conn:
+            cursor = db_conn.execute("""
+                INSERT OR IGNORE INTO Jobs (j_key, j_kind, j_user, j_payload) VALUES (?,?,?,?)
+            """, (key, kind, user_id, json.dumps(payload)))
+        return cursor.lastrowid if cursor.rowcount > 0 else 0
+
+    async def claimJobAsync(self, now:float) -> dict:
+        """
+        Takes the next job to run and marks it as running: the oldest pending job (due 
+        at `now`) of a user without other running jobs, so the jobs of the same user 
+        are run one after the other and in order.
+
+        Args:
+            now (float): Current UNIX time, the jobs waiting for a retry after it are skipped.
+
+        Returns:
+            dict: The job (id, key, kind, user_id, payload, attempts), None if there is 
+                no job to run (or on error).
+        """
+        try:
+            return await self._pool.write_async(self._claim_job, now)
+
+        except sqlite3.Error as e:
+            # Log: Error claiming job
+            print(f"Error claiming job: {e}")
+            return None
+
+    def _claim_job(self, db_conn:sqlite3.Connection, now:float) -> dict:
+        # NOTE: Runs in the writer thread, two workers never claim the same job
+        with db_conn:
+            row = db_conn.execute("""
+                SELECT j_id, j_key, j_kind, j_user, j_payload, j_attempts FROM Jobs AS j
+                WHERE j_status = 'pending'
+                    AND NOT EXISTS (SELECT 1 FROM Jobs WHERE j_user = j.j_user AND j_status = 'running')
+                    AND NOT EXISTS (SELECT 1 FROM Jobs WHERE j_user = j.j_user AND j_status = 'pending' AND j_id < j.j_id)
+                    AND j_run_after <= ?
+                ORDER BY j_id LIMIT 1
+            """, (now,)).fetchone()
+            if row is None:
+                return None
+            db_conn.execute("""
+                UPDATE Jobs SET j_status = 'running', j_attempts = j_attempts + 1, j_updated = CURRENT_TIMESTAMP
+                WHERE j_id = ?
+            """, (row[0],))
+        return {
+            'id': row[0], 'key': row[1], 'kind': row[2], 'user_id': row[3],
+            'payload': json.loads(row[4]) if row[4] else {}, 'attempts': row[5] + 1,
+        }
+
+    async def updateJobAsync(self, job_id:int, status:str, error:str=None, run_after:float=0) -> bool:
+        """
+        Records the result of a job run.
+
+        Args:
+            job_id (int): The job ID.
+            status (str): 'done', 'failed', or 'pending' to retry it.
+            error (str, optional): Error of the last run.
+            run_after (float, optional): UNIX time of the retry (pending jobs).
+
+        Returns:
+            bool: True if the job was updated, False otherwise.
+        """
+        try:
+            return await self._pool.write_async(self._update_job, job_id, status, error, run_after)
+
+        except sqlite3.Error as e:
+            # Log: Error updating job
+            print(f"Error updating job: {e}")
+            return False
+
+    def _update_job(self, db_conn:sqlite3.Connection, job_id:int, status:str, error:str, run_after:float) -> bool:
+        with db_conn:
+            cursor = db_conn.execute("""
+                UPDATE Jobs SET j_status = ?, j_error = ?, j_run_after = ?, j_updated = CURRENT_TIMESTAMP
+                WHERE j_id = ?
+            """, (status, error, run_after, job_id))
+        return cursor.rowcount > 0
+
+    def resetRunningJobs(self) -> int:
+        """
+        Puts back in the queue the jobs that were running when the bot stopped (or crashed).
+        Call it at startup, before running any job.
+
+        Returns:
+            int: Number of jobs put back in the queue, -1 on error.
+        """
+        try:
+            return self._pool.write(self._reset_running_jobs)
+
+        except sqlite3.Error as e:
+            # Log: Error resetting jobs
+            print(f"Error resetting jobs: {e}")
+            return -1
+
+    def _reset_running_jobs(self, db_conn:sqlite3.Connection) -> int:
+        with db_conn:
+            cursor = db_conn.execute("""
+                UPDATE Jobs SET j_status = 'pending', j_run_after = 0, j_updated = CURRENT_TIMESTAMP
+                WHERE j_status = 'running'
+            """)
+        return cursor.rowcount
+
+    def deleteFinishedJobs(self, days:float) -> int:
+        """
+        Removes the finished (done or failed) jobs older than the given days. Their keys 
+        are not checked anymore, Telegram never delivers an update again after a few hours.
+
+        Returns:
+            int: Number of removed jobs, -1 on error.
+        """
+        try:
+            return self._pool.write(self._delete_finished_jobs, days)
+
+        except sqlite3.Error as e:
+            # Log: Error removing jobs
+            print(f"Error removing jobs: {e}")
+            return -1
+
+    def _delete_finished_jobs(self, db_conn:sqlite3.Connection, days:float) -> int:
+        with db_conn:
+            cursor = db_conn.execute("""
+                DELETE FROM Jobs WHERE j_status IN ('done', 'failed') AND j_updated < DATETIME('now', ?)
+            """, (f'-{days} days',))
+        return cursor.rowcount
+
+    def getJobCounts(self) -> dict:
+        """
+        Returns the number of jobs by status, e.g. {'pending': 3, 'running': 1, 'done': 120}.
+        An empty dict on error.
+        """
+        try:
+            return self._pool.read(self._count_jobs)
+
+        except sqlite3.Error as e:
+            # Log: Error counting jobs
+            print(f"Error counting jobs: {e}")
+            return {}
+
+    def _count_jobs(self, db_conn:sqlite3.Connection) -> dict:
+        return dict(db_conn.execute("SELECT j_status, COUNT(*) FROM Jobs GROUP BY j_status").fetchall())
+
+    async def countPendingJobsAsync(self) -> int:
+        """
+        Returns the number of pending jobs (index-only count, it grows with the backlog, 
+        not with the finished jobs). -1 on error.
+        """
+        try:
+            return await self._pool.read_async(self._count_pending_jobs)
+
+        except sqlite3.Error as e:
+            # Log: Error counting jobs
+            print(f"Error counting jobs: {e}")
+            return -1
+
+    def _count_pending_jobs(self, db_conn:sqlite3.Connection) -> int:
+        return db_conn.execute("SELECT COUNT(*) FROM Jobs WHERE j_status = 'pending'").fetchone()[0]
+
+    def getUnfinishedJobs(self) -> dict:
+        """
+        Returns what the unfinished (pending or running) jobs could have left behind after a
+        crash: their users and the audios they stored. Call it at startup, before running any job.
+
+        Returns:
+            dict: 'users' (list of user IDs) and 'audios' (a_id, a_name, a_format and u_id of 
+                every audio), empty lists on error.
+        """
+        try:
+            return self._pool.read(self._select_unfinished_jobs)
+
+        except sqlite3.Error as e:
+            # Log: Error reading jobs
+            print(f"Error reading unfinished jobs: {e}")
+            return {'users': [], 'audios': []}
+
+    def _select_unfinished_jobs(self, db_conn:sqlite3.Connection) -> dict:
+        users = db_conn.execute("""
+            SELECT DISTINCT j_user FROM Jobs WHERE j_status IN ('pending', 'running') AND j_user IS NOT NULL
+        """).fetchall()
+        audios = db_conn.execute("""
+            SELECT a.a_id, a.a_name, a.a_format, a.u_id FROM Jobs AS j JOIN Audios AS a ON a.a_job = j.j_key
+            WHERE j.j_status IN ('pending', 'running')
+        """).fetchall()
+        return {
+            'users': [row[0] for row in users],
+            'audios': [dict(zip(('a_id', 'a_name', 'a_format', 'u_id'), row)) for row in audios],
+        }
+
+    async def getAudioByJobAsync(self, job_key:str) -> dict:
+        """
+        Returns the audio stored by the given job (see `postUserAudio`), if any.
+
+        Returns:
+            dict: a_id, a_name, a_format and u_id of the audio, None if there is none (or on error).
+        """
+        try:
+            return await self._pool.read_async(self._select_audio_by_job, job_key)
+
+        except sqlite3.Error as e:
+            # Log: Error reading audio
+            print(f"Error reading audio: {e}")
+            return None
+
+    def _select_audio_by_job(self, db_conn:sqlite3.Connection, job_key:str) -> dict:
+        row = db_conn.execute("SELECT a_id, a_name, a_format, u_id FROM Audios WHERE a_job = ? LIMIT 1", (job_key,)).fetchone()
+        return dict(zip(('a_id', 'a_name', 'a_format', 'u_id'), row)) if row is not None else None
+
+    def deleteAudio(self, a_id:str) -> bool:
+        """
+        Removes an audio record, e.g. when its file was never written (see `reconcile_audios`).
+        NOTE: The user's audio counter is not decremented, its audio N is never reused.
+
+        Returns:
+            bool: True if the audio was removed, False otherwise.
+        """
+        try:
+            return self._pool.write(self._delete_audio, a_id)
+
+        except sqlite3.Error as e:
+            # Log: Error removing audio
+            print(f"Error removing audio: {e}")
+            return False
+
+    async def deleteAudioAsync(self, a_id:str) -> bool:
+        """Awaitable version of `deleteAudio`."""
+        try:
+            return await self._pool.write_async(self._delete_audio, a_id)
+
+        except sqlite3.Error as e:
+            # Log: Error removing audio
+            print(f"Error removing audio: {e}")
+            return False
+
+    def _delete_audio(self, db_conn:sqlite3.Connection, a_id:str) -> bool:
+        with db_conn:
+            cursor = db_conn.execute("DELETE FROM Audios WHERE a_id = ?", (a_id,))
+        # NOTE: The owner is not known here, deletes are rare (startup recovery)
+        self._cache.clear()
+        return cursor.rowcount > 0
+
+    # =========================================================================================== BULK READS
+    def iterAudios(self, user_ids:list=None, since:str=None, until:str=None, after_rowid:int=0, batch_size:int=1000):
+        """
+        Yields the Audios rows in insertion (rowid) order, read page by page with the 
+        read-only connections, so any number of rows can be walked with bounded memory.
+
+        Args:
+            user_ids (list, optional): Only the audios of these users. Defaults to all.
+            since (str, optional): Only the audios from this UTC timestamp ('YYYY-MM-DD[ HH:MM:SS]').
+            until (str, optional): Only the audios before this UTC timestamp.
+            after_rowid (int, optional): Only the audios after this rowid (e.g. the last exported one).
+            batch_size (int, optional): Rows read at a time. Defaults to 1000.
+
+        Yields:
+            dict: rowid, a_id, a_name, a_format, a_timestamp and u_id of every audio.
+
+        Raises:
+            sqlite3.Error: Unlike the other methods, a failed read is raised, so a 
+                bulk reader (e.g. the dataset exporter) never mistakes it for the end.
+        """
+        columns = ('rowid', 'a_id', 'a_name', 'a_format', 'a_timestamp', 'u_id')
+        yield from self._iter_rows('Audios', 'a_timestamp', columns, user_ids, since, until, after_rowid, batch_size)
+
+    def iterImages(self, user_ids:list=None, since:str=None, until:str=None, after_rowid:int=0, batch_size:int=1000):
+        """
+        Yields the Images rows in insertion (rowid) order, see `iterAudios`.
+
+        Yields:
+            dict: rowid, i_id, i_name, i_width, i_height, i_faces (list), i_hash, i_timestamp and u_id of every image.
+        """
+        columns = ('rowid', 'i_id', 'i_name', 'i_width', 'i_height', 'i_faces', 'i_hash', 'i_timestamp', 'u_id')
+        for row in self._iter_rows('Images', 'i_timestamp', columns, user_ids, since, until, after_rowid, batch_size):
+            row['i_faces'] = json.loads(row['i_faces']) if row['i_faces'] else []
+            yield row
+
+    def _iter_rows(self, table:str, timestamp_column:str, columns:tuple, user_ids:list, since:str, until:str,
+                   after_rowid:int, batch_size:int):
+        conditions, params = ['rowid > ?'], []
+        if user_ids:
+            conditions.append(f"u_id IN ({','.join('?' * len(user_ids))})")
+            params.extend(user_ids)
+        if since:
+            conditions.append(f'{timestamp_column} >= ?')
+            params.append(since)
+        if until:
+            conditions.append(f'{timestamp_column} < ?')
+            params.append(until)
+        sql = f"SELECT {', '.join(columns)} FROM {table} WHERE {' AND '.join(conditions)} ORDER BY rowid LIMIT ?"
+
+        while True:
+            try:
+                rows = self._pool.read(self._select_page, sql, [after_rowid, *params, batch_size])
+            except sqlite3.Error as e:
+                # Log: Error reading the rows
+                print(f"Error reading {table}: {e}")
+                raise
+            if not rows:
+                return
+            for row in rows:
+                yield dict(zip(columns, row))
+            after_rowid = rows[-1][0]
+
+    def _select_page(self, db_conn:sqlite3.Connection, sql:str, params:list) -> list:
+        return db_conn.execute(sql, params).fetchall()
+
+    # =========================================================================================== STATS
+    # NOTE: The stats only use the read-only connections (never the writer) and O(1) or index-only
+    # queries: the counts come from the counters kept by triggers (see `_migration_stats`) and the
+    # listings are keyset paginated on the (u_id, timestamp) indexes. The stats are cached for
+    # DB_STATS_CACHE_TTL seconds, the user's ones, the totals and the recent activity are dropped
+    # as soon as a user sends new media (see `_invalidate_stats`).
+    _AUDIO_PAGE_COLUMNS = ('rowid', 'a_id', 'a_name', 'a_format', 'a_timestamp')
+    _IMAGE_PAGE_COLUMNS = ('rowid', 'i_id', 'i_name', 'i_width', 'i_height', 'i_faces', 'i_timestamp')
+
+    def getUserAudios(self, user_id:int, before:tuple=None, limit:int=20) -> list:
+        """
+        Lists a page of the user's audios, the newest first.
+
+        Args:
+            user_id (int): The user ID in Telegram.
+            before (tuple, optional): (a_timestamp, rowid) of the last audio of the previous
+                page. Defaults to the first page.
+            limit (int, optional): Audios per page. Defaults to 20.
+
+        Returns:
+            list: rowid, a_id, a_name, a_format and a_timestamp of every audio, [] if error.
+        """
+        try:
+            return self._pool.read(self._select_user_page, 'Audios', 'a', self._AUDIO_PAGE_COLUMNS, user_id, before, limit)
+
+        except sqlite3.Error as e:
+            # Log: Error listing audios
+            print(f"Error listing audios: {e}")
+            return []
+
+    async def getUserAudiosAsync(self, user_id:int, before:tuple=None, limit:int=20) -> list:
+        """Awaitable version of `getUserAudios`."""
+        try:
+            return await self._pool.read_async(self._select_user_page, 'Audios', 'a', self._AUDIO_PAGE_COLUMNS, user_id, before, limit)
+
+        except sqlite3.Error as e:
+            # Log: Error listing audios
+            print(f"Error listing audios: {e}")
+            return []
+
+    def getUserImages(self, user_id:int, before:tuple=None, limit:int=20) -> list:
+        """
+        Lists a page of the user's images, the newest first, see `getUserAudios`.
+
+        Returns:
+            list: rowid, i_id, i_name, i_width, i_height, i_faces (list) and i_timestamp of every image, [] if error.
+        """
+        try:
+            return self._pool.read(self._select_user_page, 'Images', 'i', self._IMAGE_PAGE_COLUMNS, user_id, before, limit)
+
+        except sqlite3.Error as e:
+            # Log: Error listing images
+            print(f"Error listing images: {e}")
+            return []
+
+    async def getUserImagesAsync(self, user_id:int, before:tuple=None, limit:int=20) -> list:
+        """Awaitable version of `getUserImages`."""
+        try:
+            return await self._pool.read_async(self._select_user_page, 'Images', 'i', self._IMAGE_PAGE_COLUMNS, user_id, before, limit)
+
+        except sqlite3.Error as e:
+            # Log: Error listing images
+            print(f"Error listing images: {e}")
+            return []
+
+    def _select_user_page(self, db_conn:sqlite3.Connection, table:str, prefix:str, columns:tuple,
+                          user_id:int, before:tuple, limit:int) -> list:
+        # NOTE: The (timestamp, rowid) order is the order of the idx_<table>_user_timestamp entries,
+        # so a page is a range of the index, no matter how many rows the user has.
+        sql = f"SELECT {', '.join(columns)} FROM {table} WHERE u_id = ?"
+        params = [user_id]
+        if before is not None:
+            sql += f" AND ({prefix}_timestamp, rowid) < (?, ?)"
+            params.extend(before)
+        sql += f" ORDER BY {prefix}_timestamp DESC, rowid DESC LIMIT ?"
+        params.append(limit)
+        rows = [dict(zip(columns, row)) for row in db_conn.execute(sql, params)]
+        if 'i_faces' in columns:
+            for row in rows:
+                row['i_faces'] = json.loads(row['i_faces']) if row['i_faces'] else []
+        return rows
+
+    def getUserStats(self, user_id:int) -> dict:
+        """
+        Returns the user's stats.
+
+        Args:
+            user_id (int): The user ID in Telegram.
+
+        Returns:
+            dict: audios, images (counts), joined and last_activity (UTC timestamps, None if
+                unknown) of the user, None if error.
+        """
+        try:
+            return self._cached_read(('user', user_id), self._select_user_stats, user_id)
+
+        except sqlite3.Error as e:
+            # Log: Error reading the user stats
+            print(f"Error reading user stats: {e}")
+            return None
+
+    async def getUserStatsAsync(self, user_id:int) -> dict:
+        """Awaitable version of `getUserStats`."""
+        try:
+            return await self._cached_read_async(('user', user_id), self._select_user_stats, user_id)
+
+        except sqlite3.Error as e:
+            # Log: Error reading the user stats
+            print(f"Error reading user stats: {e}")
+            return None
+
+    def _select_user_stats(self, db_conn:sqlite3.Connection, user_id:int) -> dict:
+        row = db_conn.execute("""
+            SELECT u_audio_count, u_image_count, u_joined, u_last_activity FROM Users WHERE u_id = ?
+        """, (user_id,)).fetchone()
+        return dict(zip(('audios', 'images', 'joined', 'last_activity'), row or (0, 0, None, None)))
+
+    def getTotals(self) -> dict:
+        """
+        Returns the number of users, audios and images stored.
+
+        Returns:
+            dict: users, audios and images counts, None if error.
+        """
+        try:
+            return self._cached_read(('totals',), self._select_totals)
+
+        except sqlite3.Error as e:
+            # Log: Error reading the totals
+            print(f"Error reading totals: {e}")
+            return None
+
+    async def getTotalsAsync(self) -> dict:
+        """Awaitable version of `getTotals`."""
+        try:
+            return await self._cached_read_async(('totals',), self._select_totals)
+
+        except sqlite3.Error as e:
+            # Log: Error reading the totals
+            print(f"Error reading totals: {e}")
+            return None
+
+    def _select_totals(self, db_conn:sqlite3.Connection) -> dict:
+        totals = {'users': 0, 'audios': 0, 'images': 0}
+        totals.update(db_conn.execute("SELECT c_name, c_value FROM Counters").fetchall())
+        return totals
+
+    def getRecentActivity(self, hours:int=24) -> dict:
+        """
+        Summary of the last hours: audios and images received and users who sent them.
+        NOTE: Hour resolution, the window starts at the beginning of its first hour.
+
+        Args:
+            hours (int, optional): Size of the window. Defaults to 24.
+
+        Returns:
+            dict: hours, audios, images and active_users, None if error.
+        """
+        try:
+            return self._cached_read(('recent', hours), self._select_recent_activity, hours)
+
+        except sqlite3.Error as e:
+            # Log: Error reading the recent activity
+            print(f"Error reading recent activity: {e}")
+            return None
+
+    async def getRecentActivityAsync(self, hours:int=24) -> dict:
+        """Awaitable version of `getRecentActivity`."""
+        try:
+            return await self._cached_read_async(('recent', hours), self._select_recent_activity, hours)
+
+        except sqlite3.Error as e:
+            # Log: Error reading the recent activity
+            print(f"Error reading recent activity: {e}")
+            return None
+
+    def _select_recent_activity(self, db_conn:sqlite3.Connection, hours:int) -> dict:
+        # NOTE: `hours` rows of the hourly counters, and an index-only count of the active users
+        row = db_conn.execute("""
+            WITH Window (since) AS (SELECT STRFTIME('%Y-%m-%d %H:00:00', 'now', :offset))
+            SELECT
+                (SELECT COALESCE(SUM(h_audios), 0) FROM ActivityHours WHERE h_hour >= (SELECT since FROM Window)),
+                (SELECT COALESCE(SUM(h_images), 0) FROM ActivityHours WHERE h_hour >= (SELECT since FROM Window)),
+                (SELECT COUNT(*) FROM Users WHERE u_last_activity >= (SELECT since FROM Window))
+        """, {'offset': f'-{int(hours) - 1} hours'}).fetchone()
+        return dict(zip(('hours', 'audios', 'images', 'active_users'), (hours, *row)))
+
+    def _invalidate_stats(self, user_id:int):
+        """Drops the cached stats changed by a new (or removed) media of the user: the user's,
+        the totals and the recent activity of any window."""
+        self._cache.pop(('user', user_id))
+        self._cache.pop(('totals',))
+        self._cache.pop_prefix(('recent',))
+
+    def _cached_read(self, key:tuple, func, *args):
+        value = self._cache.get(key)
+        if value is None:
+            # NOTE: A read that overlaps an insert of the user (invalidated meanwhile) is not cached,
+            # it could come from a snapshot taken before the insert
+            generation = self._cache.generation(key)
+            try:
+                value = self._pool.read(func, *args)
+            except BaseException:
+                self._cache.release(key, generation)
+                raise
+            self._cache.put(key, value, generation)
+        return value
+
+    async def _cached_read_async(self, key:tuple, func, *args):
+        value = self._cache.get(key)
+        if value is None:
+            generation = self._cache.generation(key)
+            try:
+                value = await self._pool.read_async(func, *args)
+            except BaseException:
+                self._cache.release(key, generation)
+                raise
+            self._cache.put(key, value, generation)
+        return value
+
     # =========================================================================================== GET: Just for checking purposes
     def getUserAudioCount(self, user_id:int) -> int:
-        """ 
-        Makes a GET request to the DB that returns the user's Audio messages number, 
-        useful to obtain the next audio N for the audio name "audio_message_N"
-        
+        """
+        Makes a GET request to the DB that returns the user's Audio messages number.
+        NOTE: The next audio N for the audio name "audio_message_N" comes from the
+        user's counter (see `postUserAudio`), not from this count.
+
         Args:
             user_id (int): The user ID in Telegram, which is also used in our file management
-        Returns: 
+        Returns:
             int: The count of audio messages for the given user ID.
         """
         try:
-            with sqlite3.connect(self._db_prod_path) as db_conn:
-                cursor = db_conn.cursor()
-                cursor.execute("""SELECT COUNT(*) FROM Audios WHERE u_id = ?""", (user_id,))
-                user_audios_count = cursor.fetchone()[0]
-                db_conn.commit()
-                
-                return user_audios_count
-            
+            return self._pool.read(self._count_user_audios, user_id)
+
         except sqlite3.Error as e:
-            # Log: Error couting audios 
-            print(f"Error couting audios: {e}") 
-            return -1 # Return a default value (-1) in case of error
\ No newline at end of file
+            # Log: Error couting audios
+            print(f"Error couting audios: {e}")
+            return -1 # Return a default value (-1) in case of error
+
+    async def getUserAudioCountAsync(self, user_id:int) -> int:
+        """Awaitable version of `getUserAudioCount`."""
+        try:
+            return await self._pool.read_async(self._count_user_audios, user_id)
+
+        except sqlite3.Error as e:
+            # Log: Error couting audios
+            print(f"Error couting audios: {e}")
+            return -1 # Return a default value (-1) in case of error
+
+    def _count_user_audios(self, db_conn:sqlite3.Connection, user_id:int) -> int:
+        # The user's counter kept by the triggers, O(1) no matter how many audios are stored
+        row = db_conn.execute("SELECT u_audio_count FROM Users WHERE u_id = ?", (user_id,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def getImageCount(self) -> int:
+        """
+        Makes a GET request to the DB that returns the number of stored images.
+
+        Returns:
+            int: The count of images, -1 in case of error.
+        """
+        try:
+            return self._pool.read(self._count_images)
+
+        except sqlite3.Error as e:
+            # Log: Error couting images
+            print(f"Error couting images: {e}")
+            return -1
+
+    def _count_images(self, db_conn:sqlite3.Connection) -> int:
+        return db_conn.execute("SELECT c_value FROM Counters WHERE c_name = 'images'").fetchone()[0]
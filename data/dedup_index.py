@@ -0,0 +1,81 @@
+from data.database_handler import DatabaseHandler
+from utils.cache_utils import LRUCache
+from utils.metrics import METRICS
+import os
+
+class DedupIndex:
+    """
+        Index of the media already processed, so the same photo or voice note sent 
+        (or forwarded) again is not downloaded, processed and stored twice.
+
+        The media is found by its Telegram `file_unique_id` (before downloading it) or 
+        by the SHA-256 of its bytes (after downloading it). The index is persisted in 
+        the MediaCache table, with an in-memory LRU in front of it.
+    """
+    KEYS = ('unique_id', 'content_hash')
+
+    def __init__(self, db:DatabaseHandler=None, max_size:int=None):
+        self._dh = db or DatabaseHandler()
+        self._cache = LRUCache(max_size or int(os.getenv('DEDUP_CACHE_SIZE', 4096)))
+        self._counters = {}
+
+    def _count(self, kind:str, key:str, counter:str):
+        counters = self._counters.setdefault(kind, {}).setdefault(key, {'hits': 0, 'misses': 0})
+        counters[counter] += 1
+        METRICS.inc('dedup_lookups_total', kind=kind, key=key, result=counter)
+
+    def stats(self) -> dict:
+        """Hit/miss counters, as {kind: {'unique_id'|'content_hash': {'hits': int, 'misses': int}}}."""
+        return {kind: {key: dict(counters) for key, counters in keys.items()} for kind, keys in self._counters.items()}
+
+    async def lookup(self, kind:str, unique_id:str=None, content_hash:str=None) -> dict:
+        """Search an already processed media, by `unique_id` or by `content_hash`.
+
+        Args:
+            kind (str): 'audio' or 'image'.
+            unique_id (str, optional): Telegram `file_unique_id`.
+            content_hash (str, optional): SHA-256 of the media bytes.
+
+        Returns:
+            dict: The cached media (see `DatabaseHandler.postMediaCache`), None on a miss.
+        """
+        key = 'unique_id' if unique_id is not None else 'content_hash'
+        cache_key = (kind, key, unique_id if unique_id is not None else content_hash)
+
+        entry = self._cache.get(cache_key)
+        if entry is None:
+            entry = await self._dh.getMediaCacheAsync(kind, unique_id=unique_id, content_hash=content_hash)
+            if entry is not None:
+                self._cache.put(cache_key, entry)
+
+        # The stored file could have been removed, then it must be processed again
+        if entry is not None and entry['path'] is not None and not os.path.exists(entry['path']):
+            self._cache.pop(cache_key)
+            entry = None
+
+        self._count(kind, key, 'hits' if entry is not None else 'misses')
+        return entry
+
+    async def record(self, kind:str, unique_id:str, content_hash:str, path:str=None, name:str=None,
+                     faces:list=None, width:int=None, height:int=None) -> dict:
+        """Adds a processed media to the index (see `DatabaseHandler.postMediaCache` for the args).
+
+        Returns:
+            dict: The recorded entry.
+        """
+        entry = {
+            'kind': kind,
+            'unique_id': unique_id,
+            'content_hash': content_hash,
+            'path': path,
+            'name': name,
+            'faces': faces,
+            'width': width,
+            'height': height,
+        }
+        await self._dh.postMediaCacheAsync(kind, unique_id, content_hash, path, name, faces, width, height)
+        self._cache.put((kind, 'unique_id', unique_id), entry)
+        # NOTE: The photos rejected by their preview were never downloaded, they have no hash
+        if content_hash is not None:
+            self._cache.put((kind, 'content_hash', content_hash), entry)
+        return entry
@@ -0,0 +1,224 @@
+from data.database_handler import DatabaseHandler
+from utils.metrics import METRICS
+import traceback
+import asyncio
+import time
+import os
+
+class JobFailed(Exception):
+    """Raised by a job handler when the job can never succeed (e.g. an undecodable audio), it's not retried."""
+
+class JobQueue:
+    """
+        Durable queue of media jobs, persisted in the Jobs table, so the media received
+        is processed even if the bot restarts or crashes while processing it.
+
+        The handlers `enqueue` the job (the Telegram file_id and its metadata) and reply
+        right away, a pool of asyncio workers runs the jobs:
+            - The jobs of the same user are run one after the other, in order.
+            - A failed job is retried up to `max_attempts` times, with an exponential delay.
+              Once it fails for good its `on_failed` cleanup is run (see `register`).
+            - Every job has an idempotency key, the same update is queued only once.
+            - The jobs that were running when the bot stopped are run again at startup (`recover`).
+            - At most `max_pending` jobs wait in the queue, `enqueue` refuses the new ones beyond
+              that (backpressure), so the backlog can't grow without bounds.
+
+        NOTE: A job can be run more than once (e.g. a crash right after processing it),
+        the job handlers must be idempotent.
+    """
+    def __init__(self, db:DatabaseHandler=None, workers:int=None, max_attempts:int=None,
+                 retry_delay:float=None, poll_interval:float=1.0, stop_timeout:float=None,
+                 max_pending:int=None):
+        self._dh = db or DatabaseHandler()
+        self._workers_size = workers or int(os.getenv('JOB_WORKERS', 8))
+        self._max_attempts = max_attempts or int(os.getenv('JOB_MAX_ATTEMPTS', 5))
+        # Max jobs waiting to be run, 0 = no limit
+        self._max_pending = max_pending if max_pending is not None else int(os.getenv('JOB_MAX_PENDING', 1000))
+        # Seconds before the first retry, doubled on every attempt
+        self._retry_delay = retry_delay if retry_delay is not None else float(os.getenv('JOB_RETRY_DELAY', 5))
+        # Max seconds between two checks of the queue (e.g. for the retries)
+        self._poll_interval = poll_interval
+        # Seconds the running jobs have to finish on shutdown, then they are run again at the next startup
+        self._stop_timeout = stop_timeout if stop_timeout is not None else float(os.getenv('JOB_STOP_TIMEOUT', 30))
+        self._handlers = {}
+        self._on_failed = {}
+        self._workers = []
+        # The idle workers wait on the condition, `_enqueued` tells them if a job was
+        # queued while they were looking for one (so that wake up is never missed)
+        self._new_jobs = None
+        self._enqueued = 0
+        self._stopping = False
+
+    def register(self, kind:str, handler, on_failed=None):
+        """Sets the handler of a job kind: `async handler(job:dict)`, see `DatabaseHandler.claimJobAsync`
+        for the job fields. It raises JobFailed if the job must not be retried.
+        `async on_failed(job:dict)` is run when a job fails for good (JobFailed or `max_attempts`),
+        e.g. to remove what the job left half done."""
+        self._handlers[kind] = handler
+        if on_failed is not None:
+            self._on_failed[kind] = on_failed
+
+    # =========================================================================================== LIFE CYCLE
+    def recover(self) -> int:
+        """Puts back in the queue the jobs interrupted by the last stop (or crash).
+        Call it before `start`.
+
+        Returns:
+            int: Number of recovered jobs.
+        """
+        recovered = self._dh.resetRunningJobs()
+        if recovered > 0:
+            # Log: Jobs interrupted by the last stop
+            print(f'{recovered} interrupted jobs queued again')
+        return max(recovered, 0)
+
+    def start(self):
+        """Starts the workers. Must be called from the running event loop."""
+        self._stopping = False
+        self._new_jobs = asyncio.Condition()
+        loop = asyncio.get_running_loop()
+        self._workers = [loop.create_task(self._worker()) for _ in range(self._workers_size)]
+
+    async def stop(self):
+        """Stops the workers, the running jobs have `stop_timeout` seconds to finish, the
+        pending ones stay in the queue for the next startup."""
+        self._stopping = True
+        if self._new_jobs is not None:
+            async with self._new_jobs:
+                self._new_jobs.notify_all()
+        if not self._workers:
+            return
+        _, running = await asyncio.wait(self._workers, timeout=self._stop_timeout)
+        for worker in running:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def counts(self) -> dict:
+        """Number of jobs by status, see `DatabaseHandler.getJobCounts`."""
+        return self._dh.getJobCounts()
+
+    # =========================================================================================== JOBS
+    async def enqueue(self, kind:str, key:str, user_id:int, payload:dict) -> bool:
+        """Adds a job to the queue (only once per `key`).
+
+        Args:
+            kind (str): Job kind, it must have a handler (see `register`).
+            key (str): Idempotency key, e.g. 'audio:<chat_id>:<message_id>'.
+            user_id (int): The user the job belongs to.
+            payload (dict): JSON serializable job data.
+
+        Returns:
+            bool: True if the job is queued (now or before), False if the queue is full 
+                (`max_pending`) or the job could not be stored.
+        """
+        if self._max_pending and await self._dh.countPendingJobsAsync() >= self._max_pending:
+            METRICS.inc('jobs_enqueued_total', kind=kind, result='full')
+            return False
+        job_id = await self._dh.postJobAsync(kind, key, user_id, payload)
+        if job_id < 0:
+            return False
+        METRICS.inc('jobs_enqueued_total', kind=kind, result='new' if job_id > 0 else 'duplicate')
+        if job_id > 0 and self._new_jobs is not None:
+            self._enqueued += 1
+            # A single idle worker claims it
+            async with self._new_jobs:
+                self._new_jobs.notify()
+        return True
+
+    async def _worker(self):
+        while not self._stopping:
+            enqueued = self._enqueued
+            job = await self._dh.claimJobAsync(time.time())
+            if job is not None:
+                # NOTE: Once done, this worker claims again, e.g. the next job of the same user
+                await self._run(job)
+                continue
+            async with self._new_jobs:
+                if self._enqueued != enqueued or self._stopping:
+                    continue
+                try:
+                    # The retries (`run_after`) are found by the periodic check
+                    await asyncio.wait_for(self._new_jobs.wait(), timeout=self._poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _run(self, job:dict):
+        """Runs a job and records its result: done, failed or pending (to retry it)."""
+        handler = self._handlers.get(job['kind'])
+        try:
+            if handler is None:
+                raise JobFailed(f"No handler for the {job['kind']} jobs")
+            with METRICS.trace(f"{job['kind']}_job"):
+                await handler(job)
+        except asyncio.CancelledError:
+            # Stopped: the job stays running, it's recovered at the next startup
+            raise
+        except JobFailed as e:
+            await self._fail(job, str(e))
+            return
+        except Exception as e:
+            error = ''.join(traceback.format_exception_only(e)).strip()
+            if job['attempts'] >= self._max_attempts:
+                # Log: The job failed too many times
+                print(f"Job {job['key']} failed after {job['attempts']} attempts: {error}")
+                await self._fail(job, error)
+            else:
+                run_after = time.time() + self._retry_delay * 2 ** (job['attempts'] - 1)
+                await self._dh.updateJobAsync(job['id'], 'pending', error=error, run_after=run_after)
+                METRICS.inc('jobs_total', kind=job['kind'], result='retried')
+            return
+        await self._dh.updateJobAsync(job['id'], 'done')
+        METRICS.inc('jobs_total', kind=job['kind'], result='done')
+
+    async def _fail(self, job:dict, error:str):
+        """Runs the cleanup of a job that failed for good, then records it as failed."""
+        on_failed = self._on_failed.get(job['kind'])
+        if on_failed is not None:
+            try:
+                await on_failed(job)
+            except Exception as e:
+                # Log: The cleanup failed, the job is recorded as failed anyway
+                print(f"Cleanup of the failed job {job['key']} failed: {e}")
+        await self._dh.updateJobAsync(job['id'], 'failed', error=error)
+        METRICS.inc('jobs_total', kind=job['kind'], result='failed')
+
+def reconcile_audios(db:DatabaseHandler, audio_utils, unfinished:dict=None) -> dict:
+    """Startup recovery of the audios of the unfinished jobs (blocking): removes the Audios 
+    records whose file was never written (e.g. a crash between the DB insert and the disk 
+    write) and the temporary files left in the folders of their users.
+    NOTE: Run it before the job workers start, a job could be writing its audio. Only the
+    unfinished jobs are checked: a done job has its file in place and a failed one removed
+    its record (see `discard_audio_job` in main.py), so the other audios are never touched
+    (nor even stat'ed), even if the storage is not mounted.
+
+    Args:
+        db (DatabaseHandler): The bot DB.
+        audio_utils (AudioUtils): Where the audios are stored.
+        unfinished (dict, optional): The `DatabaseHandler.getUnfinishedJobs` result, if it was
+            already read. Defaults to reading it.
+
+    Returns:
+        dict: Number of audios checked, records removed and temporary files removed.
+    """
+    stats = {'checked': 0, 'missing': 0, 'tmp_files': 0}
+    if unfinished is None:
+        unfinished = db.getUnfinishedJobs()
+    for audio in unfinished['audios']:
+        stats['checked'] += 1
+        path = audio_utils.audioPath(audio['u_id'], audio['a_name'], audio['a_format'])
+        if not os.path.exists(path) and db.deleteAudio(audio['a_id']):
+            stats['missing'] += 1
+
+    for user_id in unfinished['users']:
+        user_folder = audio_utils.audioFolder(user_id)
+        if not os.path.isdir(user_folder):
+            continue
+        for entry in os.scandir(user_folder):
+            if entry.name.startswith('.tmp_'):
+                os.remove(entry.path)
+                stats['tmp_files'] += 1
+    if stats['missing'] or stats['tmp_files']:
+        # Log: Leftovers of an interrupted audio processing
+        print(f"Audios reconciled: {stats['missing']} records without file and {stats['tmp_files']} temporary files removed")
+    return stats
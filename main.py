@@ -1,26 +1,112 @@
-from data.database_handler import DatabaseHandler
-from utils.audio_utils import AudioUtils
-from utils.image_utils import ImageUtils
+from data.database_handler import DatabaseHandler, IMAGE_DATA_DIR
+from data.dedup_index import DedupIndex
+from data.job_queue import JobQueue, JobFailed, reconcile_audios
+from utils.media_executor import MediaExecutor, MediaQueueFull, MediaJobTimeout, default_capacity
+from utils.file_utils import content_hash
+from utils.update_processor import PerUserUpdateProcessor
+from utils.metrics import METRICS, MetricsExporter
+from utils.admission import AdmissionController
 from dotenv import load_dotenv
+import functools
+import asyncio
+import math
 import os 
 
 from telegram import Update
-from telegram.ext import Application, ContextTypes, MessageHandler, filters
+from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters
 
 # .env
 load_dotenv()
 TELEGRAM_BOT_TOKEN=os.getenv('TELEGRAM_BOT_TOKEN')
-IMAGE_DATA_PATH = './data/image_data/'
+# Optional, e.g. to use a local Bot API server (see benchmarks/fake_bot_api.py)
+TELEGRAM_BASE_URL=os.getenv('TELEGRAM_BASE_URL')
+TELEGRAM_BASE_FILE_URL=os.getenv('TELEGRAM_BASE_FILE_URL')
+# Webhook mode (BOT_MODE=webhook), the bot listens in WEBHOOK_LISTEN:WEBHOOK_PORT behind 
+# a reverse proxy that serves WEBHOOK_URL (the public HTTPS URL Telegram posts to).
+BOT_MODE=os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL=os.getenv('WEBHOOK_URL')
+WEBHOOK_LISTEN=os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT=int(os.getenv('WEBHOOK_PORT', 8443))
+WEBHOOK_PATH=os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET_TOKEN=os.getenv('WEBHOOK_SECRET_TOKEN')
+# Absolute, the paths recorded in the dedup index must not depend on the working directory
+IMAGE_DATA_PATH = f'{IMAGE_DATA_DIR}/'
+BUSY_MESSAGE = "I'm a bit busy right now, please try again later."
+SAVE_FAILED_MESSAGE = "Sorry, I couldn't save this file, please send it again."
+# Only the update types we handle are requested to Telegram (voice, audio and photo messages)
+ALLOWED_UPDATES = [Update.MESSAGE]
+# NOTE: The media modules (cv2, numpy, soundfile, soxr) and the face detector are not imported
+# at startup, they are loaded in the background once the bot is running (MEDIA_WARMUP=0 to
+# load them on the first media update instead).
+MEDIA_WARMUP = os.getenv('MEDIA_WARMUP', '1') == '1'
+# Adaptive face detection: the faces are searched first in a small size of the photo (sent 
+# in the update, at least FACE_PREVIEW_SIZE px), and the full size photo is downloaded only
+# if it could have faces. FACE_DETECTION_MODE=full always downloads the full size photo.
+FACE_DETECTION_MODE = os.getenv('FACE_DETECTION_MODE', 'adaptive')
+FACE_PREVIEW_SIZE = int(os.getenv('FACE_PREVIEW_SIZE', 320))
+# Days the finished jobs (and so their idempotency keys) are kept
+JOB_RETENTION_DAYS = float(os.getenv('JOB_RETENTION_DAYS', 7))
 
 # =========================================================================================== BOT FUNCTION HANDLERS
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Log the error and send a telegram message to notify the developer."""
     # Log the error, also we can implement a dev notification.
     print("An exception was raised while handling an update.")
+    METRICS.inc('handler_errors_total', error=type(context.error).__name__)
 
+async def reply(update: Update, text: str) -> None:
+    """Answers the update message, timing the reply stage."""
+    with METRICS.timer('reply'):
+        await update.message.reply_text(text)
+
+def admission_controlled(media:str):
+    """Decorator of the media handlers: the media is checked by the AdmissionController 
+    (size, duration, user rate and global load) before downloading it, if it's rejected 
+    the user gets a fast "try later" answer and the handler is not run.
+
+    Args:
+        media (str): 'audio' or 'image'.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+            # Edge case of the message been edited
+            if not update.message:
+                return None
+            if media == 'audio':
+                media_obj = update.message.voice or update.message.audio
+            else:
+                media_obj = update.message.photo[-1]
+            admission_controller = context.bot_data['admission']
+            admission = admission_controller.admit(
+                update.effective_user.id, media, 
+                file_size=media_obj.file_size, duration=getattr(media_obj, 'duration', None),
+                media_group_id=update.message.media_group_id
+            )
+            if not admission.admitted:
+                # Only one answer per album
+                if admission.notified:
+                    return None
+                if admission.reason == 'rate_limited':
+                    text = f"You're sending too many files, please try again in {math.ceil(admission.retry_after)} seconds."
+                elif admission.reason == 'too_long':
+                    text = f"This audio is too long, the limit is {admission_controller.max_audio_duration // 60} minutes."
+                elif admission.reason == 'too_big':
+                    text = f"This file is too big, the limit is {admission_controller.max_file_size // 2**20}MB."
+                else:
+                    text = BUSY_MESSAGE
+                await reply(update, text)
+                return None
+            with admission:
+                return await handler(update, context)
+        return wrapper
+    return decorator
+
+@METRICS.traced('audio')
+@admission_controlled('audio')
 async def audio_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Receive an audio message, changes the sampling rate to 16kHz and 
-    saves it in .wav format.
+    """Receive an audio message (voice note or audio file) and queue it to be processed
+    (see `process_audio_job`), the user gets the answer right away.
 
     Args:
         update (Update): This object represents an incoming update.
@@ -29,22 +115,110 @@ async def audio_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     # Edge case of the message been edited
     if not update.message:
         return None
-    
-    # Obtain the user ID to know where to store its audio
-    user_id = update.effective_user.id
-    # Audio preprocessing and conversion
-    file_id = update.message.voice.file_id
-    audio_msg_file = await context.bot.get_file(file_id)
 
-    # NOTE: Here I ASSUME that the audio will be short enough to be stored as bytearray in RAM, 
-    # allowing us to directly preprocess the audio without additional I/O latency
-    # of saving the file, reading it, and saving it again after preprocessing.
-    audio_data = await audio_msg_file.download_as_bytearray()
-    au = AudioUtils()
-    await au.processAudio(audio_data=audio_data, user_id=user_id)
-    await update.message.reply_text("Let's check this audio!")
+    audio_obj = update.message.voice or update.message.audio
+    # NOTE: The same update delivered again (e.g. after a restart) has the same key, it's queued once
+    job_key = f'audio:{update.effective_chat.id}:{update.message.message_id}'
+    queued = await context.bot_data['job_queue'].enqueue('audio', job_key, update.effective_user.id, {
+        'file_id': audio_obj.file_id,
+        'file_unique_id': audio_obj.file_unique_id,
+        'duration': audio_obj.duration,
+        'file_size': audio_obj.file_size,
+    })
+    if not queued:
+        await reply(update, BUSY_MESSAGE)
+        return None
+    await reply(update, "Let's check this audio!")
+
+async def process_audio_job(application: Application, job: dict) -> None:
+    """Downloads a queued audio, changes the sampling rate to 16kHz and saves it in the 
+    storage format (AUDIO_STORAGE_FORMAT, .wav by default). Run by the job queue workers.
+
+    Args:
+        application (Application): The bot application.
+        job (dict): The queued job, see `audio_message`.
+
+    Raises:
+        JobFailed: If the audio can not be decoded (it's not retried).
+        RuntimeError: If the audio could not be stored, e.g. a DB error (it's retried).
+    """
+    user_id, job_key, audio_obj = job['user_id'], job['key'], job['payload']
+    await media_ready(application)
+    from utils.audio_utils import AudioDecodeError
+    db = application.bot_data['db']
+    au = application.bot_data['audio_utils']
+    dedup = application.bot_data['dedup_index']
+    executor = application.bot_data['media_executor']
+
+    # The job could have stored its audio before being interrupted, it's not stored twice
+    stored = await db.getAudioByJobAsync(job_key)
+    if stored is not None:
+        if os.path.exists(au.audioPath(stored['u_id'], stored['a_name'], stored['a_format'])):
+            return None
+        await db.deleteAudioAsync(stored['a_id'])
+
+    # Already processed audio (e.g. forwarded), link it without downloading it
+    cached = await dedup.lookup('audio', unique_id=audio_obj['file_unique_id'])
+    if cached is not None and await au.linkAudio(cached['path'], user_id, executor=executor, job_key=job_key) is not None:
+        METRICS.inc('audios_total', result='linked')
+        return None
+
+    with METRICS.timer('get_file', media='audio'):
+        audio_msg_file = await application.bot.get_file(audio_obj['file_id'])
+
+    # NOTE: Short audios are stored as bytearray in RAM, allowing us to directly preprocess 
+    # the audio without additional I/O latency of saving the file, reading it, and saving 
+    # it again after preprocessing. Long ones are spooled to disk and streamed instead.
+    streaming = au.useStreaming(audio_obj['duration'], audio_obj['file_size'])
+    with METRICS.timer('download', media='audio'):
+        if streaming:
+            audio_data = await au.spoolAudio(audio_msg_file)
+        else:
+            audio_data = await audio_msg_file.download_as_bytearray()
+    try:
+        with METRICS.timer('hash', media='audio'):
+            audio_hash = await executor.run_in_thread(content_hash, audio_data)
+        # Same bytes under another file_unique_id, link them instead of processing them
+        cached = await dedup.lookup('audio', content_hash=audio_hash)
+        audio_path = await au.linkAudio(cached['path'], user_id, executor=executor, job_key=job_key) if cached is not None else None
+        if audio_path is not None:
+            METRICS.inc('audios_total', result='linked')
+        else:
+            try:
+                audio_path = await au.processAudio(audio_data=audio_data, user_id=user_id, executor=executor,
+                                                   streaming=streaming, job_key=job_key)
+            except AudioDecodeError as e:
+                # A broken or unsupported upload, trying again won't decode it
+                METRICS.inc('audios_total', result='undecodable')
+                raise JobFailed(str(e)) from e
+            METRICS.inc('audios_total', result='processed' if audio_path is not None else 'failed')
+        if audio_path is None:
+            # e.g. the DB record could not be created, the job is retried
+            raise RuntimeError('The audio could not be stored')
+        await dedup.record('audio', audio_obj['file_unique_id'], audio_hash, path=audio_path)
+    finally:
+        if streaming:
+            os.remove(audio_data)
+
+async def discard_audio_job(application: Application, job: dict) -> None:
+    """Run when an audio job fails for good: removes the Audios record it created if its
+    file was never written (e.g. the disk write failed), no record points to a missing file.
 
+    Args:
+        application (Application): The bot application.
+        job (dict): The failed job, see `audio_message`.
+    """
+    au = application.bot_data.get('audio_utils')
+    # Without the media utils the job never got to store its audio
+    if au is None:
+        return None
+    db = application.bot_data['db']
+    stored = await db.getAudioByJobAsync(job['key'])
+    if stored is not None and not os.path.exists(au.audioPath(stored['u_id'], stored['a_name'], stored['a_format'])):
+        await db.deleteAudioAsync(stored['a_id'])
 
+@METRICS.traced('image')
+@admission_controlled('image')
 async def image_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Determines whether there is a face in the photos being sent or not, 
     saves only those where it is.
@@ -57,8 +231,8 @@ async def image_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     Here I'm assuming that we are making a face Dataset, so all the images 
     are named as [image_<0>.jpg, ..., image_<N>.jpg] with its original sizes. 
     
-    Also no information about the userid will be included (it would be the same 
-    code like in the audio part, if needed).
+    The image N, the user ID, the dimensions, the detected faces and the content
+    hash are recorded in the Images table.
 
     Args:
         update (Update): This object represents an incoming update.
@@ -68,38 +242,159 @@ async def image_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     if not update.message:
         return 
     
-    iu = ImageUtils()
+    await media_ready(context.application)
+    iu = context.bot_data['image_utils']
+    db = context.bot_data['db']
+    dedup = context.bot_data['dedup_index']
+    executor = context.bot_data['media_executor']
+    user_id = update.effective_user.id
 
     # for photo_obj in update.message.photo:
     photo_obj = update.message.photo[-1]
-    new_file = await context.bot.get_file(photo_obj.file_id)
+
+    # Already processed photo (e.g. forwarded), answer without downloading it
+    cached = await dedup.lookup('image', unique_id=photo_obj.file_unique_id)
+    if cached is not None:
+        await reply_cached_image(update, db, cached)
+        return None
+
+    # Search the faces in a small size first, most photos without faces are never downloaded in full size
+    preview_obj = select_preview_photo(update.message.photo) if FACE_DETECTION_MODE == 'adaptive' else None
+    if preview_obj is not None:
+        try:
+            with METRICS.timer('get_file', media='preview'):
+                preview_file = await context.bot.get_file(preview_obj.file_id)
+            with METRICS.timer('download', media='preview'):
+                preview_data = await preview_file.download_as_bytearray()
+            with METRICS.timer('screen', media='image'):
+                candidate = await iu.screenImage(preview_data, executor=executor)
+        except (MediaQueueFull, MediaJobTimeout) as e:
+            # Log: The media workers are saturated
+            print(f'Image processing rejected: {e}')
+            METRICS.inc('updates_rejected_total', media='image')
+            await reply(update, BUSY_MESSAGE)
+            return None
+        METRICS.inc('face_screen_total', result='rejected' if candidate is False else 'candidate')
+        if candidate is False:
+            METRICS.inc('images_total', result='no_faces')
+            # Remember it by its file_unique_id, the photo is not downloaded again if it's sent again
+            await dedup.record('image', photo_obj.file_unique_id, None, faces=[],
+                               width=photo_obj.width, height=photo_obj.height)
+            await reply(update, "Wow, thanks!")
+            return None
+
+    with METRICS.timer('get_file', media='image'):
+        new_file = await context.bot.get_file(photo_obj.file_id)
 
     # NOTE: Here I ASSUME that the photo will be small enough to be stored as bytearray in RAM, 
     # allowing us to directly if there is a face without additional I/O latency
     # of saving the file, reading it, and saving it again after preprocessing.
-    image_data = await new_file.download_as_bytearray()
-    has_face = await iu.processImage(img=image_data)
+    # The photo is downloaded only once, the same buffer is decoded and then saved.
+    with METRICS.timer('download', media='image'):
+        image_data = await new_file.download_as_bytearray()
+    try:
+        # Same bytes under another file_unique_id
+        with METRICS.timer('hash', media='image'):
+            image_hash = await executor.run_in_thread(content_hash, image_data)
+        cached = await dedup.lookup('image', content_hash=image_hash)
+        if cached is not None:
+            await dedup.record('image', photo_obj.file_unique_id, image_hash, path=cached['path'], name=cached['name'],
+                               faces=cached['faces'], width=cached['width'], height=cached['height'])
+            await reply_cached_image(update, db, cached)
+            return None
+
+        # The photos received at the same time (e.g. albums) are scored in a single batch
+        with METRICS.timer('face_batch', media='image'):
+            image_faces = await context.bot_data['face_batch_scheduler'].processImage(image_data)
+    except (MediaQueueFull, MediaJobTimeout) as e:
+        # Log: The media workers are saturated
+        print(f'Image processing rejected: {e}')
+        METRICS.inc('updates_rejected_total', media='image')
+        await reply(update, BUSY_MESSAGE)
+        return None
+    has_face = image_faces is not None and image_faces.has_faces
+    img_name, new_img_id = None, None
+    if image_faces is None:
+        METRICS.inc('images_total', result='undecodable')
+    else:
+        METRICS.inc('images_total', result='faces' if has_face else 'no_faces')
+        METRICS.inc('faces_detected_total', len(image_faces.faces))
 
     # Telegram converts all the images to .jpg, which is good for making the Dataset
     # and we don't need to preprocess it further.
     if has_face:
-        files_in_dir = iu.count_directory_files()
+        # Create new Image record in the DB and return the new image name
+        with METRICS.timer('db_insert', media='image'):
+            img_name = await db.postUserImageAsync(
+                user_id, image_faces.width, image_faces.height, image_faces.faces, image_hash
+            )
         # In case of failure, we will simply skip this image.
-        if files_in_dir < 0:
+        if img_name == 'NULL':
             return None
 
-        new_img_id = f'{IMAGE_DATA_PATH}image_{files_in_dir}.jpg'
+        new_img_id = f'{IMAGE_DATA_PATH}{img_name}.jpg'
 
         # NOTE: Saving the original file from internet without rescaling could be
         # a problem if someone starts sending very big images. But with 
         # "saves only those where it is" I understand that is original Image. 
         # At least Telegram downsizes big images, it's a plus in this task.
-        await new_file.download_to_drive(new_img_id)
+        # The record is removed if its file is not written, no Images row points to a missing file
+        try:
+            saved = await iu.saveImage(image_data, new_img_id, executor=executor)
+        except (MediaQueueFull, MediaJobTimeout) as e:
+            # Log: The media workers are saturated
+            print(f'Image saving rejected: {e}')
+            METRICS.inc('updates_rejected_total', media='image')
+            await db.deleteUserImageAsync(user_id, img_name)
+            await reply(update, BUSY_MESSAGE)
+            return None
+        if not saved:
+            METRICS.inc('images_total', result='failed')
+            await db.deleteUserImageAsync(user_id, img_name)
+            await reply(update, SAVE_FAILED_MESSAGE)
+            return None
+
+    # Remember the result (also the photos without faces), for the next time this photo is sent
+    if image_faces is not None:
+        await dedup.record('image', photo_obj.file_unique_id, image_hash, path=new_img_id, name=img_name,
+                           faces=image_faces.faces, width=image_faces.width, height=image_faces.height)
 
     if has_face:
-        await update.message.reply_text("What a beautiful face!")
+        await reply(update, "What a beautiful face!")
+    else:
+        await reply(update, "Wow, thanks!")
+
+def select_preview_photo(photo_sizes:list):
+    """Chooses the photo size where the faces are searched first: the smallest one with
+    at least FACE_PREVIEW_SIZE px in its longest side.
+
+    Args:
+        photo_sizes (list): The `update.message.photo` sizes, from the smallest to the biggest.
+
+    Returns:
+        PhotoSize: The preview size, None if there is no size smaller than the full size 
+            photo that is big enough.
+    """
+    for photo_size in photo_sizes[:-1]:
+        if max(photo_size.width, photo_size.height) >= FACE_PREVIEW_SIZE:
+            return photo_size
+    return None
+
+async def reply_cached_image(update: Update, db: DatabaseHandler, cached: dict) -> None:
+    """Answers a photo that was already processed, linking its stored file (if it 
+    has faces) to the user instead of storing it again.
+
+    Args:
+        update (Update): This object represents an incoming update.
+        db (DatabaseHandler): The bot DB.
+        cached (dict): The photo entry in the dedup index.
+    """
+    METRICS.inc('images_total', result='cached')
+    if cached['faces'] and cached['name'] is not None:
+        await db.linkUserImageAsync(update.effective_user.id, cached['name'])
+        await reply(update, "What a beautiful face!")
     else:
-        await update.message.reply_text("Wow, thanks!")
+        await reply(update, "Wow, thanks!")
 
 async def audioDBCount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Development purposses only. Check the DB Audio Count for your ID.
@@ -108,16 +403,226 @@ async def audioDBCount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         update (Update): This object represents an incoming update.
         context (ContextTypes.DEFAULT_TYPE): Determines the type of the context argument.
     """
-    db = DatabaseHandler()          
-    res = f'We have {db.getUserAudioCount(update.effective_user.id)} audios from you'              
-    await update.message.reply_text(res)
+    db = context.bot_data['db']
+    res = f'We have {await db.getUserAudioCountAsync(update.effective_user.id)} audios from you'
+    await reply(update, res)
+
+@METRICS.traced('stats')
+async def user_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Answers with the user's stats, the DB totals and the activity of the last 24 hours.
+    NOTE: Only counters and index ranges are read (see `DatabaseHandler` STATS), so it stays 
+    fast as the DB grows and it never waits for the media writes.
+
+    Args:
+        update (Update): This object represents an incoming update.
+        context (ContextTypes.DEFAULT_TYPE): Determines the type of the context argument.
+    """
+    db = context.bot_data['db']
+    with METRICS.timer('db_stats'):
+        user, totals, recent = await asyncio.gather(
+            db.getUserStatsAsync(update.effective_user.id),
+            db.getTotalsAsync(),
+            db.getRecentActivityAsync(24),
+        )
+    if user is None or totals is None or recent is None:
+        await reply(update, "I can't read the stats right now, please try again later.")
+        return
+    await reply(update, (
+        f"You sent {user['audios']} audios and {user['images']} images.\n"
+        f"In total: {totals['audios']} audios and {totals['images']} images from {totals['users']} users.\n"
+        f"Last 24h: {recent['audios']} audios and {recent['images']} images from {recent['active_users']} users."
+    ))
+
+# =========================================================================================== APP LIFE CYCLE
+def load_media_modules():
+    """Imports the heavy media modules and loads the face detector. 
+    It's blocking, so it's run in a thread while the bot keeps polling.
+
+    Returns:
+        FaceDetector: The loaded face detector.
+    """
+    import utils.audio_utils
+    import utils.image_utils
+    from utils.face_detector import FaceDetector
+
+    detector = FaceDetector.from_env()
+    if not detector.load():
+        # Fallback to the Haar Cascade included in cv2, if the DNN model is not available
+        print(f'Face detector backend "{detector.backend}" not available, using "haar"')
+        detector = FaceDetector(backend='haar')
+        detector.load()
+    return detector
+
+async def load_media(application: Application) -> None:
+    """Loads the face detector, starts the media workers and creates the media utils."""
+    with METRICS.timer('media_load'):
+        detector = await asyncio.to_thread(load_media_modules)
+    from utils.audio_utils import AudioUtils
+    from utils.image_utils import ImageUtils, FaceBatchScheduler
+
+    # Every media worker thread loads its own detector instance when it starts
+    media_executor = MediaExecutor(thread_initializer=detector.load)
+    media_executor.start()
+    METRICS.gauge('media_queue_depth', lambda: media_executor.pending)
+    METRICS.gauge('media_queue_capacity', lambda: media_executor.capacity)
+
+    db = application.bot_data['db']
+    image_utils = ImageUtils(detector=detector, db=db)
+    application.bot_data['face_detector'] = detector
+    application.bot_data['media_executor'] = media_executor
+    application.bot_data['audio_utils'] = AudioUtils(db=db)
+    application.bot_data['image_utils'] = image_utils
+    application.bot_data['face_batch_scheduler'] = FaceBatchScheduler(image_utils, executor=media_executor)
+
+async def media_ready(application: Application) -> None:
+    """Waits until the media utils are loaded, the first caller starts loading them.
+    If the loading fails, the waiting callers get its error and the next caller tries again."""
+    loader = application.bot_data.get('media_loader')
+    if loader is None:
+        loader = application.bot_data['media_loader'] = asyncio.ensure_future(load_media(application))
+        loader.add_done_callback(functools.partial(forget_failed_loader, application))
+    await loader
+
+def forget_failed_loader(application: Application, loader: asyncio.Future) -> None:
+    """Done callback of the media loader: a failed loading is dropped, so it's not reused."""
+    if (loader.cancelled() or loader.exception() is not None) and application.bot_data.get('media_loader') is loader:
+        del application.bot_data['media_loader']
+
+async def warmup_media(application: Application) -> None:
+    """Loads the media utils and warms up the workers: every media thread loads its face
+    detector and the process pool workers are started with the resampler initialized."""
+    await media_ready(application)
+    from utils.audio_utils import warmup_resampler
+    detector = application.bot_data['face_detector']
+    media_executor = application.bot_data['media_executor']
+    try:
+        with METRICS.timer('warmup'):
+            await asyncio.gather(
+                *(media_executor.run_in_thread(detector.warmup) for _ in range(media_executor.thread_workers)),
+                media_executor.run_in_process(warmup_resampler),
+            )
+        print('Media workers ready')
+    except (MediaQueueFull, MediaJobTimeout) as e:
+        # Log: The bot is already busy, the workers will be initialized by the real updates
+        print(f'Media warm-up skipped: {e}')
+
+async def post_init(application: Application) -> None:
+    """Open the DB and start the metrics exporter once the bot is initialized, the media
+    utils are loaded in the background (see `warmup_media`)."""
+    db = DatabaseHandler()
+    application.bot_data['db'] = db
+    application.bot_data['dedup_index'] = DedupIndex(db)
+    admission = AdmissionController()
+    # The media updates in flight are limited by the workers capacity (ADMISSION_MAX_IN_FLIGHT),
+    # known before the media stack is loaded, so the cap also applies during the cold start
+    admission.bindCapacity(default_capacity())
+    application.bot_data['admission'] = admission
+    METRICS.gauge('admission_in_flight', lambda: admission.in_flight)
+
+    # Durable queue of the audios to process, the interrupted ones are run again
+    job_queue = JobQueue(db)
+    job_queue.register('audio', functools.partial(process_audio_job, application),
+                       on_failed=functools.partial(discard_audio_job, application))
+    application.bot_data['job_queue'] = job_queue
+    METRICS.gauge('jobs_pending', lambda: job_queue.counts().get('pending', 0))
+    application.bot_data['job_recovery'] = asyncio.get_running_loop().create_task(start_job_queue(application))
+
+    # Optional metrics endpoint (METRICS_PORT) and periodic JSON dump (METRICS_DUMP_PATH)
+    metrics_exporter = MetricsExporter()
+    if metrics_exporter.enabled:
+        metrics_exporter.start()
+    application.bot_data['metrics_exporter'] = metrics_exporter
+
+    if MEDIA_WARMUP:
+        # NOTE: A plain asyncio task, it runs while the polling starts 
+        # (Application.create_task is meant for a running application).
+        application.bot_data['media_warmup'] = asyncio.get_running_loop().create_task(warmup_media(application))
+
+async def start_job_queue(application: Application) -> None:
+    """Startup recovery, then the job workers are started: the audios left without file 
+    by a crash are removed (their jobs store them again) and the interrupted jobs are queued again."""
+    job_queue = application.bot_data['job_queue']
+    db = application.bot_data['db']
+    try:
+        # The media utils (which know where the audios are stored) are loaded here only if some
+        # jobs are unfinished, they need them anyway. With MEDIA_WARMUP=0 they are not loaded otherwise.
+        unfinished = await asyncio.to_thread(db.getUnfinishedJobs)
+        if unfinished['users']:
+            await media_ready(application)
+            await asyncio.to_thread(reconcile_audios, db, application.bot_data['audio_utils'], unfinished)
+        await asyncio.to_thread(db.deleteFinishedJobs, JOB_RETENTION_DAYS)
+    except Exception as e:
+        # Log: The recovery failed, the jobs are run anyway
+        print(f'Startup recovery failed: {e}')
+    await asyncio.to_thread(job_queue.recover)
+    job_queue.start()
+
+async def post_shutdown(application: Application) -> None:
+    """Stop the job workers and the media workers, waiting for the jobs in progress, the metrics exporter and close the DB connections."""
+    job_recovery = application.bot_data.get('job_recovery')
+    if job_recovery is not None:
+        await asyncio.gather(job_recovery, return_exceptions=True)
+    job_queue = application.bot_data.get('job_queue')
+    if job_queue is not None:
+        await job_queue.stop()
+    # The media utils could still be loading
+    for task_name in ('media_warmup', 'media_loader'):
+        task = application.bot_data.get(task_name)
+        if task is not None:
+            await asyncio.gather(task, return_exceptions=True)
+    media_executor = application.bot_data.get('media_executor')
+    if media_executor is not None:
+        media_executor.shutdown(wait=True)
+    metrics_exporter = application.bot_data.get('metrics_exporter')
+    if metrics_exporter is not None and metrics_exporter.enabled:
+        metrics_exporter.stop()
+    DatabaseHandler.close_all()
 
 # =========================================================================================== MAIN APP
+def build_application(token:str, base_url:str=None, base_file_url:str=None) -> Application:
+    """Creates the bot Application with all its handlers.
+
+    Args:
+        token (str): Telegram bot token.
+        base_url (str, optional): Bot API URL, e.g. a local Bot API server. Defaults to Telegram's one.
+        base_file_url (str, optional): Bot API files URL. Defaults to Telegram's one.
+
+    Returns:
+        Application: The bot, ready to be run.
+    """
+    builder = (
+        Application.builder()
+        .token(token)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        # Different users are processed in parallel, the updates of the same user in order
+        .concurrent_updates(PerUserUpdateProcessor())
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    if base_file_url:
+        builder = builder.base_file_url(base_file_url)
+    telegram_bot = builder.build()
+    # -------------------------------------------------------------------------------------- Adding the bot handlers
+    telegram_bot.add_handler(MessageHandler(filters.VOICE | filters.AUDIO, audio_message)) # Audio filtering task
+    telegram_bot.add_handler(MessageHandler(filters.PHOTO, image_message))             # Image filtering task
+
+    telegram_bot.add_handler(CommandHandler("stats", user_stats))                      # /stats returns your stats and the DB totals
+    telegram_bot.add_handler(CommandHandler("adb", audioDBCount))                      # /adb   returns the Audio Db count for your ID, (Dev. HELPER)
+
+    telegram_bot.add_error_handler(error_handler)
+    return telegram_bot
+
 def main():
+    # Without it PTB would register its local address (https://<listen>:<port>/<path>) in Telegram
+    if BOT_MODE == 'webhook' and not WEBHOOK_URL:
+        print("WEBHOOK_URL is required in webhook mode (BOT_MODE=webhook): the public HTTPS URL Telegram posts to")
+        return None
+
     # --------------------------------------------------------------------------------------- Database initialization
     db = DatabaseHandler()
     try:
-        # Create tables: Users, Audios, <Images - in case of being needed> 
+        # Create tables: Users, Audios, Images
         db.create_tables()              
     
     except Exception as db_error:
@@ -127,20 +632,23 @@ def main():
     # ====================================================================================== Start the SrVladyslav Bot
     try:
         print("Starting the SrVladyslav Bot")
-        telegram_bot = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-        # ---------------------------------------------------------------------------------- Adding the bot handlers
-        telegram_bot.add_handler(MessageHandler(filters.VOICE, audio_message))             # Audio filtering task
-        telegram_bot.add_handler(MessageHandler(filters.PHOTO, image_message))             # Image filtering task
-
-        telegram_bot.add_error_handler(error_handler)
-        # telegram_bot.add_handler(CommandHandler("adb", audioDBCount))                    # /adb   returns the Audio Db count for your ID, (Dev. HELPER)
+        telegram_bot = build_application(TELEGRAM_BOT_TOKEN, TELEGRAM_BASE_URL, TELEGRAM_BASE_FILE_URL)
         # ---------------------------------------------------------------------------------- Run the bot until Ctrl-C is pressed
         print("The bot is running... Press Ctrl-C to stop.")
-        telegram_bot.run_polling(allowed_updates=Update.ALL_TYPES)
+        if BOT_MODE == 'webhook':
+            telegram_bot.run_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=WEBHOOK_URL,
+                secret_token=WEBHOOK_SECRET_TOKEN,
+                allowed_updates=ALLOWED_UPDATES,
+            )
+        else:
+            telegram_bot.run_polling(allowed_updates=ALLOWED_UPDATES)
         
     except Exception as e:
         print(f"An error occurred while initializing the bot: {e}")
 
-
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,16 @@
+import sys
+import os
+import pytest
+
+# The tests import the bot modules from the repo root (e.g. `data.job_queue`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from data.database_handler import DatabaseHandler
+
+@pytest.fixture
+def db(tmp_path):
+    """A new DB in a temporary folder, with all the migrations applied."""
+    db = DatabaseHandler(str(tmp_path / 'database_test.db'))
+    db.create_tables()
+    yield db
+    DatabaseHandler.close_all()
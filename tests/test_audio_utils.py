@@ -0,0 +1,37 @@
+from utils.audio_utils import AudioUtils, AudioDecodeError
+import utils.audio_utils as audio_utils
+import soundfile as sf
+import numpy as np
+import asyncio
+import pytest
+import io
+import os
+
+def voice_note() -> bytearray:
+    buffer = io.BytesIO()
+    sf.write(buffer, np.zeros(16000, dtype='float32'), 48000, format='OGG', subtype='OPUS')
+    return bytearray(buffer.getvalue())
+
+def test_original_audio_not_written_leaves_no_record(db, tmp_path, monkeypatch):
+    au = AudioUtils(base_dir=str(tmp_path), db=db, storage_format='opus')
+    monkeypatch.setattr(audio_utils, 'write_file_atomic', lambda path, data: False)
+    assert asyncio.run(au.processAudio(voice_note(), 1)) is None
+    assert db.getUserAudioCount(1) == 0
+    assert os.listdir(au.audioFolder(1)) == []
+
+def test_original_audio_is_stored_once_complete(db, tmp_path):
+    au = AudioUtils(base_dir=str(tmp_path), db=db, storage_format='opus')
+    spool_path = tmp_path / 'audio.spool'
+    spool_path.write_bytes(voice_note())
+    path = asyncio.run(au.processAudio(str(spool_path), 1))
+    assert path == au.audioPath(1, 'audio_message_0', 'opus')
+    assert os.listdir(au.audioFolder(1)) == ['audio_message_0.ogg']
+    assert db.getUserAudioCount(1) == 1
+
+@pytest.mark.parametrize('storage_format', ['wav24', 'opus'])
+def test_undecodable_audio_raises_decode_error(db, tmp_path, storage_format):
+    au = AudioUtils(base_dir=str(tmp_path), db=db, storage_format=storage_format)
+    garbage = bytearray(b'OggS' + os.urandom(4000)) if storage_format == 'opus' else bytearray(os.urandom(4000))
+    with pytest.raises(AudioDecodeError):
+        asyncio.run(au.processAudio(garbage, 1))
+    assert db.getUserAudioCount(1) == 0
@@ -0,0 +1,40 @@
+from utils.cache_utils import TTLCache
+
+def test_ttl_cache_skips_the_values_invalidated_while_read():
+    cache = TTLCache(ttl=60)
+    generation = cache.generation('user')
+    cache.pop('user')     # e.g. an insert committed during the read
+    cache.put('user', 'stale', generation)
+    assert cache.get('user') is None
+
+    generation = cache.generation('user')
+    cache.put('user', 'fresh', generation)
+    assert cache.get('user') == 'fresh'
+
+def test_ttl_cache_clear_invalidates_the_reads_in_progress():
+    cache = TTLCache(ttl=60)
+    generation = cache.generation('totals')
+    cache.clear()
+    cache.put('totals', 'stale', generation)
+    assert cache.get('totals') is None
+
+def test_user_stats_read_during_an_insert_is_not_cached(db):
+    db.postUserAudio(1)
+    read = db._pool.read
+    def read_during_insert(func, *args):
+        value = read(func, *args)
+        db.postUserAudio(1)   # Committed after the snapshot, before the value is cached
+        return value
+    db._pool.read = read_during_insert
+    assert db.getUserStats(1)['audios'] == 1
+    db._pool.read = read
+    assert db.getUserStats(1)['audios'] == 2
+
+def test_totals_and_recent_activity_are_invalidated_on_insert(db):
+    db.postUserAudio(1)
+    assert db.getTotals()['audios'] == 1
+    assert db.getRecentActivity(24)['audios'] == 1
+    db.postUserAudio(1)
+    assert db.getUserStats(1)['audios'] == 2
+    assert db.getTotals()['audios'] == 2
+    assert db.getRecentActivity(24)['audios'] == 2
@@ -0,0 +1,152 @@
+from data.job_queue import JobQueue, JobFailed
+import asyncio
+import time
+
+def claim(db, now:float=None) -> dict:
+    return asyncio.run(db.claimJobAsync(now if now is not None else time.time()))
+
+def finish(db, job:dict, status:str='done', run_after:float=0):
+    assert asyncio.run(db.updateJobAsync(job['id'], status, run_after=run_after))
+
+# =========================================================================================== CLAIM
+def test_post_job_is_idempotent(db):
+    assert db.postJob('audio', 'audio:1:1', 1, {'file_id': 'a'}) > 0
+    assert db.postJob('audio', 'audio:1:1', 1, {'file_id': 'a'}) == 0
+    assert db.getJobCounts() == {'pending': 1}
+
+def test_claim_runs_the_jobs_of_a_user_in_order(db):
+    db.postJob('audio', 'audio:1:1', 1, {'n': 1})
+    db.postJob('audio', 'audio:1:2', 1, {'n': 2})
+    db.postJob('audio', 'audio:2:1', 2, {'n': 3})
+
+    first = claim(db)
+    assert first['key'] == 'audio:1:1' and first['attempts'] == 1
+    # User 1 has a running job, the next one is the other user's
+    assert claim(db)['key'] == 'audio:2:1'
+    assert claim(db) is None
+
+    finish(db, first)
+    assert claim(db)['payload'] == {'n': 2}
+
+def test_retry_waits_for_run_after(db):
+    db.postJob('audio', 'audio:1:1', 1, {})
+    db.postJob('audio', 'audio:1:2', 1, {})
+    now = time.time()
+    job = claim(db, now)
+    finish(db, job, 'pending', run_after=now + 60)
+
+    # Neither the retry nor the next job of the same user are run before `run_after`
+    assert claim(db, now) is None
+    retried = claim(db, now + 61)
+    assert retried['key'] == 'audio:1:1' and retried['attempts'] == 2
+
+def test_reset_running_jobs(db):
+    db.postJob('audio', 'audio:1:1', 1, {})
+    db.postJob('audio', 'audio:2:1', 2, {})
+    claim(db)
+    claim(db)
+    assert db.resetRunningJobs() == 2
+    assert db.getJobCounts() == {'pending': 2}
+    assert claim(db)['attempts'] == 2
+
+# =========================================================================================== QUEUE
+def run_queue(queue:JobQueue, jobs:list, timeout:float=5) -> dict:
+    """Starts the queue, enqueues the jobs (kind, key, user_id, payload) and waits until they finish."""
+    async def run():
+        queue.start()
+        try:
+            results = [await queue.enqueue(*job) for job in jobs]
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                counts = queue.counts()
+                if not counts.get('pending') and not counts.get('running'):
+                    break
+                await asyncio.sleep(0.01)
+            return results
+        finally:
+            await queue.stop()
+    return asyncio.run(run())
+
+def test_queue_retries_failed_jobs(db):
+    runs = []
+    async def flaky(job):
+        runs.append(job['attempts'])
+        if job['attempts'] < 3:
+            raise OSError('disk full')
+
+    queue = JobQueue(db, workers=2, max_attempts=5, retry_delay=0, poll_interval=0.01)
+    queue.register('audio', flaky)
+    run_queue(queue, [('audio', 'audio:1:1', 1, {})])
+    assert runs == [1, 2, 3]
+    assert queue.counts() == {'done': 1}
+
+def test_queue_gives_up(db):
+    async def broken(job):
+        if job['key'] == 'audio:1:1':
+            raise JobFailed('undecodable audio')
+        raise OSError('disk full')
+
+    failed = []
+    async def cleanup(job):
+        failed.append((job['key'], job['attempts']))
+
+    queue = JobQueue(db, workers=2, max_attempts=2, retry_delay=0, poll_interval=0.01)
+    queue.register('audio', broken, on_failed=cleanup)
+    run_queue(queue, [('audio', 'audio:1:1', 1, {}), ('audio', 'audio:2:1', 2, {})])
+    assert queue.counts() == {'failed': 2}
+    # The cleanup runs once, when the job fails for good
+    assert sorted(failed) == [('audio:1:1', 1), ('audio:2:1', 2)]
+
+def test_queue_keeps_the_order_of_a_user(db):
+    order = []
+    async def record(job):
+        order.append(job['payload']['n'])
+        await asyncio.sleep(0.001)
+
+    queue = JobQueue(db, workers=4, poll_interval=0.01)
+    queue.register('audio', record)
+    run_queue(queue, [('audio', f'audio:1:{n}', 1, {'n': n}) for n in range(10)])
+    assert order == list(range(10))
+
+def test_queue_refuses_jobs_when_full(db):
+    queue = JobQueue(db, max_pending=2)
+    async def enqueue():
+        # Not started, the jobs stay pending
+        return [await queue.enqueue('audio', f'audio:1:{n}', 1, {}) for n in range(3)]
+    assert asyncio.run(enqueue()) == [True, True, False]
+
+def test_recover_runs_the_interrupted_jobs(db):
+    db.postJob('audio', 'audio:1:1', 1, {})
+    claim(db)   # Running when the bot "crashed"
+    done = []
+    async def handler(job):
+        done.append(job['key'])
+
+    queue = JobQueue(db, poll_interval=0.01)
+    queue.register('audio', handler)
+    assert queue.recover() == 1
+    run_queue(queue, [])
+    assert done == ['audio:1:1']
+
+def test_enqueue_wakes_an_idle_worker(db):
+    done = []
+    async def handler(job):
+        done.append(job['key'])
+
+    # Much longer than the test: the jobs can only be found thanks to the wake ups
+    queue = JobQueue(db, workers=4, poll_interval=30, stop_timeout=1)
+    queue.register('audio', handler)
+    async def run():
+        queue.start()
+        await asyncio.sleep(0.05)   # The workers are idle
+        try:
+            for n in range(5):
+                await queue.enqueue('audio', f'audio:{n}:1', n, {})
+                await asyncio.sleep(0)
+            deadline = time.monotonic() + 2
+            while len(done) < 5 and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+        finally:
+            await queue.stop()
+    asyncio.run(run())
+    assert sorted(done) == [f'audio:{n}:1' for n in range(5)]
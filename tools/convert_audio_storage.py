@@ -0,0 +1,125 @@
+"""
+Converts the stored audios to another storage format (see AUDIO_STORAGE_FORMAT), e.g.
+the existing 24-bit WAV files to FLAC, and records the new format of every audio in the DB.
+
+Usage (from the repo root, better with the bot stopped):
+    python -m tools.convert_audio_storage --to flac
+    python -m tools.convert_audio_storage --to wav16 --from wav24 --dry-run
+    python -m tools.convert_audio_storage --to opus --lossy      # Encodes the WAV/FLAC files as Opus
+
+Every file is converted into a temporary file, renamed, recorded in the DB, and only
+then the old file is removed, so an interrupted run can simply be run again.
+"""
+from data.database_handler import DatabaseHandler, AUDIO_FORMAT_EXTENSIONS
+from utils.audio_utils import AudioUtils, resample_audio, SOUNDFILE_FORMATS
+from concurrent.futures import ThreadPoolExecutor
+import soundfile as sf
+import tempfile
+import argparse
+import os
+
+def convert_file(src_path:str, dest_path:str, audio_format:str, sampling_rate:int=16000) -> int:
+    """Converts a stored audio into the given format (blocking).
+
+    Args:
+        src_path (str): Path of the stored audio, in any storage format.
+        dest_path (str): Path of the converted audio, it can be the same as `src_path`.
+        audio_format (str): Target storage format, see AUDIO_FORMAT_EXTENSIONS.
+        sampling_rate (int, optional): Sampling rate of the stored audios. Defaults to 16000.
+
+    Returns:
+        int: Size in bytes of the converted file.
+    """
+    audio_wave = resample_audio(src_path, sampling_rate)
+    if audio_format == 'opus':
+        # NOTE: Lossy, the original voice note is not available anymore
+        file_format, subtype = 'OGG', 'OPUS'
+    else:
+        file_format, subtype = SOUNDFILE_FORMATS[audio_format]
+        if file_format == 'FLAC' and sf.info(src_path).subtype == 'PCM_16':
+            # A 16-bit WAV is kept 16-bit, 24 bits would only make the FLAC file bigger
+            subtype = 'PCM_16'
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest_path), prefix='.tmp_', suffix=AUDIO_FORMAT_EXTENSIONS[audio_format])
+    os.close(fd)
+    try:
+        sf.write(tmp_path, audio_wave, sampling_rate, format=file_format, subtype=subtype)
+        os.replace(tmp_path, dest_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return os.path.getsize(dest_path)
+
+def convert_audio(au:AudioUtils, db:DatabaseHandler, audio:dict, audio_format:str, dry_run:bool=False) -> tuple:
+    """Converts a single audio (a row of `DatabaseHandler.getAudiosToConvert`).
+
+    Returns:
+        tuple: (bytes before, bytes after), None if the audio could not be converted.
+    """
+    src_path = au.audioPath(audio['u_id'], audio['a_name'], audio['a_format'])
+    dest_path = au.audioPath(audio['u_id'], audio['a_name'], audio_format)
+    if not os.path.isfile(src_path):
+        print(f'Missing file {src_path}')
+        return None
+    size_before = os.path.getsize(src_path)
+    if dry_run:
+        return size_before, size_before
+
+    try:
+        size_after = convert_file(src_path, dest_path, audio_format)
+    except (RuntimeError, OSError) as e:
+        # Log: The audio could not be converted, it keeps its old format
+        print(f'Error converting {src_path}: {e}')
+        return None
+    if not db.updateAudioFormat(audio['a_id'], audio_format):
+        return None
+    if src_path != dest_path:
+        os.remove(src_path)
+    return size_before, size_after
+
+def main():
+    parser = argparse.ArgumentParser(description='Converts the stored audios to another storage format.')
+    parser.add_argument('--to', required=True, choices=sorted(AUDIO_FORMAT_EXTENSIONS), help='Target storage format.')
+    parser.add_argument('--from', dest='source', choices=sorted(AUDIO_FORMAT_EXTENSIONS), default=None,
+                        help='Convert only the audios in this format. Defaults to all of them.')
+    parser.add_argument('--lossy', action='store_true', help='Allow the lossy conversion to Opus.')
+    parser.add_argument('--dry-run', action='store_true', help='Only count the audios and their size.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Files converted in parallel.')
+    parser.add_argument('--batch-size', type=int, default=500, help='Audios read from the DB at a time.')
+    parser.add_argument('--db', default=None, help='DB path. Defaults to DB_PATH or the production DB.')
+    parser.add_argument('--base-dir', default=None, help='Folder with data/audio_data. Defaults to the repo root.')
+    args = parser.parse_args()
+
+    if args.to == 'opus' and not args.lossy:
+        parser.error('Converting to Opus is lossy (the original voice notes are not stored), use --lossy')
+
+    db = DatabaseHandler(args.db)
+    db.create_tables()
+    au = AudioUtils(base_dir=args.base_dir, db=db)
+
+    converted, failed, size_before, size_after = 0, 0, 0, 0
+    after_rowid = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        while True:
+            audios = db.getAudiosToConvert(args.to, after_rowid=after_rowid, limit=args.batch_size)
+            if not audios:
+                break
+            after_rowid = audios[-1]['rowid']
+            audios = [audio for audio in audios if args.source is None or audio['a_format'] == args.source]
+            # NOTE: soxr and libsndfile release the GIL, so the threads convert in parallel
+            for result in pool.map(lambda audio: convert_audio(au, db, audio, args.to, args.dry_run), audios):
+                if result is None:
+                    failed += 1
+                    continue
+                converted += 1
+                size_before += result[0]
+                size_after += result[1]
+            print(f'{converted} audios converted, {failed} failed...')
+
+    DatabaseHandler.close_all()
+    action = 'To convert' if args.dry_run else 'Converted'
+    print(f'{action}: {converted} audios ({size_before / 2**20:.1f}MB -> {size_after / 2**20:.1f}MB), {failed} failed')
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,367 @@
+"""
+Exports the stored dataset (the users' audios and the face images) into shards, to train
+on it without walking the data folders:
+    - tar: WebDataset style tar shards, every sample is a `<key>.wav` (16kHz int16 PCM) or
+      `<key>.jpg` member plus a `<key>.json` member with its metadata (user, timestamp, faces...).
+    - npy: memory-mappable `audio-NNNNNN.npy` shards with the audios (16kHz int16) one after
+      the other, and an `audio-NNNNNN.jsonl` index with the offset and length of every audio.
+      The images are always exported as tar shards.
+
+Usage (from the repo root):
+    python -m tools.export_dataset --output /datasets/voices --format npy --kind audio
+    python -m tools.export_dataset --output /datasets/faces --kind images --user 1234 --since 2024-05-01
+    python -m tools.export_dataset --output /datasets/voices --format npy --kind audio  # Only the new audios
+
+The rows are read from the DB page by page and the files decoded in a bounded window, so
+the memory used does not depend on the dataset size. Every shard is written into a temporary
+file and renamed once complete, and the last exported row is saved (`export_state.json` in the
+output folder) after every shard, so the next run only exports what was added since then.
+The state is only valid for the same filters (--user, --since, --until): a run with other
+filters is refused, use --full (or another output folder) to export them.
+"""
+from data.database_handler import DatabaseHandler
+from utils.audio_utils import AudioUtils, resample_audio
+from concurrent.futures import ThreadPoolExecutor
+from utils.file_utils import write_file_atomic
+import soundfile as sf
+import numpy as np
+import itertools
+import argparse
+import tarfile
+import time
+import json
+import io
+import os
+
+SAMPLING_RATE = 16000
+STATE_FILE = 'export_state.json'
+
+def load_audio_int16(path:str, sampling_rate:int=SAMPLING_RATE) -> np.ndarray:
+    """Decodes a stored audio (any storage format) as mono int16 samples at `sampling_rate`."""
+    info = sf.info(path)
+    if info.samplerate == sampling_rate and info.channels == 1:
+        # The WAV/FLAC files are already stored at 16kHz, read them as they are
+        audio_wave, _ = sf.read(path, dtype='int16')
+        return audio_wave
+    audio_wave = resample_audio(path, sampling_rate)
+    return (np.clip(audio_wave, -1.0, 1.0) * 32767).astype(np.int16)
+
+# =========================================================================================== SHARD WRITERS
+class TarShardWriter:
+    """Writes the samples into WebDataset style tar shards: `<prefix>-NNNNNN.tar`."""
+    def __init__(self, output_dir:str, prefix:str, shard_size:int, max_shard_bytes:int):
+        self._output_dir = output_dir
+        self._prefix = prefix
+        self._shard_size = shard_size
+        self._max_shard_bytes = max_shard_bytes
+        self._tar = None
+        self._path = None
+        self._samples = 0
+        self._bytes = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self._tar is not None
+
+    @property
+    def full(self) -> bool:
+        return self._samples >= self._shard_size or self._bytes >= self._max_shard_bytes
+
+    def open(self, shard_index:int):
+        self._path = os.path.join(self._output_dir, f'{self._prefix}-{shard_index:06d}.tar')
+        self._tar = tarfile.open(self._path + '.tmp', mode='w', format=tarfile.PAX_FORMAT)
+        self._samples = 0
+        self._bytes = 0
+
+    def add(self, key:str, members:dict):
+        """Adds a sample: its members as {extension: bytes}, e.g. {'wav': ..., 'json': ...}."""
+        mtime = time.time()
+        for extension, data in members.items():
+            member = tarfile.TarInfo(f'{key}.{extension}')
+            member.size = len(data)
+            member.mtime = mtime
+            self._tar.addfile(member, io.BytesIO(data))
+            self._bytes += len(data)
+        self._samples += 1
+
+    def close(self) -> str:
+        """Closes the current shard, returns its path."""
+        self._tar.close()
+        self._tar = None
+        os.replace(self._path + '.tmp', self._path)
+        return self._path
+
+class NpyShardWriter:
+    """
+        Writes the audios one after the other into `<prefix>-NNNNNN.npy` (a 1-D int16 array,
+        it can be opened with `np.load(path, mmap_mode='r')`), and an `<prefix>-NNNNNN.jsonl`
+        index with a line per audio: its metadata plus `offset` and `frames` in the array.
+    """
+    def __init__(self, output_dir:str, prefix:str, shard_size:int, max_shard_bytes:int):
+        self._output_dir = output_dir
+        self._prefix = prefix
+        self._shard_size = shard_size
+        self._max_shard_bytes = max_shard_bytes
+        self._array_file = None
+        self._index_file = None
+        self._path = None
+        self._header_size = 0
+        self._samples = 0
+        self._frames = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self._array_file is not None
+
+    @property
+    def full(self) -> bool:
+        return self._samples >= self._shard_size or self._frames * 2 >= self._max_shard_bytes
+
+    def _write_header(self):
+        header = {'descr': np.dtype(np.int16).str, 'fortran_order': False, 'shape': (self._frames,)}
+        self._array_file.seek(0)
+        np.lib.format.write_array_header_1_0(self._array_file, header)
+        return self._array_file.tell()
+
+    def open(self, shard_index:int):
+        self._path = os.path.join(self._output_dir, f'{self._prefix}-{shard_index:06d}')
+        self._array_file = open(self._path + '.npy.tmp', 'wb')
+        self._index_file = open(self._path + '.jsonl.tmp', 'w')
+        self._samples = 0
+        self._frames = 0
+        # NOTE: The header is padded to 64 bytes, its size does not change with the final shape
+        self._header_size = self._write_header()
+
+    def add(self, audio_wave:np.ndarray, metadata:dict):
+        audio_wave = np.ascontiguousarray(audio_wave, dtype='<i2')
+        self._array_file.write(audio_wave.tobytes())
+        self._index_file.write(json.dumps(dict(metadata, offset=self._frames, frames=len(audio_wave))) + '\n')
+        self._frames += len(audio_wave)
+        self._samples += 1
+
+    def close(self) -> str:
+        """Writes the final shape in the header and closes the current shard, returns its path."""
+        if self._write_header() != self._header_size:
+            raise RuntimeError(f'The header of {self._path}.npy changed its size')
+        self._array_file.close()
+        self._index_file.close()
+        self._array_file = self._index_file = None
+        # The index is renamed last: an audio shard is complete when its index exists
+        os.replace(self._path + '.npy.tmp', self._path + '.npy')
+        os.replace(self._path + '.jsonl.tmp', self._path + '.jsonl')
+        return self._path + '.npy'
+
+# =========================================================================================== EXPORT
+class ExportFiltersChanged(Exception):
+    """Raised by an incremental export whose filters are not the ones of the previous export
+    into the same folder, the rows skipped by the previous filters would never be exported."""
+
+class DatasetExporter:
+    """
+        Exports the audios and/or images of the DB into shards of the output folder,
+        from the last row exported into it (see `export_state.json`).
+    """
+    def __init__(self, db:DatabaseHandler, output_dir:str, base_dir:str=None, shard_format:str='tar',
+                 shard_size:int=1000, max_shard_bytes:int=1 << 30, workers:int=None, full:bool=False):
+        self._db = db
+        self._output_dir = output_dir
+        self._base_dir = base_dir or os.path.dirname( os.path.dirname(os.path.realpath(__file__)) )
+        self._audio_utils = AudioUtils(base_dir=self._base_dir, db=db)
+        self._shard_format = shard_format
+        self._shard_size = shard_size
+        self._max_shard_bytes = max_shard_bytes
+        self._workers = workers or os.cpu_count() or 1
+        self._state_path = os.path.join(output_dir, STATE_FILE)
+        self._state = {} if full else self._load_state()
+
+    def _load_state(self) -> dict:
+        if not os.path.isfile(self._state_path):
+            return {}
+        with open(self._state_path) as state_file:
+            return json.load(state_file)
+
+    def _save_state(self, kind:str, filters:dict, last_rowid:int, next_shard:int):
+        self._state[kind] = {'last_rowid': last_rowid, 'next_shard': next_shard, 'filters': filters,
+                             'exported_at': time.time()}
+        write_file_atomic(self._state_path, json.dumps(self._state, indent=2).encode())
+
+    def _resume(self, kind:str, filters:dict) -> int:
+        """Returns the last rowid exported with these filters (0 if nothing was exported).
+
+        Raises:
+            ExportFiltersChanged: If the previous export into the folder used other filters.
+        """
+        state = self._state.get(kind)
+        if state is None:
+            return 0
+        # NOTE: The states saved before the filters were recorded are unfiltered exports
+        previous = state.get('filters', {'users': None, 'since': None, 'until': None})
+        if previous != filters:
+            raise ExportFiltersChanged(
+                f'The {kind} export in {self._output_dir} used the filters {previous}, not {filters}: '
+                'use --full to export everything again, or another output folder'
+            )
+        return state['last_rowid']
+
+    @staticmethod
+    def _filters(user_ids:list, since:str, until:str) -> dict:
+        return {'users': sorted(set(user_ids)) if user_ids else None, 'since': since, 'until': until}
+
+    def _export(self, kind:str, filters:dict, rows, writer, load, add, is_duplicate=None) -> dict:
+        """Exports the given rows, `load(row)` reads the file of a row (in the worker threads)
+        and `add(writer, row, data)` adds it to the current shard. The rows for which
+        `is_duplicate(row)` is True are skipped, their file is not read."""
+        state = self._state.get(kind, {})
+        shard_index = state.get('next_shard', 0)
+        last_rowid = state.get('last_rowid', 0)
+        stats = {'exported': 0, 'missing': 0, 'duplicates': 0, 'shards': []}
+
+        with ThreadPoolExecutor(max_workers=self._workers) as pool:
+            # NOTE: Only a window of files is decoded at a time, in order
+            window = self._workers * 4
+            while True:
+                batch = list(itertools.islice(rows, window))
+                if not batch:
+                    break
+                duplicates = [is_duplicate is not None and is_duplicate(row) for row in batch]
+                loaded = pool.map(load, [row for row, duplicate in zip(batch, duplicates) if not duplicate])
+                for row, duplicate in zip(batch, duplicates):
+                    data = None if duplicate else next(loaded)
+                    if duplicate:
+                        stats['duplicates'] += 1
+                    elif data is None:
+                        stats['missing'] += 1
+                    else:
+                        if not writer.is_open:
+                            writer.open(shard_index)
+                        add(writer, row, data)
+                        stats['exported'] += 1
+                    last_rowid = row['rowid']
+                    if writer.is_open and writer.full:
+                        stats['shards'].append(writer.close())
+                        shard_index += 1
+                        self._save_state(kind, filters, last_rowid, shard_index)
+
+        if writer.is_open:
+            stats['shards'].append(writer.close())
+            shard_index += 1
+        self._save_state(kind, filters, last_rowid, shard_index)
+        return stats
+
+    def exportAudios(self, user_ids:list=None, since:str=None, until:str=None) -> dict:
+        """Exports the (new) audios of the DB.
+
+        Args:
+            user_ids (list, optional): Only the audios of these users. Defaults to all.
+            since (str, optional): Only the audios from this UTC timestamp ('YYYY-MM-DD[ HH:MM:SS]').
+            until (str, optional): Only the audios before this UTC timestamp.
+
+        Returns:
+            dict: Number of audios exported and missing (no file), and the written shards.
+
+        Raises:
+            ExportFiltersChanged: If the previous export into the folder used other filters.
+        """
+        filters = self._filters(user_ids, since, until)
+        after_rowid = self._resume('audio', filters)
+        rows = self._db.iterAudios(user_ids, since, until, after_rowid=after_rowid)
+        writer_class = NpyShardWriter if self._shard_format == 'npy' else TarShardWriter
+        writer = writer_class(self._output_dir, 'audio', self._shard_size, self._max_shard_bytes)
+
+        def load(audio:dict):
+            path = self._audio_utils.audioPath(audio['u_id'], audio['a_name'], audio['a_format'])
+            try:
+                return load_audio_int16(path)
+            except (RuntimeError, OSError) as e:
+                # Log: The audio file is missing or can not be decoded, it's skipped
+                print(f'Error reading {path}: {e}')
+                return None
+
+        def add(writer, audio:dict, audio_wave:np.ndarray):
+            metadata = {'u_id': audio['u_id'], 'a_name': audio['a_name'], 'a_timestamp': audio['a_timestamp'],
+                        'a_format': audio['a_format'], 'sampling_rate': SAMPLING_RATE}
+            if isinstance(writer, NpyShardWriter):
+                writer.add(audio_wave, metadata)
+                return
+            wav_file = io.BytesIO()
+            sf.write(wav_file, audio_wave, SAMPLING_RATE, format='WAV', subtype='PCM_16')
+            metadata['frames'] = len(audio_wave)
+            writer.add(f"{audio['u_id']}_{audio['a_name']}", {'wav': wav_file.getvalue(), 'json': json.dumps(metadata).encode()})
+
+        return self._export('audio', filters, rows, writer, load, add)
+
+    def exportImages(self, user_ids:list=None, since:str=None, until:str=None) -> dict:
+        """Exports the (new) images of the DB into tar shards, see `exportAudios`."""
+        filters = self._filters(user_ids, since, until)
+        after_rowid = self._resume('images', filters)
+        rows = self._db.iterImages(user_ids, since, until, after_rowid=after_rowid)
+        writer = TarShardWriter(self._output_dir, 'images', self._shard_size, self._max_shard_bytes)
+
+        def load(image:dict):
+            path = f"{self._base_dir}/data/image_data/{image['i_name']}.jpg"
+            try:
+                with open(path, 'rb') as image_file:
+                    return image_file.read()
+            except OSError as e:
+                # Log: The image file is missing, it's skipped
+                print(f'Error reading {path}: {e}')
+                return None
+
+        def add(writer, image:dict, data:bytes):
+            metadata = {'u_id': image['u_id'], 'i_name': image['i_name'], 'i_timestamp': image['i_timestamp'],
+                        'i_width': image['i_width'], 'i_height': image['i_height'],
+                        'i_faces': image['i_faces'], 'i_hash': image['i_hash']}
+            # NOTE: Keyed by i_id, the same i_name can be in several rows (see `linkUserImage`)
+            writer.add(image['i_id'], {'jpg': data, 'json': json.dumps(metadata).encode()})
+
+        # A photo sent again is linked to the same file, it's exported once per run
+        exported_names = set()
+        def is_duplicate(image:dict) -> bool:
+            if image['i_name'] in exported_names:
+                return True
+            exported_names.add(image['i_name'])
+            return False
+
+        return self._export('images', filters, rows, writer, load, add, is_duplicate)
+
+def main():
+    parser = argparse.ArgumentParser(description='Exports the audios and face images into dataset shards.')
+    parser.add_argument('--output', required=True, help='Output folder of the shards (and the export state).')
+    parser.add_argument('--format', choices=['tar', 'npy'], default='tar',
+                        help='Audio shards: WebDataset tar or memory-mappable npy. The images are always tar.')
+    parser.add_argument('--kind', choices=['audio', 'images', 'all'], default='all', help='What to export.')
+    parser.add_argument('--user', type=int, action='append', default=None, help='Only this user (repeatable).')
+    parser.add_argument('--since', default=None, help="Only the media from this UTC time, e.g. '2024-05-01 12:00:00'.")
+    parser.add_argument('--until', default=None, help='Only the media before this UTC time.')
+    parser.add_argument('--shard-size', type=int, default=1000, help='Max samples per shard.')
+    parser.add_argument('--max-shard-mb', type=int, default=1024, help='Max size of a shard, in MB.')
+    parser.add_argument('--full', action='store_true', help='Export everything again, ignoring the previous export.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Files decoded in parallel.')
+    parser.add_argument('--db', default=None, help='DB path. Defaults to DB_PATH or the production DB.')
+    parser.add_argument('--base-dir', default=None, help='Folder with data/audio_data and data/image_data. Defaults to the repo root.')
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    db = DatabaseHandler(args.db)
+    db.create_tables()
+    exporter = DatasetExporter(db, args.output, base_dir=args.base_dir, shard_format=args.format,
+                               shard_size=args.shard_size, max_shard_bytes=args.max_shard_mb << 20,
+                               workers=args.workers, full=args.full)
+    kinds = ['audio', 'images'] if args.kind == 'all' else [args.kind]
+    try:
+        for kind in kinds:
+            export = exporter.exportAudios if kind == 'audio' else exporter.exportImages
+            try:
+                stats = export(args.user, args.since, args.until)
+            except ExportFiltersChanged as e:
+                # Log: Incremental export with other filters
+                print(f'{kind}: {e}')
+                return 2
+            print(f"{kind}: {stats['exported']} exported into {len(stats['shards'])} shards, {stats['missing']} missing, "
+                  f"{stats['duplicates']} duplicates")
+    finally:
+        DatabaseHandler.close_all()
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,152 @@
+from utils.cache_utils import LRUCache
+from utils.metrics import METRICS
+import time
+import os
+
+class TokenBucket:
+    """Token bucket rate limiter: `burst` tokens, refilled at `rate` tokens per second."""
+    def __init__(self, rate:float, burst:float, now:float=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now if now is not None else time.monotonic()
+
+    def take(self, now:float=None) -> bool:
+        """Takes a token if there is one.
+
+        Returns:
+            bool: True if the token was taken, False if the bucket is empty.
+        """
+        now = now if now is not None else time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self) -> float:
+        """Seconds until the next token is available."""
+        return max(0.0, (1 - self.tokens) / self.rate) if self.rate > 0 else float('inf')
+
+class Admission:
+    """Result of `AdmissionController.admit`, an admitted media must be `release`d."""
+    def __init__(self, controller, reason:str=None, retry_after:float=0.0, notified:bool=False):
+        self._controller = controller
+        self.reason = reason            # None if admitted: 'too_big', 'too_long', 'rate_limited' or 'busy'
+        self.retry_after = retry_after  # Seconds until the user can send media again (rate_limited)
+        self.notified = notified        # The user was already told (e.g. another photo of the same album)
+
+    @property
+    def admitted(self) -> bool:
+        return self.reason is None
+
+    def release(self):
+        if self.admitted and self._controller is not None:
+            self._controller._release()
+            self._controller = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class AdmissionController:
+    """
+        Admission control in front of the media handlers, so a single user (or a burst of
+        users) can't saturate the media workers and the DB for everyone. It's checked from
+        the Telegram media info, before downloading anything:
+            - The media limits: `max_file_size` bytes and `max_audio_duration` seconds.
+            - A token bucket per user: `user_rate` media per minute, with bursts of `user_burst`.
+              An album (the photos with the same `media_group_id`) takes a single token.
+            - A global cap of media updates in flight (admitted and not released yet), by
+              default the media executor capacity (see `bindCapacity`).
+
+        NOTE: Not thread-safe, it's meant to be used from the event loop.
+    """
+    def __init__(self, user_rate:float=None, user_burst:float=None, max_in_flight:int=None,
+                 max_file_size:int=None, max_audio_duration:int=None, max_users:int=None):
+        # Media per minute per user, 0 = no per user limit
+        self._user_rate = (user_rate if user_rate is not None else float(os.getenv('ADMISSION_USER_RATE', 20))) / 60
+        self._user_burst = user_burst or float(os.getenv('ADMISSION_USER_BURST', 5))
+        # None = set from the media executor capacity, 0 = no global limit
+        max_in_flight = max_in_flight if max_in_flight is not None else os.getenv('ADMISSION_MAX_IN_FLIGHT')
+        self._max_in_flight = int(max_in_flight) if max_in_flight is not None else None
+        # Telegram bots can't download files bigger than 20MB anyway
+        self._max_file_size = max_file_size or int(os.getenv('MAX_MEDIA_FILE_SIZE', 20 * 1024 * 1024))
+        self._max_audio_duration = max_audio_duration or int(os.getenv('MAX_AUDIO_DURATION', 600))
+        # NOTE: The least active users are forgotten (their bucket starts full again)
+        self._buckets = LRUCache(max_users or int(os.getenv('ADMISSION_MAX_USERS', 10000)))
+        # Token bucket result of the recent albums: (user_id, media_group_id) -> rejection or None
+        self._albums = LRUCache(1024)
+        self._in_flight = 0
+
+    def bindCapacity(self, capacity:int):
+        """Ties the global in-flight cap to the media executor capacity, unless it was configured."""
+        if self._max_in_flight is None:
+            self._max_in_flight = capacity
+
+    @property
+    def in_flight(self) -> int:
+        """Number of admitted media updates not released yet."""
+        return self._in_flight
+
+    @property
+    def max_audio_duration(self) -> int:
+        return self._max_audio_duration
+
+    @property
+    def max_file_size(self) -> int:
+        return self._max_file_size
+
+    # =========================================================================================== ADMISSION
+    def admit(self, user_id:int, media:str, file_size:int=None, duration:int=None, media_group_id:str=None) -> Admission:
+        """Decides if the user's media is processed now.
+
+        Args:
+            user_id (int): The user who sent the media.
+            media (str): 'audio' or 'image', for the metrics.
+            file_size (int, optional): Media size in bytes, as told by Telegram.
+            duration (int, optional): Audio duration in seconds, as told by Telegram.
+            media_group_id (str, optional): Album of the media, the whole album takes one token.
+
+        Returns:
+            Admission: `admitted` is True if it can be processed (release it once done),
+                otherwise `reason` tells why it was rejected.
+        """
+        if (file_size or 0) > self._max_file_size:
+            return self._reject(media, 'too_big')
+        if (duration or 0) > self._max_audio_duration:
+            return self._reject(media, 'too_long')
+
+        # The global cap is checked first, so a rejected media does not spend the user's tokens
+        if self._max_in_flight and self._in_flight >= self._max_in_flight:
+            return self._reject(media, 'busy')
+        album = (user_id, media_group_id) if media_group_id is not None else None
+        if self._user_rate > 0 and album is not None and album in self._albums:
+            # The album already took its token (or was rejected, the user was already told)
+            retry_after = self._albums.get(album)
+            if retry_after is not None:
+                return self._reject(media, 'rate_limited', retry_after, notified=True)
+        elif self._user_rate > 0:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = TokenBucket(self._user_rate, self._user_burst)
+                self._buckets.put(user_id, bucket)
+            taken = bucket.take()
+            if album is not None:
+                self._albums.put(album, None if taken else bucket.wait_time())
+            if not taken:
+                return self._reject(media, 'rate_limited', bucket.wait_time())
+
+        self._in_flight += 1
+        METRICS.inc('admission_total', media=media, result='admitted')
+        return Admission(self)
+
+    def _reject(self, media:str, reason:str, retry_after:float=0.0, notified:bool=False) -> Admission:
+        METRICS.inc('admission_total', media=media, result=reason)
+        return Admission(None, reason, retry_after, notified)
+
+    def _release(self):
+        self._in_flight -= 1
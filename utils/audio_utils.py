@@ -1,67 +1,497 @@
-from data.database_handler import DatabaseHandler
+from data.database_handler import DatabaseHandler, AUDIO_FORMAT_EXTENSIONS
+from utils.file_utils import link_file, create_folder, write_file_atomic
+from utils.metrics import METRICS
 import soundfile as sf
-import librosa
+import numpy as np
+import tempfile
+import soxr
+import uuid
 import io
 import os 
 
+# Frames decoded, resampled and written at a time in the streaming mode (~4s at 16kHz)
+STREAM_BLOCK_FRAMES = 65536
+# Storage formats (see AUDIO_FORMAT_EXTENSIONS) written by soundfile: (format, subtype).
+# 'opus' keeps the original voice note bytes, it is never written by soundfile.
+SOUNDFILE_FORMATS = {
+    'wav24': ('WAV', 'PCM_24'),
+    'wav16': ('WAV', 'PCM_16'),
+    'flac': ('FLAC', 'PCM_24'),
+}
+
+class AudioDecodeError(RuntimeError):
+    """The audio data can not be decoded (broken or unsupported format), trying again won't help."""
+
+def is_ogg_opus(audio_data) -> bool:
+    """Whether the audio data (or the file in the given path) is an OGG/Opus stream, e.g. a
+    voice note. Other OGG audios (e.g. Vorbis) are not Opus, they can't be stored as 'opus'."""
+    if isinstance(audio_data, str):
+        with open(audio_data, 'rb') as audio_file:
+            # Page header (27 bytes), segment table (up to 255 bytes) and the packet magic
+            head = audio_file.read(27 + 255 + 8)
+    else:
+        head = bytes(audio_data[:27 + 255 + 8])
+    if len(head) < 27 or head[:4] != b'OggS':
+        return False
+    # The first packet of the first page identifies the codec
+    packet_start = 27 + head[26]
+    return head[packet_start:packet_start + 8] == b'OpusHead'
+
+def detect_audio_format(path:str) -> str:
+    """Storage format of a stored audio file, from its extension (and WAV subtype).
+
+    Returns:
+        str: One of AUDIO_FORMAT_EXTENSIONS keys.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.wav':
+        return 'wav16' if sf.info(path).subtype == 'PCM_16' else 'wav24'
+    return 'flac' if extension == '.flac' else 'opus'
+
+def resample_audio(audio_data, sampling_rate:int):
+    """Decode the given audio data and resample it to `sampling_rate`.
+
+    The audio is decoded with soundfile (libsndfile) and resampled with soxr directly,
+    the same result as `librosa.load(..., res_type='soxr_hq')` without importing librosa 
+    (numba/scipy), which takes seconds the first time it's used.
+
+    NOTE: Defined at module level so it can be sent to the process pool workers.
+
+    Args:
+        audio_data (bytearray | str): Raw audio data, or the path of the file with it.
+        sampling_rate (int): Target sampling rate.
+
+    Returns:
+        numpy.ndarray: The resampled audio wave.
+
+    Raises:
+        AudioDecodeError: If the audio can not be decoded.
+    """
+    source = audio_data if isinstance(audio_data, str) else io.BytesIO(audio_data)
+    try:
+        audio_wave, source_rate = sf.read(source, dtype='float32', always_2d=True)
+    except RuntimeError:
+        # libsndfile can not decode this format (e.g. .m4a audio files)
+        return librosa_resample_audio(audio_data, sampling_rate)
+    # Mix down to mono, as librosa.load does
+    audio_wave = audio_wave.mean(axis=1)
+    if source_rate == sampling_rate:
+        return audio_wave
+    # NOTE: Use 'HQ' (librosa 'soxr_hq') to minimaze the Aliasing effect
+    return soxr.resample(audio_wave, source_rate, sampling_rate, quality='HQ')
+
+def librosa_resample_audio(audio_data, sampling_rate:int):
+    """Fallback of `resample_audio` for the formats libsndfile can not decode, librosa
+    uses audioread (ffmpeg) for them. librosa is imported only when it's needed.
+
+    Raises:
+        AudioDecodeError: If neither libsndfile nor audioread can decode the audio.
+    """
+    import librosa
+    source = audio_data if isinstance(audio_data, str) else io.BytesIO(audio_data)
+    try:
+        audio_wave, _ = librosa.load(source, sr=sampling_rate, res_type='soxr_hq')
+    except Exception as e:
+        raise AudioDecodeError(f'Can not decode the audio: {e}') from e
+    return audio_wave
+
+def warmup_resampler(sampling_rate:int=16000) -> bool:
+    """Runs a tiny resampling, so the first real audio does not pay for the lazy 
+    initialization of soxr and libsndfile (e.g. in a new process pool worker)."""
+    soxr.resample(np.zeros(4800, dtype='float32'), 48000, sampling_rate, quality='HQ')
+    return True
+
+def stream_resample_audio(audio_data, dest_path:str, sampling_rate:int, block_frames:int=STREAM_BLOCK_FRAMES,
+                          audio_format:str='wav24') -> int:
+    """Decode, resample and write the audio block by block, so the memory used is bounded
+    by the block size and not by the audio duration.
+
+    NOTE: Defined at module level so it can be sent to the process pool workers.
+
+    Args:
+        audio_data (bytearray | str): Raw audio data, or the path of the file with it.
+        dest_path (str): Path of the file to write.
+        sampling_rate (int): Target sampling rate.
+        block_frames (int, optional): Frames processed at a time. Defaults to STREAM_BLOCK_FRAMES.
+        audio_format (str, optional): Storage format, see SOUNDFILE_FORMATS. Defaults to 'wav24'.
+
+    Returns:
+        int: Number of frames written.
+
+    Raises:
+        AudioDecodeError: If the audio can not be decoded.
+    """
+    file_format, subtype = SOUNDFILE_FORMATS[audio_format]
+    source = audio_data if isinstance(audio_data, str) else io.BytesIO(audio_data)
+    try:
+        in_file = sf.SoundFile(source)
+    except RuntimeError as e:
+        # libsndfile can not decode this format (e.g. .m4a audio files), use librosa
+        # instead, which falls back to audioread and loads the whole audio in memory.
+        print(f'Streaming decoding not available ({e}), loading the whole audio')
+        audio_wave = librosa_resample_audio(audio_data, sampling_rate)
+        sf.write(dest_path, audio_wave, sampling_rate, format=file_format, subtype=subtype)
+        return len(audio_wave)
+
+    frames = 0
+    with in_file, sf.SoundFile(dest_path, 'w', samplerate=sampling_rate, channels=1,
+                                       format=file_format, subtype=subtype) as out_file:
+        # NOTE: 'HQ' is the same quality as librosa 'soxr_hq', to minimaze the Aliasing effect
+        resampler = soxr.ResampleStream(in_file.samplerate, sampling_rate, 1, dtype='float32', quality='HQ')
+        for block in in_file.blocks(blocksize=block_frames, dtype='float32', always_2d=True):
+            # Mix down to mono, as librosa.load does
+            chunk = resampler.resample_chunk(block.mean(axis=1))
+            out_file.write(chunk)
+            frames += len(chunk)
+        # Flush the samples still in the resampler
+        chunk = resampler.resample_chunk(np.zeros(0, dtype='float32'), last=True)
+        out_file.write(chunk)
+        frames += len(chunk)
+    return frames
+
+def materialize_wav(path:str, dest_path:str, sampling_rate:int=16000) -> str:
+    """Writes a 16kHz 24-bit WAV copy of a stored audio in any storage format (e.g. an
+    original OGG/Opus voice note), for the consumers that need a .wav file.
+
+    NOTE: Defined at module level so it can be sent to the process pool workers.
+
+    Args:
+        path (str): Path of the stored audio.
+        dest_path (str): Path of the .wav file to write.
+        sampling_rate (int, optional): Sampling rate of the .wav file. Defaults to 16000.
+
+    Returns:
+        str: `dest_path`.
+    """
+    audio_wave = resample_audio(path, sampling_rate)
+    buffer = io.BytesIO()
+    sf.write(buffer, audio_wave, sampling_rate, format='WAV', subtype='PCM_24')
+    write_file_atomic(dest_path, buffer.getbuffer())
+    return dest_path
+
 class AudioUtils:
-    def __init__(self):
-        self._BASE_DIR = os.path.dirname( os.path.dirname(os.path.realpath(__file__)) )
+    def __init__(self, base_dir:str=None, db:DatabaseHandler=None, storage_format:str=None):
+        # NOTE: base_dir and db can be changed to store the audios somewhere else (e.g. benchmarks)
+        self._BASE_DIR = base_dir or os.path.dirname( os.path.dirname(os.path.realpath(__file__)) )
         self._audio_data_path = self._BASE_DIR + '/data/audio_data/'
         self._new_sampling_rate = 16000 # Sampling rate of 16kHz  
-        self._dh = DatabaseHandler()                                       
+        self._dh = db or DatabaseHandler()                                       
+        # Audios longer (seconds) or bigger (bytes) than these are spooled to disk and streamed
+        self._streaming_min_duration = int(os.getenv('AUDIO_STREAMING_MIN_DURATION', 120))
+        self._streaming_min_size = int(os.getenv('AUDIO_STREAMING_MIN_SIZE', 2 * 1024 * 1024))
+        # How the audios are stored: 'wav24' (default), 'wav16', 'flac' or 'opus' (original voice note)
+        self._storage_format = storage_format or os.getenv('AUDIO_STORAGE_FORMAT', 'wav24')
+        if self._storage_format not in AUDIO_FORMAT_EXTENSIONS:
+            raise ValueError(f'Unknown audio storage format: {self._storage_format}')
 
-    def createNewFolder(self, folder_path:str) -> bool:
-        """Create a new folder at the specified path if it does not already exist.
+    def audioPath(self, user_id:int, audio_name:str, audio_format:str) -> str:
+        """Path of the user's audio file: data/audio_data/<uid>/<audio_name>.<format extension>"""
+        return f'{self.audioFolder(user_id)}/{audio_name}{AUDIO_FORMAT_EXTENSIONS[audio_format]}'
+
+    def audioFolder(self, user_id:int) -> str:
+        """Folder of the user's audio files: data/audio_data/<uid>"""
+        return f'{self._BASE_DIR}/data/audio_data/{user_id}'
+
+    def storageFormat(self, audio_data) -> str:
+        """Format the given audio will be stored in. The 'opus' passthrough keeps only OGG/Opus 
+        voice notes as they are, other audio files (mp3, m4a, OGG/Vorbis...) are stored as FLAC.
 
         Args:
-            folder_path (str): Path of the folder to be created.
+            audio_data (bytearray | str): Raw audio data, or the path of the file with it.
+        """
+        if self._storage_format == 'opus' and not is_ogg_opus(audio_data):
+            return 'flac'
+        return self._storage_format
 
-        Raises:
-            OSError: If an error occurs during folder creation.
+    def useStreaming(self, duration:int=None, file_size:int=None) -> bool:
+        """Whether an audio should be spooled to disk and processed in the streaming mode.
+
+        Args:
+            duration (int, optional): Audio duration in seconds, as reported by Telegram.
+            file_size (int, optional): Audio file size in bytes, as reported by Telegram.
+        """
+        return (duration or 0) >= self._streaming_min_duration or (file_size or 0) >= self._streaming_min_size
+
+    async def spoolAudio(self, telegram_file) -> str:
+        """Downloads the Telegram file into a temporary file instead of RAM.
+
+        Args:
+            telegram_file (telegram.File): The file to download.
+
+        Returns:
+            str: Path of the temporary file, it must be removed by the caller.
         """
+        fd, spool_path = tempfile.mkstemp(prefix='audio_', suffix='.spool')
+        os.close(fd)
         try:
-            os.makedirs(folder_path, exist_ok=True)
-            return True
-        except OSError as e:
-            # Log: Error on folder creation.
-            print(f'Error on folder creation {folder_path}: {e}')
-            return False
-
-    async def processAudio(self, audio_data:bytearray, user_id:int):
+            await telegram_file.download_to_drive(spool_path)
+        except Exception:
+            os.remove(spool_path)
+            raise
+        return spool_path
+
+    def createNewFolder(self, folder_path:str) -> bool:
+        """Create a new folder at the specified path if it does not already exist.
+        See `utils.file_utils.create_folder`."""
+        return create_folder(folder_path)
+
+    async def processAudio(self, audio_data, user_id:int, executor=None, streaming:bool=False, job_key:str=None):
         """Process audio data and save it in the designated user's audio folder.
 
         Args:
-            audio_data (bytearray): Raw audio data to be processed and saved.
+            audio_data (bytearray | str): Raw audio data to be processed and saved, or
+                the path of the (spooled) file with it.
             user_id (int): Unique Telegram identifier of the user associated with the audio.
+            executor (MediaExecutor, optional): Where the decoding, resampling and writing 
+                are run. If None, they are run in the current thread.
+            streaming (bool, optional): Process the audio block by block, with bounded memory
+                no matter its duration. Defaults to False.
+            job_key (str, optional): Key of the job processing the audio, recorded with it
+                (see `DatabaseHandler.postUserAudio`).
+
+        Returns:
+            str: Path of the stored audio file, None if it was not stored.
+
+        Raises:
+            AudioDecodeError: If the audio can not be decoded.
         """
         if self._new_sampling_rate <= 0:
             return None
+
+        audio_format = self.storageFormat(audio_data)
+        if audio_format == 'opus':
+            return await self.storeOriginalAudio(audio_data, user_id, executor=executor, job_key=job_key)
+        if streaming:
+            return await self.processAudioStream(audio_data, user_id, executor=executor, job_key=job_key)
         
         # Load the data and resample to 16KHz rate.
-        # NOTE: Use 'soxr_hq' to minimaze the Aliasing effect
-        audio_wave, samplerate = librosa.load(io.BytesIO(audio_data), sr=self._new_sampling_rate, res_type='soxr_hq')
+        with METRICS.timer('resample', media='audio'):
+            if executor is not None:
+                # Decoding can fall back to librosa (GIL bound), so it goes to the process pool
+                audio_wave = await executor.run_in_process(resample_audio, audio_data, self._new_sampling_rate)
+            else:
+                audio_wave = resample_audio(audio_data, self._new_sampling_rate)
     
         # The Audio recording format is: uid -> [audio_message_0, audio_message_1, ..., audio_message_N]
         usr_audio_folder_path = f'{self._BASE_DIR}/data/audio_data/{user_id}/'
         # Create new folder if it does not already exist.
         self.createNewFolder(usr_audio_folder_path)
         # Create new Audio item record in the DB and return the new User's next audio filename
-        user_audio_filename = self._dh.postUserAudio(user_id)
+        with METRICS.timer('db_insert', media='audio'):
+            user_audio_filename = await self._dh.postUserAudioAsync(user_id, audio_format, job_key)
 
         # Abort if we fail to create an audio record in the database
         if user_audio_filename == 'NULL':
             return None
 
-        user_audio_path = f'{usr_audio_folder_path}/{user_audio_filename}.wav'
-        # Store the audio in the corresponding PATH, with a sampling rate of 16kHz and in .WAV format
-        sf.write(user_audio_path, audio_wave, self._new_sampling_rate, subtype='PCM_24')
+        user_audio_path = self.audioPath(user_id, user_audio_filename, audio_format)
+        # Store the audio in the corresponding PATH, with a sampling rate of 16kHz in the storage format
+        with METRICS.timer('disk_write', media='audio'):
+            if executor is not None:
+                await executor.run_in_thread(self.writeAudio, user_audio_path, audio_wave, audio_format)
+            else:
+                self.writeAudio(user_audio_path, audio_wave, audio_format)
         
         # ============================================================================================
         # NOTE: Uncomment only for Dev purposes
         # self.get_sample_rate(user_audio_path) # Check      
         # self.store_raw_audio(audio_data, usr_audio_folder_path+'original.wav') # Store data      
         # ============================================================================================
+        return user_audio_path
+
+    async def processAudioStream(self, audio_data, user_id:int, executor=None, job_key:str=None):
+        """Streaming version of `processAudio`, the audio is resampled and written block 
+        by block into a temporary file, which is renamed once its DB record is created.
+
+        Args:
+            audio_data (bytearray | str): Raw audio data, or the path of the file with it.
+            user_id (int): Unique Telegram identifier of the user associated with the audio.
+            executor (MediaExecutor, optional): Where the streaming is run. 
+                If None, it is run in the current thread.
+            job_key (str, optional): Key of the job processing the audio.
+
+        Returns:
+            str: Path of the stored audio file, None if it was not stored.
+
+        Raises:
+            AudioDecodeError: If the audio can not be decoded.
+        """
+        audio_format = self.storageFormat(audio_data)
+        usr_audio_folder_path = f'{self._BASE_DIR}/data/audio_data/{user_id}/'
+        self.createNewFolder(usr_audio_folder_path)
+        fd, tmp_path = tempfile.mkstemp(dir=usr_audio_folder_path, prefix='.tmp_', suffix=AUDIO_FORMAT_EXTENSIONS[audio_format])
+        os.close(fd)
+        try:
+            args = (audio_data, tmp_path, self._new_sampling_rate, STREAM_BLOCK_FRAMES, audio_format)
+            # NOTE: In streaming mode the disk write is part of the resampling stage
+            with METRICS.timer('resample', media='audio', streaming=True):
+                if executor is not None:
+                    await executor.run_in_process(stream_resample_audio, *args)
+                else:
+                    stream_resample_audio(*args)
+
+            # Create the DB record only once the audio was decoded, so a broken
+            # audio never leaves a record without its file.
+            with METRICS.timer('db_insert', media='audio'):
+                user_audio_filename = await self._dh.postUserAudioAsync(user_id, audio_format, job_key)
+            if user_audio_filename == 'NULL':
+                return None
+            user_audio_path = self.audioPath(user_id, user_audio_filename, audio_format)
+            os.replace(tmp_path, user_audio_path)
+            return user_audio_path
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    async def linkAudio(self, src_path:str, user_id:int, executor=None, job_key:str=None) -> str:
+        """Stores an already processed audio (e.g. a forwarded voice note) as the user's
+        next audio, linking the existing file instead of processing it again.
+
+        Args:
+            src_path (str): Path of the already stored audio file.
+            user_id (int): Unique Telegram identifier of the user associated with the audio.
+            executor (MediaExecutor, optional): Where the file checks and the link are run.
+                If None, they are run in the current thread.
+            job_key (str, optional): Key of the job processing the audio.
+
+        Returns:
+            str: Path of the user's new audio file (in the same format), None if it was not stored.
+        """
+        try:
+            # The linked file keeps its format, even if the storage format changed since then
+            if executor is not None:
+                audio_format = await executor.run_in_thread(detect_audio_format, src_path)
+            else:
+                audio_format = detect_audio_format(src_path)
+        except RuntimeError as e:
+            # Log: The stored file is not readable
+            print(f'Error reading {src_path}: {e}')
+            return None
+        usr_audio_folder_path = f'{self._BASE_DIR}/data/audio_data/{user_id}/'
+        self.createNewFolder(usr_audio_folder_path)
+        # Linked into a temporary name first, the DB record is created only once the file is there
+        tmp_path = f'{usr_audio_folder_path}.tmp_{uuid.uuid4().hex}{AUDIO_FORMAT_EXTENSIONS[audio_format]}'
+        with METRICS.timer('disk_write', media='audio'):
+            if executor is not None:
+                linked = await executor.run_in_thread(link_file, src_path, tmp_path)
+            else:
+                linked = link_file(src_path, tmp_path)
+        if not linked:
+            return None
+        try:
+            user_audio_filename = await self._dh.postUserAudioAsync(user_id, audio_format, job_key)
+            if user_audio_filename == 'NULL':
+                return None
+            user_audio_path = self.audioPath(user_id, user_audio_filename, audio_format)
+            os.replace(tmp_path, user_audio_path)
+            return user_audio_path
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    async def storeOriginalAudio(self, audio_data, user_id:int, executor=None, job_key:str=None):
+        """Stores the original OGG/Opus voice note as it was received ('opus' storage format), 
+        without decoding nor resampling it. See `loadAudio` to read it at 16kHz.
+
+        Args:
+            audio_data (bytearray | str): Raw audio data, or the path of the (spooled) file with it.
+            user_id (int): Unique Telegram identifier of the user associated with the audio.
+            executor (MediaExecutor, optional): Where the checks and the disk write are run.
+                If None, they are run in the current thread.
+            job_key (str, optional): Key of the job processing the audio.
+
+        Returns:
+            str: Path of the stored .ogg file, None if it was not stored.
+
+        Raises:
+            AudioDecodeError: If the voice note is not a readable OGG/Opus file.
+        """
+        source = audio_data if isinstance(audio_data, str) else io.BytesIO(audio_data)
+        try:
+            # Only the headers are parsed, a broken voice note never gets a record
+            if executor is not None:
+                await executor.run_in_thread(sf.info, source)
+            else:
+                sf.info(source)
+        except RuntimeError as e:
+            raise AudioDecodeError(f'Invalid voice note: {e}') from e
+
+        usr_audio_folder_path = f'{self._BASE_DIR}/data/audio_data/{user_id}/'
+        self.createNewFolder(usr_audio_folder_path)
+        # Stored into a temporary name first (a spooled file is linked or copied, the downloaded 
+        # bytes are written), the DB record is created only once the whole file is there
+        tmp_path = f'{usr_audio_folder_path}.tmp_{uuid.uuid4().hex}{AUDIO_FORMAT_EXTENSIONS["opus"]}'
+        if isinstance(audio_data, str):
+            store, args = link_file, (audio_data, tmp_path)
+        else:
+            store, args = write_file_atomic, (tmp_path, audio_data)
+        try:
+            with METRICS.timer('disk_write', media='audio'):
+                if executor is not None:
+                    stored = await executor.run_in_thread(store, *args)
+                else:
+                    stored = store(*args)
+            if not stored:
+                return None
+
+            with METRICS.timer('db_insert', media='audio'):
+                user_audio_filename = await self._dh.postUserAudioAsync(user_id, 'opus', job_key)
+            if user_audio_filename == 'NULL':
+                return None
+            user_audio_path = self.audioPath(user_id, user_audio_filename, 'opus')
+            try:
+                os.replace(tmp_path, user_audio_path)
+            except OSError as e:
+                # Log: The audio could not be moved in place, no record is left without its file
+                print(f'Error storing {user_audio_path}: {e}')
+                await self._dh.deleteUserAudioAsync(user_id, user_audio_filename)
+                return None
+            return user_audio_path
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def loadAudio(self, path:str):
+        """Reads a stored audio in any storage format as a mono wave at 16kHz 
+        (the original voice notes are decoded and resampled on read).
+
+        Args:
+            path (str): Path of the stored audio.
+
+        Returns:
+            numpy.ndarray: The audio wave.
+        """
+        return resample_audio(path, self._new_sampling_rate)
+
+    def materializeWav(self, path:str, dest_path:str) -> str:
+        """Writes a 16kHz .wav copy of a stored audio, see `materialize_wav`.
+        A .wav audio is returned as it is (no copy).
+
+        Returns:
+            str: Path of the .wav file.
+        """
+        if path.lower().endswith('.wav'):
+            return path
+        return materialize_wav(path, dest_path, self._new_sampling_rate)
+
+    def writeAudio(self, path:str, audio_wave, audio_format:str='wav24'):
+        """Store the given audio wave in the storage format with the new sampling rate.
+
+        Args:
+            path (str): path, including the name, for this audio
+            audio_wave (numpy.ndarray): Audio wave already resampled to the new sampling rate
+            audio_format (str, optional): Storage format, see SOUNDFILE_FORMATS. Defaults to 'wav24'.
+        """
+        file_format, subtype = SOUNDFILE_FORMATS[audio_format]
+        # Written into a temporary file and renamed, a crash never leaves a half written audio
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp_', suffix=os.path.splitext(path)[1])
+        os.close(fd)
+        try:
+            sf.write(tmp_path, audio_wave, self._new_sampling_rate, format=file_format, subtype=subtype)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
 
     # DEVELOPMENT PURPOSES ONLY ======================================================================
     def get_sample_rate(self, path:str):
@@ -80,6 +510,7 @@ class AudioUtils:
             path (str): path, including the name, for this audio
         """
         try:
+            import librosa
             audio_wave, samplerate = librosa.load(io.BytesIO(audio_data), sr=None, res_type='soxr_hq')
             sf.write(path, audio_wave, samplerate, subtype='PCM_24')
             print("Sample rate: ", samplerate)
@@ -0,0 +1,143 @@
+from collections import OrderedDict
+import threading
+import time
+
+class LRUCache:
+    """
+        Small in-memory Least Recently Used cache, when it's full the entry 
+        that was used the longest time ago is dropped.
+
+        NOTE: Not thread-safe, it's meant to be used from the event loop.
+    """
+    def __init__(self, max_size:int=1024):
+        self._max_size = max_size
+        self._items = OrderedDict()
+
+    def get(self, key, default=None):
+        """Returns the cached value for `key` (marking it as recently used), or `default`."""
+        try:
+            self._items.move_to_end(key)
+        except KeyError:
+            return default
+        return self._items[key]
+
+    def put(self, key, value):
+        """Caches `value` for `key`, dropping the least recently used entry if needed."""
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self._max_size:
+            self._items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Removes `key` from the cache and returns its value, or `default`."""
+        return self._items.pop(key, default)
+
+    def __contains__(self, key) -> bool:
+        return key in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+class TTLCache:
+    """
+        Small in-memory cache whose entries expire `ttl` seconds after being cached, 
+        when it's full the oldest entry is dropped.
+
+        A value read from somewhere else (e.g. the DB) can be invalidated (`pop`) while it's 
+        being read, then it must not be cached: the reader takes the key `generation` before
+        reading and passes it to `put`, which skips the value if the key was popped since then.
+
+        NOTE: Thread-safe, the DB handlers that use it are called from several threads.
+    """
+    def __init__(self, ttl:float, max_size:int=1024):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._items = OrderedDict()
+        # Keys being read: key -> [generation, readers], only while there are readers
+        self._reads = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the cached value for `key` if it has not expired, or `default`."""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return default
+            if item[0] <= time.monotonic():
+                del self._items[key]
+                return default
+            return item[1]
+
+    def generation(self, key) -> int:
+        """Starts reading the value of `key`, end it with `put` or `release`.
+
+        Returns:
+            int: The key generation, changed by every `pop` of the key (or `clear`).
+        """
+        with self._lock:
+            read = self._reads.setdefault(key, [0, 0])
+            read[1] += 1
+            return read[0]
+
+    def release(self, key, generation:int) -> bool:
+        """Ends a read of `key` started with `generation`, without caching anything.
+
+        Returns:
+            bool: True if the key was not invalidated during the read.
+        """
+        with self._lock:
+            return self._end_read(key, generation)
+
+    def _end_read(self, key, generation:int) -> bool:
+        read = self._reads[key]
+        read[1] -= 1
+        if read[1] == 0:
+            del self._reads[key]
+        return read[0] == generation
+
+    def put(self, key, value, generation:int=None):
+        """Caches `value` for `key` during `ttl` seconds, dropping the oldest entry if needed.
+        With the `generation` of a read, the value is not cached if the key was popped since then."""
+        with self._lock:
+            if generation is not None and not self._end_read(key, generation):
+                return
+            if self._ttl <= 0:
+                return
+            self._items[key] = (time.monotonic() + self._ttl, value)
+            self._items.move_to_end(key)
+            if len(self._items) > self._max_size:
+                self._items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Removes `key` from the cache and returns its value (even if expired), or `default`."""
+        with self._lock:
+            item = self._items.pop(key, None)
+            if key in self._reads:
+                self._reads[key][0] += 1
+        return item[1] if item is not None else default
+
+    def pop_prefix(self, prefix:tuple) -> int:
+        """Removes the (tuple) keys that start with `prefix`, e.g. ('recent',) for every 
+        ('recent', hours) key, their reads in progress are invalidated as with `pop`.
+
+        Returns:
+            int: Number of entries removed.
+        """
+        size = len(prefix)
+        with self._lock:
+            keys = [key for key in self._items if key[:size] == prefix]
+            for key in keys:
+                del self._items[key]
+            for key, read in self._reads.items():
+                if key[:size] == prefix:
+                    read[0] += 1
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            for read in self._reads.values():
+                read[0] += 1
+
+    def __len__(self) -> int:
+        return len(self._items)
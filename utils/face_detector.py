@@ -0,0 +1,144 @@
+import numpy as np
+import threading
+import cv2
+import os
+
+HAAR_MODEL_PATH = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+DNN_MODEL_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+    'data', 'models', 'face_detection_yunet_2023mar.onnx'
+)
+
+class FaceDetector:
+    """
+        Long-lived face detector engine, loaded once at startup and shared by all the handlers.
+
+        OpenCV detectors are not thread-safe, so every worker thread gets its own
+        instance of the underlying model (created the first time the thread uses it).
+
+        Backends:
+            - 'haar': Haar Cascade included in cv2, trades precision for time.
+            - 'dnn': OpenCV DNN face detector (YuNet), loaded from a local .onnx model.
+    """
+    BACKENDS = ('haar', 'dnn')
+
+    def __init__(self, backend:str='haar', model_path:str=None, score_threshold:float=0.8):
+        if backend not in self.BACKENDS:
+            raise ValueError(f'Unknown face detector backend: {backend}')
+        self._backend = backend
+        self._model_path = model_path or (DNN_MODEL_PATH if backend == 'dnn' else HAAR_MODEL_PATH)
+        self._score_threshold = score_threshold
+        self._local = threading.local()
+
+    @classmethod
+    def from_env(cls):
+        """Creates the detector configured by the FACE_DETECTOR_* env vars."""
+        return cls(
+            backend=os.getenv('FACE_DETECTOR_BACKEND', 'haar'),
+            model_path=os.getenv('FACE_DETECTOR_MODEL_PATH') or None,
+        )
+
+    @property
+    def backend(self) -> str:
+        return self._backend
+
+    # =========================================================================================== LOADING
+    def load(self) -> bool:
+        """Loads the model in the current thread, so a broken model fails at startup
+        and not on the first photo. Also used to warm up the worker threads.
+
+        Returns:
+            bool: True if the model was loaded, False otherwise.
+        """
+        try:
+            return self._engine() is not None
+        except Exception as e:
+            # Log: Face detector failed to load
+            print(f'Face detector ({self._backend}) failed to load {self._model_path}: {e}')
+            return False
+
+    def warmup(self) -> bool:
+        """Loads the model in the current thread and runs a detection on a blank image, 
+        so the first photo does not pay for the lazy initialization of OpenCV.
+
+        Returns:
+            bool: True if the detector is ready, False otherwise.
+        """
+        if not self.load():
+            return False
+        self.detect(np.zeros((64, 64), dtype=np.uint8))
+        return True
+
+    def _engine(self):
+        """Returns the detector instance of the current thread, creating it if needed."""
+        engine = getattr(self._local, 'engine', None)
+        if engine is None:
+            if not os.path.isfile(self._model_path):
+                raise FileNotFoundError(f'Face detector model not found: {self._model_path}')
+            if self._backend == 'dnn':
+                # The input size is set on every detection, since it depends on the image
+                engine = cv2.FaceDetectorYN.create(self._model_path, '', (320, 320), self._score_threshold)
+            else:
+                engine = cv2.CascadeClassifier(self._model_path)
+                if engine.empty():
+                    raise ValueError(f'Invalid Haar Cascade model: {self._model_path}')
+            self._local.engine = engine
+        return engine
+
+    # =========================================================================================== DETECTION
+    def detect(self, img, scale_factor=1.2, min_neighbors=6, min_size=(30,30)) -> list:
+        """Search for faces in the given image.
+
+        Args:
+            img (numpy.ndarray): Gray scaled (or BGR) image.
+            scale_factor (float, optional): Haar only, factor of increase in window size. Defaults to 1.2.
+            min_neighbors (int, optional): Haar only, higher the value, less FP. Defaults to 6.
+            min_size (tuple, optional): Smallest face (w, h) to report. Defaults to (30,30).
+
+        Returns:
+            list: Face boxes as (x, y, w, h) tuples, empty if there are no faces.
+        """
+        engine = self._engine()
+        if self._backend == 'dnn':
+            # YuNet expects a 3 channel image
+            if img.ndim == 2:
+                img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+            height, width = img.shape[:2]
+            engine.setInputSize((width, height))
+            _, faces_info = engine.detect(img)
+            if faces_info is None:
+                return []
+            boxes = [tuple(int(v) for v in face[:4]) for face in faces_info]
+            return [box for box in boxes if box[2] >= min_size[0] and box[3] >= min_size[1]]
+
+        faces_info = engine.detectMultiScale(
+            img,
+            scaleFactor=scale_factor,
+            minNeighbors=min_neighbors,
+            minSize=min_size
+        )
+        return [tuple(int(v) for v in face) for face in faces_info]
+
+    def detect_many(self, images:list, **kwargs) -> list:
+        """Search for faces in a batch of images (e.g. a photo album) in a single pass,
+        reusing the same detector instance for the whole batch.
+
+        Args:
+            images (list): List of gray scaled (or BGR) images, None items are skipped.
+            **kwargs: Detection parameters, see `detect`.
+
+        Returns:
+            list: For each image, its list of face boxes (empty if none or on failure).
+        """
+        results = []
+        for img in images:
+            if img is None:
+                results.append([])
+                continue
+            try:
+                results.append(self.detect(img, **kwargs))
+            except Exception as e:
+                # Log: Face detector failed
+                print(f'Face detector failed: {e}')
+                results.append([])
+        return results
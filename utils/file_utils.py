@@ -0,0 +1,87 @@
+import hashlib
+import shutil
+import tempfile
+import os
+
+def write_file_atomic(path:str, data) -> bool:
+    """Writes the given bytes in `path` atomically: the data is written in a temporary
+    file of the same folder and then renamed, so a crash never leaves a half written file.
+
+    Args:
+        path (str): Destination path, including the file name.
+        data (bytes-like): Data to write (bytes, bytearray, memoryview...), it's not copied.
+
+    Returns:
+        bool: True if the file was written, False otherwise.
+    """
+    folder = os.path.dirname(path) or '.'
+    tmp_path = None
+    try:
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.tmp_', suffix=os.path.splitext(path)[1])
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(data)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, path)
+        return True
+    except OSError as e:
+        # Log: Error writing the file
+        print(f'Error writing {path}: {e}')
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+def create_folder(folder_path:str) -> bool:
+    """Create a new folder at the specified path if it does not already exist.
+
+    Args:
+        folder_path (str): Path of the folder to be created.
+
+    Returns:
+        bool: True if the folder exists (or was created), False on error.
+    """
+    try:
+        os.makedirs(folder_path, exist_ok=True)
+        return True
+    except OSError as e:
+        # Log: Error on folder creation.
+        print(f'Error on folder creation {folder_path}: {e}')
+        return False
+
+def content_hash(source, chunk_size:int=1024 * 1024) -> str:
+    """SHA-256 of the given bytes, or of the file in the given path (read in chunks).
+
+    Args:
+        source (bytes-like | str): Data to hash, or the path of the file to hash.
+        chunk_size (int, optional): Bytes read at a time from the file. Defaults to 1MB.
+
+    Returns:
+        str: The hex digest.
+    """
+    if not isinstance(source, str):
+        return hashlib.sha256(source).hexdigest()
+    sha256 = hashlib.sha256()
+    with open(source, 'rb') as source_file:
+        for chunk in iter(lambda: source_file.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def link_file(src_path:str, dest_path:str) -> bool:
+    """Makes `dest_path` point to the same data as `src_path` without duplicating it
+    (hard link), or copies it if hard links are not supported.
+
+    Returns:
+        bool: True if linked (or copied), False otherwise.
+    """
+    try:
+        os.makedirs(os.path.dirname(dest_path) or '.', exist_ok=True)
+        try:
+            os.link(src_path, dest_path)
+        except OSError:
+            shutil.copyfile(src_path, dest_path)
+        return True
+    except OSError as e:
+        # Log: Error linking the file
+        print(f'Error linking {src_path} to {dest_path}: {e}')
+        return False
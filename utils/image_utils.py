@@ -1,28 +1,41 @@
 from data.database_handler import DatabaseHandler
-from utils.audio_utils import AudioUtils
+from utils.face_detector import FaceDetector
+from utils.file_utils import write_file_atomic
+from utils.metrics import METRICS
+from typing import NamedTuple
 import numpy as np
+import asyncio
 import cv2
 import os 
 
+class ImageFaces(NamedTuple):
+    """Face detection result of an image, with its original dimensions."""
+    faces: list                 # Face boxes (x, y, w, h) in the original image coordinates
+    width: int
+    height: int
+
+    @property
+    def has_faces(self) -> bool:
+        return len(self.faces) > 0
+
+# The faces are searched in the photos resized to fit in DETECTION_SIZE x DETECTION_SIZE
+DETECTION_SIZE = 500
+# Gaussian blur kernel of the preprocessing, relative to the (resized) image side
+BLUR_KERNEL_RATIO = 0.05
+# Neighbors needed by a preview candidate, lower than the full detection (6) so an unclear
+# face in the small preview is a candidate and it's checked in the full size photo
+PREVIEW_MIN_NEIGHBORS = 3
+
 class ImageUtils:
-    def __init__(self):
+    def __init__(self, detector:FaceDetector=None, db:DatabaseHandler=None):
         self._BASE_DIR = os.path.dirname( os.path.dirname(os.path.realpath(__file__)) )
-        self._audio_data_path = self._BASE_DIR + '/data/image_data/'
-        self._dh = DatabaseHandler()  
+        self._image_data_path = self._BASE_DIR + '/data/image_data/'
+        self._dh = db or DatabaseHandler()  
+        # NOTE: Share the same detector between ImageUtils instances, so the model is loaded only once
+        self._detector = detector or FaceDetector()
+        # The Haar Cascade works on enhanced gray scaled images, the DNN model on natural color ones
+        self._color = self._detector.backend == 'dnn'
 
-    def count_directory_files(self) -> int:
-        """ Counts the number of files in the image_data 
-            NOTE: I assume that this directory only will contain images and .gitignore
-        """
-        if not os.path.isdir(self._audio_data_path):
-            print(f"Error: '{self._audio_data_path}' is not a valid directory.")
-            # If there is no directory with this path, try to create one
-            is_created = AudioUtils().createNewFolder(self._audio_data_path)
-            if is_created:
-                return 0 # If created, the first count is zero
-            return -1
-        return len(os.listdir(self._audio_data_path)) - 1
-    
     def resize_to_fit(self,image, max_width:int, max_height:int):
         """
         Resize the input image to fit within the specified maximum width and height,
@@ -62,7 +75,7 @@ class ImageUtils:
         return resized_image
 
     def hasFaces(self, gray_img, scale_factor=1.2, min_neighbors=6, min_size=(30,30)) -> bool:
-        """Applies Haar on a given image that searches for faces, 
+        """Applies the face detector on a given image that searches for faces, 
             returns True if the image has faces, False otherwise.
 
         Args:
@@ -79,12 +92,11 @@ class ImageUtils:
             Yet (30,30) still showing god results.
         """
         try:
-            haar_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-            faces_info = haar_cascade.detectMultiScale(
+            faces_info = self._detector.detect(
                 gray_img, 
-                scaleFactor=scale_factor, 
-                minNeighbors=min_neighbors, # Higher the value, less will be the number of FP. However, there is a chance of missing some unclear face traces.
-                minSize=min_size
+                scale_factor=scale_factor, 
+                min_neighbors=min_neighbors, # Higher the value, less will be the number of FP. However, there is a chance of missing some unclear face traces.
+                min_size=min_size
             )
             if len(faces_info) > 0:
                 return True 
@@ -96,37 +108,249 @@ class ImageUtils:
             # In case of failure, we will simply skip this image.
             return False
 
-    async def processImage(self, img:bytearray) -> bool:
-        """Process the input image to enhance features for face detection using Haar Cascade.
+    def decodeImage(self, img:bytearray):
+        """Decodes the input image in grayscale because of the benefits for the algorithm
+        (in BGR color for the DNN detector backend).
 
         Args:
             img (bytearray): Input image data in the form of a bytearray.
 
         Returns:
-            bool: True if the processed image contains detected faces, otherwise False.
+            numpy.ndarray: The gray scaled (or BGR) image, None if it could not be decoded.
         """
-        # Loading the image 
-        bytes_arr = bytes(img)
-        # Create the pixel matrix
-        np_arr = np.frombuffer(bytes_arr, dtype=np.uint8)
+        # Create the pixel matrix, a view over the downloaded buffer (no copy)
+        np_arr = np.frombuffer(img, dtype=np.uint8)
         # Decode the matrix in grayscale because of the benefits for the algorithm
-        gray_img = cv2.imdecode(np_arr, cv2.IMREAD_GRAYSCALE)
+        gray_img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR if self._color else cv2.IMREAD_GRAYSCALE)
+
+        if gray_img is None:
+            # Log: Failed to process 
+            print("Failed processing")
+        return gray_img
+
+    def preprocessImage(self, gray_img):
+        """Enhances the features of a gray scaled image for face detection. The DNN detector 
+        is trained on natural images, so a color image (DNN backend) is only resized.
+
+        Args:
+            gray_img (numpy.ndarray): Gray scaled (or BGR) image, see `decodeImage`.
+
+        Returns:
+            numpy.ndarray: The preprocessed image, resized to fit in DETECTION_SIZE x DETECTION_SIZE.
+        """
         # Resize the image to a smaller one if it's big enough
-        gray_img = self.resize_to_fit(gray_img, 500, 500)
+        gray_img = self.resize_to_fit(gray_img, DETECTION_SIZE, DETECTION_SIZE)
+        if self._color:
+            return gray_img
         # Apply histogram equalization to improve the contrast
         gray_img = cv2.equalizeHist(gray_img)
-        # Reduce some noise and blemishes that can interfece with face detection
-        smooth = cv2.GaussianBlur(gray_img, (25,25), 0)
-        gray_img = cv2.divide(gray_img, smooth, scale=255)
+        # Reduce some noise and blemishes that can interfece with face detection.
+        # NOTE: The kernel is 5% of the image side (25x25 for 500px), so a small 
+        # preview is not blurred as much as a full size photo.
+        kernel = max(3, int(max(gray_img.shape[:2]) * BLUR_KERNEL_RATIO) | 1)
+        smooth = cv2.GaussianBlur(gray_img, (kernel, kernel), 0)
+        return cv2.divide(gray_img, smooth, scale=255)
+
+    async def processImage(self, img:bytearray, executor=None) -> ImageFaces:
+        """Process the input image to enhance features for face detection using Haar Cascade.
+
+        Args:
+            img (bytearray): Input image data in the form of a bytearray.
+            executor (MediaExecutor, optional): Where the decoding and detection are run.
+                If None, they are run in the current thread.
 
+        Returns:
+            ImageFaces: The detected faces (`has_faces` is True if there are some), 
+                None if the image could not be decoded.
+        """
+        if executor is not None:
+            # OpenCV releases the GIL, so the thread pool is enough here
+            return await executor.run_in_thread(self.detectImageFaces, img)
+        return self.detectImageFaces(img)
+
+    async def processImages(self, imgs:list, executor=None) -> list:
+        """Batched version of `processImage`, all the images (e.g. a photo album) 
+        are scored in a single worker job.
+
+        Args:
+            imgs (list): Input images data in the form of bytearrays.
+            executor (MediaExecutor, optional): Where the decoding and detection are run.
+                If None, they are run in the current thread.
+
+        Returns:
+            list: For each image, its `ImageFaces` (None if it could not be decoded).
+        """
+        if executor is not None:
+            return await executor.run_in_thread(self.detectImagesFaces, imgs)
+        return self.detectImagesFaces(imgs)
+
+    async def screenImage(self, img:bytearray, executor=None) -> bool:
+        """Cheap face detection on a small version of a photo (a Telegram preview size), 
+        to know if the full size photo is worth downloading.
+
+        Args:
+            img (bytearray): Preview image data in the form of a bytearray.
+            executor (MediaExecutor, optional): Where the decoding and detection are run.
+                If None, they are run in the current thread.
+
+        Returns:
+            bool: True if there could be faces (found or unclear), False if there are 
+                none for sure, None if the preview could not be decoded.
+        """
+        if executor is not None:
+            return await executor.run_in_thread(self.detectCandidateFaces, img)
+        return self.detectCandidateFaces(img)
+
+    def detectCandidateFaces(self, img:bytearray) -> bool:
+        """Blocking part of `screenImage`.
+
+        The preview is scaled up to the detection size, so the detector searches the faces
+        at the same scale as in the full size photo, and with less neighbors, so a doubtful 
+        preview is not rejected, it's checked in full size.
+        NOTE: Searching at the preview size instead is ~40% faster, but it misses the 
+        faces that are clear in the full size photo.
+        """
+        with METRICS.timer('decode', media='preview'):
+            gray_img = self.decodeImage(img)
         if gray_img is None:
-            # Log: Failed to process 
-            print("Failed processing")
-            return 
-        
-        # Search for faces in the image
-        # NOTE: Here I'm using Haar Cascade Algorithm included in cv2 since
+            return None
+        with METRICS.timer('preprocess', media='preview'):
+            scale = DETECTION_SIZE / max(gray_img.shape[:2])
+            if scale > 1:
+                gray_img = cv2.resize(gray_img, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+            preprocessed = self.preprocessImage(gray_img)
+        with METRICS.timer('detect', media='preview'):
+            faces = self._detector.detect_many([preprocessed], min_neighbors=PREVIEW_MIN_NEIGHBORS)[0]
+        return len(faces) > 0
+
+    def detectImageFaces(self, img:bytearray) -> ImageFaces:
+        """Blocking part of `processImage`, decodes the image and searches for faces.
+
+        Args:
+            img (bytearray): Input image data in the form of a bytearray.
+
+        Returns:
+            ImageFaces: The detected faces, None if the image could not be decoded.
+        """
+        return self.detectImagesFaces([img])[0]
+
+    def detectImagesFaces(self, imgs:list) -> list:
+        """Blocking part of `processImages`, decodes the images and searches for faces.
+
+        Args:
+            imgs (list): Input images data in the form of bytearrays.
+
+        Returns:
+            list: For each image, its `ImageFaces` (None if it could not be decoded).
+        """
+        METRICS.inc('face_batches_total')
+        METRICS.inc('face_batch_images_total', len(imgs))
+        with METRICS.timer('decode', media='image'):
+            gray_imgs = [self.decodeImage(img) for img in imgs]
+        with METRICS.timer('preprocess', media='image'):
+            preprocessed = [self.preprocessImage(gray) if gray is not None else None for gray in gray_imgs]
+
+        # Search for faces in the images
+        # NOTE: Haar Cascade Algorithm included in cv2 is the default detector since
         # is pretty good for the given task, it's trading precision for time.
-        # If we have a good server, we can user some ML models instead here,
-        # For example, see: insightface.ai
-        return self.hasFaces(gray_img)
\ No newline at end of file
+        # If we have a good server, the DNN backend can be used instead (FACE_DETECTOR_BACKEND=dnn),
+        # or some other ML models, for example, see: insightface.ai
+        with METRICS.timer('detect', media='image'):
+            faces_info = self._detector.detect_many(preprocessed)
+
+        results = []
+        for gray, small, faces in zip(gray_imgs, preprocessed, faces_info):
+            if gray is None:
+                results.append(None)
+                continue
+            height, width = gray.shape[:2]
+            # The faces were searched in the resized image, scale them back to the original size
+            scale = width / small.shape[1]
+            faces = [tuple(int(round(v * scale)) for v in face) for face in faces]
+            results.append(ImageFaces(faces, width, height))
+        return results
+
+    async def saveImage(self, img:bytearray, path:str, executor=None) -> bool:
+        """Stores the image bytes as they were downloaded (no re-encoding) in the given path.
+
+        Args:
+            img (bytearray): Image data, the same buffer used for the face detection.
+            path (str): path, including the name, for this image
+            executor (MediaExecutor, optional): Where the disk write is run.
+                If None, it is run in the current thread.
+
+        Returns:
+            bool: True if the image was stored, False otherwise.
+        """
+        with METRICS.timer('disk_write', media='image'):
+            if executor is not None:
+                return await executor.run_in_thread(write_file_atomic, path, img)
+            return write_file_atomic(path, img)
+
+class FaceBatchScheduler:
+    """
+        Micro-batching scheduler for the face detection: the images received at the
+        same time (bursts, group chats, photo albums) are collected for a few milliseconds
+        (or until `max_batch_size` images) and decoded, preprocessed and scored as a single
+        batch in a worker, each caller gets its own result back through a future.
+
+        Several batches can be running at the same time in different workers, so
+        a little latency (`max_wait_ms`) is traded for more photos per second.
+    """
+    def __init__(self, image_utils:ImageUtils, executor=None, max_batch_size:int=None, max_wait_ms:float=None):
+        self._image_utils = image_utils
+        self._executor = executor
+        self._max_batch_size = max_batch_size or int(os.getenv('FACE_BATCH_MAX_SIZE', 8))
+        self._max_wait = (max_wait_ms if max_wait_ms is not None else float(os.getenv('FACE_BATCH_MAX_WAIT_MS', 10))) / 1000
+        self._images = []
+        self._futures = []
+        self._flush_handle = None
+        self._tasks = set()
+
+    async def processImage(self, img:bytearray) -> ImageFaces:
+        """Adds the image to the next batch and waits for its result.
+
+        Args:
+            img (bytearray): Input image data in the form of a bytearray.
+
+        Returns:
+            ImageFaces: The detected faces, None if the image could not be decoded.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._images.append(img)
+        self._futures.append(future)
+
+        if len(self._images) >= self._max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            # The first image of the batch sets the max time the batch can wait
+            self._flush_handle = loop.call_later(self._max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        """Sends the collected images as a batch to the workers."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._images:
+            return
+        images, futures = self._images, self._futures
+        self._images, self._futures = [], []
+        task = asyncio.ensure_future(self._process_batch(images, futures))
+        # Keep a reference to the running batches, so they are not garbage collected
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _process_batch(self, images:list, futures:list):
+        """Processes a batch of images and resolves their futures."""
+        try:
+            results = await self._image_utils.processImages(images, executor=self._executor)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, result in zip(futures, results):
+            if not future.done():
+                future.set_result(result)
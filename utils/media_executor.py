@@ -0,0 +1,140 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from utils.metrics import METRICS
+import asyncio
+import time
+import os
+
+class MediaQueueFull(Exception):
+    """Raised when the media executor has no free slot for a new job."""
+
+class MediaJobTimeout(Exception):
+    """Raised when a media job takes longer than the configured timeout."""
+
+def default_capacity(thread_workers:int=None) -> int:
+    """Capacity of a MediaExecutor built with the default settings (MEDIA_MAX_PENDING),
+    known without starting (nor importing the media stack of) the executor."""
+    thread_workers = thread_workers or int(os.getenv('MEDIA_THREAD_WORKERS', os.cpu_count() or 1))
+    return int(os.getenv('MEDIA_MAX_PENDING', thread_workers * 4))
+
+class MediaExecutor:
+    """
+        Runs the CPU heavy media work (decoding, resampling, face detection) outside
+        of the asyncio event loop, so the bot keeps polling and replying while
+        big voice notes or photos are being processed.
+
+        Two pools are used:
+            - A thread pool for the work that releases the GIL (OpenCV, soxr, libsndfile).
+            - A process pool for the pure Python / GIL bound work (e.g. librosa decoding).
+    """
+    def __init__(self, thread_workers:int=None, process_workers:int=None,
+                 max_pending:int=None, queue_timeout:float=None, job_timeout:float=None,
+                 thread_initializer=None):
+        cpu_count = os.cpu_count() or 1
+        self._thread_workers = thread_workers or int(os.getenv('MEDIA_THREAD_WORKERS', cpu_count))
+        self._process_workers = process_workers or int(os.getenv('MEDIA_PROCESS_WORKERS', max(1, cpu_count // 2)))
+        # Max number of jobs waiting or running at the same time (queue depth)
+        self._max_pending = max_pending or default_capacity(self._thread_workers)
+        # Seconds a new job can wait for a free slot before being rejected (backpressure)
+        self._queue_timeout = queue_timeout if queue_timeout is not None else float(os.getenv('MEDIA_QUEUE_TIMEOUT', 5))
+        # Seconds a single job can run before the caller gives up on it
+        self._job_timeout = job_timeout if job_timeout is not None else float(os.getenv('MEDIA_JOB_TIMEOUT', 60))
+        # Called once in every new worker thread (e.g. to load its own face detector)
+        self._thread_initializer = thread_initializer
+
+        self._thread_pool = None
+        self._process_pool = None
+        self._slots = None
+        self._pending = 0
+
+    # =========================================================================================== LIFE CYCLE
+    def start(self):
+        """Create the worker pools. Must be called from the running event loop."""
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(
+                max_workers=self._thread_workers, 
+                thread_name_prefix='media',
+                initializer=self._thread_initializer
+            )
+        if self._process_pool is None and self._process_workers > 0:
+            self._process_pool = ProcessPoolExecutor(max_workers=self._process_workers)
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._max_pending)
+
+    def shutdown(self, wait:bool=True):
+        """Stop the worker pools, waiting for the running jobs if `wait` is True."""
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=wait, cancel_futures=not wait)
+            self._thread_pool = None
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=wait, cancel_futures=not wait)
+            self._process_pool = None
+
+    @property
+    def pending(self) -> int:
+        """Number of jobs currently waiting or running in the pools."""
+        return self._pending
+
+    @property
+    def thread_workers(self) -> int:
+        """Number of threads of the thread pool."""
+        return self._thread_workers
+
+    @property
+    def capacity(self) -> int:
+        """Max number of jobs that can be waiting or running at the same time."""
+        return self._max_pending
+
+    # =========================================================================================== SUBMIT
+    async def run_in_thread(self, func, *args, timeout:float=None):
+        """Run `func(*args)` in the thread pool. See `submit`."""
+        return await self.submit('thread', func, *args, timeout=timeout)
+
+    async def run_in_process(self, func, *args, timeout:float=None):
+        """Run `func(*args)` in the process pool, or in the thread pool if there
+        are no process workers configured. See `submit`.
+
+        NOTE: `func` and its arguments must be picklable (module level functions).
+        """
+        return await self.submit('process', func, *args, timeout=timeout)
+
+    async def submit(self, kind:str, func, *args, timeout:float=None):
+        """Run `func(*args)` in the given pool, bounded by the executor queue depth.
+
+        Args:
+            kind (str): Pool where the job will be run, 'thread' or 'process'.
+            func (callable): Function to run.
+            timeout (float, optional): Job timeout in seconds. Defaults to the executor one.
+
+        Raises:
+            MediaQueueFull: If there is no free slot for the job after `queue_timeout` seconds.
+            MediaJobTimeout: If the job does not finish in `timeout` seconds.
+
+        Returns:
+            The `func` returned value.
+        """
+        if self._thread_pool is None:
+            self.start()
+        pool = self._thread_pool
+        if kind == 'process' and self._process_pool is not None:
+            pool = self._process_pool
+        queued = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self._queue_timeout)
+        except asyncio.TimeoutError:
+            METRICS.inc('media_jobs_rejected_total', pool=kind, reason='queue_full')
+            raise MediaQueueFull(f'Media queue is full ({self._max_pending} pending jobs)')
+        METRICS.observe('media_queue_wait_seconds', time.perf_counter() - queued, pool=kind)
+
+        self._pending += 1
+        try:
+            future = asyncio.get_running_loop().run_in_executor(pool, func, *args)
+            try:
+                return await asyncio.wait_for(future, timeout=timeout or self._job_timeout)
+            except asyncio.TimeoutError:
+                # NOTE: The worker can not be interrupted, it will finish on its own
+                # but the caller (and the slot) are released right now.
+                METRICS.inc('media_jobs_rejected_total', pool=kind, reason='timeout')
+                raise MediaJobTimeout(f'Media job {getattr(func, "__name__", func)} timed out')
+        finally:
+            self._pending -= 1
+            self._slots.release()
@@ -0,0 +1,319 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from utils.file_utils import write_file_atomic
+from contextlib import contextmanager
+from contextvars import ContextVar
+import functools
+import threading
+import json
+import time
+import os
+
+# Histogram upper bounds, in seconds (from a fast DB insert to a long audio resampling)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Histogram:
+    """Cumulative histogram of observed durations (Prometheus style buckets)."""
+    def __init__(self, buckets:tuple=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value:float):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def quantile(self, q:float) -> float:
+        """Approximated quantile: the upper bound of the bucket where it falls."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        for bound, count in zip(self.buckets, self.counts):
+            if count >= rank:
+                return bound
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'avg': round(self.sum / self.count, 6) if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'max': round(self.max, 6),
+        }
+
+class Trace:
+    """Stage timings of a single update (e.g. download -> detect -> reply), see `Metrics.trace`."""
+    def __init__(self, media:str):
+        self.media = media
+        self.stages = []
+
+# Trace of the update being handled, the stages timed in its task are added to it
+_current_trace = ContextVar('metrics_trace', default=None)
+
+class Metrics:
+    """
+        In-memory registry of the bot metrics: counters, gauges and duration histograms,
+        identified by a name and some labels (e.g. stage='download', media='image').
+
+        It's thread safe, so the media workers and the DB writer thread can record
+        metrics too. See `MetricsExporter` to publish them.
+    """
+    def __init__(self, buckets:tuple=DEFAULT_BUCKETS, slow_update_ms:float=None):
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._gauge_callbacks = {}
+        self._histograms = {}
+        # Updates slower than this are printed with their stage breakdown (0 = never)
+        self._slow_update = (slow_update_ms if slow_update_ms is not None else float(os.getenv('METRICS_SLOW_UPDATE_MS', 0))) / 1000
+
+    @staticmethod
+    def _key(name:str, labels:dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    # =========================================================================================== RECORD
+    def inc(self, name:str, value:float=1, **labels):
+        """Increments a counter."""
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name:str, value:float, **labels):
+        """Sets a gauge to the given value."""
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def gauge(self, name:str, func, **labels):
+        """Registers a gauge whose value is read from `func()` when the metrics are collected
+        (e.g. the media queue depth)."""
+        with self._lock:
+            self._gauge_callbacks[self._key(name, labels)] = func
+
+    def observe(self, name:str, value:float, **labels):
+        """Adds a value (seconds) to a histogram."""
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self._buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, stage:str, **labels):
+        """Times the wrapped block as a pipeline stage.
+
+            with METRICS.timer('decode', media='image'):
+                gray_img = cv2.imdecode(...)
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe('stage_duration_seconds', elapsed, stage=stage, **labels)
+            trace = _current_trace.get()
+            if trace is not None:
+                trace.stages.append((stage, elapsed))
+
+    @contextmanager
+    def trace(self, media:str):
+        """Traces a whole update: its total time, and the stages timed (`timer`) while 
+        handling it, which are printed if the update is slow (env METRICS_SLOW_UPDATE_MS).
+
+        NOTE: The stages timed inside the worker threads are not part of the trace 
+        (they can be shared by several updates, e.g. a face detection batch).
+        """
+        trace = Trace(media)
+        token = _current_trace.set(trace)
+        start = time.perf_counter()
+        try:
+            yield trace
+        finally:
+            elapsed = time.perf_counter() - start
+            _current_trace.reset(token)
+            self.observe('update_duration_seconds', elapsed, media=media)
+            if self._slow_update and elapsed >= self._slow_update:
+                # Log: Slow update, to know which stage dominates
+                stages = ', '.join(f'{name}={seconds * 1000:.1f}ms' for name, seconds in trace.stages)
+                print(f'Slow {media} update ({elapsed * 1000:.1f}ms): {stages}')
+
+    def traced(self, media:str):
+        """Decorator version of `trace`, for the async bot handlers."""
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.trace(media):
+                    return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        """Removes all the recorded values (the gauge callbacks are kept)."""
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    # =========================================================================================== COLLECT
+    def _collect_gauges(self) -> dict:
+        with self._lock:
+            gauges = dict(self._gauges)
+            callbacks = dict(self._gauge_callbacks)
+        for key, func in callbacks.items():
+            try:
+                gauges[key] = func()
+            except Exception as e:
+                # Log: The gauge source is not available (e.g. during the shutdown)
+                print(f'Error reading gauge {key[0]}: {e}')
+        return gauges
+
+    def snapshot(self) -> dict:
+        """All the metrics as a JSON serializable dict.
+
+        Returns:
+            dict: {'counters': [...], 'gauges': [...], 'histograms': [...]}, every entry
+                with its name, labels and value(s).
+        """
+        gauges = self._collect_gauges()
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: histogram.to_dict() for key, histogram in self._histograms.items()}
+        entry = lambda key, **values: dict(name=key[0], labels=dict(key[1]), **values)
+        return {
+            'timestamp': time.time(),
+            'counters': [entry(key, value=value) for key, value in sorted(counters.items())],
+            'gauges': [entry(key, value=value) for key, value in sorted(gauges.items())],
+            'histograms': [entry(key, **values) for key, values in sorted(histograms.items())],
+        }
+
+    def render_prometheus(self, prefix:str='bot_') -> str:
+        """All the metrics in the Prometheus text exposition format."""
+        def labels_text(labels:tuple, extra:tuple=()) -> str:
+            items = [f'{k}="{v}"' for k, v in labels + extra]
+            return '{' + ','.join(items) + '}' if items else ''
+
+        gauges = self._collect_gauges()
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (h.buckets, list(h.counts), h.count, h.sum)) for key, h in self._histograms.items())
+
+        lines, typed = [], set()
+        def type_line(name:str, kind:str):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in counters:
+            type_line(f'{prefix}{name}', 'counter')
+            lines.append(f'{prefix}{name}{labels_text(labels)} {value}')
+        for (name, labels), value in sorted(gauges.items()):
+            type_line(f'{prefix}{name}', 'gauge')
+            lines.append(f'{prefix}{name}{labels_text(labels)} {value}')
+        for (name, labels), (buckets, counts, count, total) in histograms:
+            metric = f'{prefix}{name}'
+            type_line(metric, 'histogram')
+            for bound, bucket_count in zip(buckets, counts):
+                lines.append(f'{metric}_bucket{labels_text(labels, (("le", bound),))} {bucket_count}')
+            lines.append(f'{metric}_bucket{labels_text(labels, (("le", "+Inf"),))} {count}')
+            lines.append(f'{metric}_sum{labels_text(labels)} {total}')
+            lines.append(f'{metric}_count{labels_text(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+# Process wide registry, shared by the handlers, the media utils and the DB handler
+METRICS = Metrics()
+
+class MetricsExporter:
+    """
+        Publishes the metrics while the bot is running:
+            - A Prometheus style text endpoint (`GET /metrics`, also `GET /metrics.json`),
+              if `port` (env METRICS_PORT) is set.
+            - A periodic JSON dump into `dump_path` (env METRICS_DUMP_PATH), every
+              `dump_interval` seconds (env METRICS_DUMP_INTERVAL, default 60).
+        Both run in background threads, out of the event loop.
+    """
+    def __init__(self, metrics:Metrics=None, host:str=None, port:int=None, dump_path:str=None, dump_interval:float=None):
+        self._metrics = metrics or METRICS
+        self._host = host or os.getenv('METRICS_HOST', '127.0.0.1')
+        self._port = port if port is not None else int(os.getenv('METRICS_PORT', 0))
+        self._dump_path = dump_path or os.getenv('METRICS_DUMP_PATH')
+        self._dump_interval = dump_interval or float(os.getenv('METRICS_DUMP_INTERVAL', 60))
+        self._server = None
+        self._threads = []
+        self._stop = threading.Event()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._port or self._dump_path)
+
+    @property
+    def address(self) -> tuple:
+        """(host, port) of the HTTP endpoint, None if it's not running."""
+        return self._server.server_address[:2] if self._server is not None else None
+
+    # =========================================================================================== LIFE CYCLE
+    def start(self):
+        if self._port and self._server is None:
+            self._server = ThreadingHTTPServer((self._host, self._port), self._handler_class())
+            self._server.daemon_threads = True
+            self._start_thread(self._server.serve_forever)
+            print(f'Metrics available at http://{self._host}:{self.address[1]}/metrics')
+        if self._dump_path:
+            self._start_thread(self._dump_loop)
+
+    def stop(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        # Last dump, with the final values
+        if self._dump_path:
+            self.dump()
+
+    def _start_thread(self, target):
+        thread = threading.Thread(target=target, name='metrics', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    # =========================================================================================== EXPORT
+    def dump(self) -> bool:
+        """Writes the current metrics snapshot into the dump file."""
+        data = json.dumps(self._metrics.snapshot(), indent=2).encode()
+        return write_file_atomic(self._dump_path, data)
+
+    def _dump_loop(self):
+        while not self._stop.wait(self._dump_interval):
+            self.dump()
+
+    def _handler_class(self):
+        metrics = self._metrics
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = metrics.render_prometheus().encode(), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, content_type = json.dumps(metrics.snapshot()).encode(), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        return Handler
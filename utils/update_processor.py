@@ -0,0 +1,59 @@
+from telegram.ext import BaseUpdateProcessor
+import asyncio
+import os
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+        Processes the updates of different users concurrently, while the updates 
+        of the same user are processed one after the other, in the order they 
+        arrived (e.g. so the user's audio_message_N numbering stays sequential).
+
+        NOTE: `process_update` (final in PTB) holds its semaphore while waiting for the
+        user's turn, so it's sized with `max_pending` (updates queued in memory), and 
+        the real concurrency limit (`max_concurrent_updates`) is applied once it's
+        the user's turn, so a single user can't take all the processing slots.
+    """
+    def __init__(self, max_concurrent_updates:int=None, max_pending:int=None):
+        max_concurrent_updates = max_concurrent_updates or int(os.getenv('BOT_CONCURRENT_UPDATES', 16))
+        super().__init__(max_pending or int(os.getenv('BOT_MAX_PENDING_UPDATES', max_concurrent_updates * 64)))
+        self._workers_limit = max_concurrent_updates
+        self._workers = None
+        # user id -> [lock, number of updates using it]
+        self._user_locks = {}
+
+    async def initialize(self) -> None:
+        self._workers = asyncio.Semaphore(self._workers_limit)
+
+    async def shutdown(self) -> None:
+        self._user_locks.clear()
+
+    def _user_key(self, update:object):
+        """Key used to serialize the updates, None if the update has no user/chat."""
+        user = getattr(update, 'effective_user', None)
+        if user is not None:
+            return user.id
+        chat = getattr(update, 'effective_chat', None)
+        return chat.id if chat is not None else None
+
+    async def do_process_update(self, update:object, coroutine) -> None:
+        if self._workers is None:
+            await self.initialize()
+        key = self._user_key(update)
+        if key is None:
+            async with self._workers:
+                await coroutine
+            return
+
+        entry = self._user_locks.get(key)
+        if entry is None:
+            entry = self._user_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock is FIFO, so the user's updates keep their order
+            async with entry[0]:
+                async with self._workers:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._user_locks[key]